@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 from django import forms
 from django.conf import settings
-from django.utils.html import escape, conditional_escape
+from django.forms.util import flatatt
+from django.utils.encoding import force_text
+from django.utils.html import escape, conditional_escape, format_html
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 from easy_thumbnails.files import get_thumbnailer
@@ -54,3 +56,46 @@ class AvatarWidget(forms.ClearableFileInput):
                 substitutions['clear_template'] = self.template_with_clear % substitutions
 
         return mark_safe(template % substitutions)
+
+
+class UserAutocompleteWidget(forms.TextInput):
+    """
+    Selects a user by primary key through an autocompletion input instead of
+    a select box listing all users. The JSON endpoint given as source is
+    queried with the GET parameters "term" and "page" and has to return an
+    object with the matching users as "results" (each with a "value" and a
+    "label") and a flag "more" if there is another page.
+
+    Only the currently selected user is loaded to show its name.
+    """
+
+    def __init__(self, source, attrs=None):
+        super(UserAutocompleteWidget, self).__init__(attrs)
+        self.source = source
+
+    def get_label(self, value):
+        from django.contrib.auth.models import User
+        from .utils import get_full_name
+        if value in (None, ''):
+            return ''
+        if not isinstance(value, User):
+            try:
+                value = User.objects.select_related('profile').get(pk=value)
+            except (User.DoesNotExist, ValueError):
+                return ''
+        return get_full_name(value)
+
+    def render(self, name, value, attrs=None):
+        if hasattr(value, 'pk'):
+            value = value.pk
+        hidden = forms.HiddenInput(self.attrs).render(name, value, attrs)
+        final_attrs = {
+            'type': 'text',
+            'value': self.get_label(value),
+            'data-source': force_text(self.source),
+            'class': 'user-autocomplete-input',
+        }
+        if attrs and 'id' in attrs:
+            final_attrs['id'] = '%s_label' % attrs['id']
+        return format_html('<span class="user-autocomplete">{0}<input{1} /></span>',
+                           hidden, flatatt(final_attrs))
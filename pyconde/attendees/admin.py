@@ -3,12 +3,12 @@ from __future__ import unicode_literals
 
 import datetime
 
-from django.conf import settings
+from django.conf.urls import patterns, url
 from django.contrib import admin
-from django.http import HttpResponse
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.translation import ugettext, ugettext_lazy as _
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.template.response import TemplateResponse
+from django.utils.translation import ugettext, ungettext, ugettext_lazy as _
 from django.utils.timezone import now
 
 from . import settings as app_settings
@@ -32,8 +32,8 @@ def export_badges(modeladmin, request, queryset):
 
 class TicketTypeAdmin(admin.ModelAdmin):
     list_display = ('product_number', '__unicode__', 'conference',
-                    'fee', 'is_active', 'tutorial_ticket', 'purchases_count',
-                    'max_purchases', 'date_valid_from', 'date_valid_to')
+                    'fee', 'is_active', 'tutorial_ticket', 'sold_count',
+                    'reserved_count', 'max_purchases', 'date_valid_from', 'date_valid_to')
     list_display_links = ('product_number', '__unicode__')
     list_filter = ('is_active', 'conference')
 
@@ -94,17 +94,53 @@ class PurchaseAdmin(admin.ModelAdmin):
                'send_invoice_to_myself', 'send_invoice_to_customer',
                'send_payment_reminder', 'send_purchase_canceled',)
 
+    # Jobs started by the admin actions whose progress can be displayed.
+    jobs = {
+        'export': utils.InvoiceExport,
+        'mailing': utils.PaymentMailing,
+    }
+
+    def get_urls(self):
+        urls = super(PurchaseAdmin, self).get_urls()
+        return patterns('',
+            url(r'^(?P<job_type>export|mailing)/(?P<job_id>[0-9a-f]+)/$',
+                self.admin_site.admin_view(self.job_progress_view),
+                name='attendees_purchase_job_progress'),
+        ) + urls
+
+    def job_progress_view(self, request, job_type, job_id):
+        job = self.jobs[job_type](job_id)
+        progress = job.get_progress()
+        if progress is None:
+            raise Http404()
+        return TemplateResponse(request,
+            'admin/attendees/purchase/job_progress.html', {
+                'title': job.title,
+                'opts': self.model._meta,
+                'progress': progress,
+                'counters': [(label, progress[name])
+                             for name, label in job.counters],
+            }, current_app=self.admin_site.name)
+
+    def redirect_to_job(self, job_type, job):
+        return HttpResponseRedirect(reverse(
+            'admin:attendees_purchase_job_progress',
+            args=[job_type, job.job_id]))
+
     def export_and_send_invoices(self, request, queryset):
-        for purchase in queryset:
-            if not purchase.exported:
-                tasks.render_invoice.delay(purchase.pk)
-            else:
-                self.message_user(request,
-                    _('Purchase %(invoice_number)s has already been exported. '
-                      'Use “Send me a copy of the invoice” or “Send customer '
-                      'a copy of the invoice” to mail the invoice.') % {
-                        'invoice_number': purchase.full_invoice_number,
-                    })
+        exported = queryset.filter(exported=True).count()
+        if exported:
+            self.message_user(request, ungettext(
+                '%(count)d purchase has already been exported. Use “Send me '
+                'a copy of the invoice” or “Send customer a copy of the '
+                'invoice” to mail the invoice.',
+                '%(count)d purchases have already been exported. Use “Send '
+                'me a copy of the invoice” or “Send customer a copy of the '
+                'invoice” to mail the invoices.',
+                exported) % {'count': exported})
+        export = utils.InvoiceExport.start(queryset)
+        if export is not None:
+            return self.redirect_to_job('export', export)
     export_and_send_invoices.short_description = _('Export invoice and send')
 
     def send_invoice_to_myself(self, request, queryset):
@@ -135,30 +171,12 @@ class PurchaseAdmin(admin.ModelAdmin):
     send_invoice_to_customer.short_description = _('Send customer a copy of the invoice')
 
     def send_payment_confirmation(self, request, queryset):
-        sent = 0
-        for purchase in queryset.filter(
-                state__in=('invoice_created', 'payment_received')):
-
-            send_mail(ugettext('Payment receipt confirmation'),
-                render_to_string('attendees/mail_payment_received.txt', {
-                    'purchase': purchase,
-                    'conference': purchase.conference
-                }),
-                settings.DEFAULT_FROM_EMAIL,
-                [purchase.email_receiver, settings.DEFAULT_FROM_EMAIL],
-                fail_silently=True
-            )
-            if purchase.state == 'invoice_created':
-                purchase.state = 'payment_received'
-                purchase.save()
-            sent += 1
-
-        if sent == 1:
-            message_bit = _('1 mail was')
-        else:
-            message_bit = _('%s mails were') % sent
-
-        self.message_user(request, ugettext('%s successfully sent.') % message_bit)
+        mailing = utils.PaymentMailing.start('confirmation', queryset.filter(
+            state__in=('invoice_created', 'payment_received')))
+        if mailing is None:
+            self.message_user(request, ugettext('No mails were sent.'))
+            return
+        return self.redirect_to_job('mailing', mailing)
     send_payment_confirmation.short_description = _(
         'Send payment confirmation for selected %(verbose_name_plural)s')
 
@@ -174,28 +192,24 @@ class PurchaseAdmin(admin.ModelAdmin):
             if due_date > latest_due_date:
                 due_date = latest_due_date
 
-        for purchase in queryset.filter(state='invoice_created'):
-            send_mail(ugettext('%(conference)s payment reminder' % {
-                    'conference': purchase.conference.title,
-                }),
-                render_to_string('attendees/mail_payment_pending.txt', {
-                    'purchase': purchase,
-                    'conference': purchase.conference,
-                    'due_date': due_date
-                }),
-                settings.DEFAULT_FROM_EMAIL,
-                (purchase.email_receiver, request.user.email,),
-                fail_silently=True
-            )
-            if purchase.exported:
-                tasks.send_invoice.delay(purchase.pk, (purchase.email_receiver,))
-            else:
-                self.message_user(request,
-                    _('Purchase %(invoice_number)s has not been exported yet. '
-                      'Use “Export invoice and send” to export the invoice '
-                      'and send it to the customer.') % {
-                        'invoice_number': purchase.full_invoice_number,
-                    })
+        queryset = queryset.filter(state='invoice_created')
+        not_exported = queryset.filter(exported=False).count()
+        if not_exported:
+            self.message_user(request, ungettext(
+                '%(count)d purchase has not been exported yet. Use “Export '
+                'invoice and send” to export the invoice and send it to the '
+                'customer.',
+                '%(count)d purchases have not been exported yet. Use “Export '
+                'invoice and send” to export the invoices and send them to '
+                'the customers.',
+                not_exported) % {'count': not_exported})
+        mailing = utils.PaymentMailing.start('reminder', queryset,
+                                             due_date=due_date,
+                                             cc=request.user.email)
+        if mailing is None:
+            self.message_user(request, ugettext('No mails were sent.'))
+            return
+        return self.redirect_to_job('mailing', mailing)
 
     send_payment_reminder.short_description = _(
         'Send payment reminders for selected %(verbose_name_plural)s')
@@ -3,7 +3,10 @@ from __future__ import unicode_literals
 
 import logging
 
+from itertools import chain
+
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 
 from dateutil.rrule import DAILY, rrule
@@ -95,21 +98,84 @@ class BadgeExporter(object):
         data = self.export()
         return json.dumps(data, indent=self.indent)
 
+    def write_json(self, fp):
+        """
+        Writes the badges as JSON list to the given file-like object badge
+        by badge instead of building the whole list in memory first.
+        """
+        import json
+        fp.write('[')
+        for idx, badge in enumerate(self.iter_export()):
+            if idx:
+                fp.write(',')
+            fp.write(json.dumps(badge, indent=self.indent))
+        fp.write(']')
+
     def export(self):
         if getattr(self, '_data', None) is None:
-            self._data = self._export(self.tickets)
+            self._data = list(self.iter_export())
         return self._data
 
+    def iter_export(self):
+        return self._export(self.tickets)
+
+    def _get_speaker_involvements(self):
+        """
+        Returns a mapping from user ids to the kinds of sessions the user
+        speaks at.
+        """
+        from collections import defaultdict
+        from ..schedule.models import Session
+
+        involvements = defaultdict(set)
+        rows = chain(
+            Session.objects.values_list('speaker__user_id', 'kind__slug'),
+            Session.additional_speakers.through.objects.values_list(
+                'speaker__user_id', 'session__kind__slug'))
+        for user_id, kind in rows:
+            if kind is not None:
+                involvements[user_id].add(kind)
+        return involvements
+
+    def _get_profile_data(self, tickets):
+        """
+        Returns mappings from profile ids to the badge status slugs, the tags
+        and the ids of the attended trainings of all profiles of the ticket
+        owners.
+        """
+        from collections import defaultdict
+        from ..accounts.models import Profile
+
+        profiles = Profile.objects.filter(
+            user__in=tickets.values('user')).values('pk')
+        status = defaultdict(set)
+        for profile_id, slug in Profile.badge_status.through.objects\
+                .filter(profile__in=profiles)\
+                .values_list('profile_id', 'badgestatus__slug'):
+            status[profile_id].add(slug)
+        tags = defaultdict(list)
+        for profile_id, name in Profile.tags.through.objects\
+                .filter(content_type=ContentType.objects.get_for_model(Profile),
+                        object_id__in=profiles)\
+                .values_list('object_id', 'tag__name'):
+            tags[profile_id].append(name)
+        trainings = defaultdict(list)
+        for profile_id, session_id in Profile.sessions_attending.through.objects\
+                .filter(profile__in=profiles, session__kind__slug='training')\
+                .values_list('profile_id', 'session_id'):
+            trainings[profile_id].append(session_id)
+        return status, tags, trainings
+
     def _export(self, tickets):
+        """
+        Yields the badge data of all paid venue tickets. The number of
+        queries doesn't depend on the number of tickets.
+        """
         from collections import defaultdict
         from .models import VenueTicket
         from ..schedule.models import Session
 
-        result = []
-        sessions = Session.objects.select_related('speaker_id', 'kind') \
-                                  .prefetch_related('additional_speakers') \
-                                  .all()
-        speaker_involvements = defaultdict(set)
+        speaker_involvements = self._get_speaker_involvements()
         all_trainings = Session.objects.order_by('start', 'location__order') \
                                        .filter(released=True,
                                                kind__slug='training') \
@@ -119,22 +185,22 @@ class BadgeExporter(object):
             for idx, (pk, start)
             in enumerate(all_trainings, 1)
         }
-        for session in sessions:
-            speaker_involvements[session.speaker_id].add(session.kind.slug)
-            for add_s in session.additional_speakers.all():
-                speaker_involvements[add_s.id].add(session.kind.slug)
+        conference = current_conference()
+        conference_days = [
+            d.date().isoformat() for d in rrule(DAILY,
+                                                dtstart=conference.start_date,
+                                                until=conference.end_date)
+        ] if conference is not None and conference.start_date else None
+        profile_status, profile_tags, profile_trainings = \
+            self._get_profile_data(tickets)
 
         for ticket in tickets.select_related('purchase',
-                                             'sponsor',
-                                             'user__profile__sponsor__level',
-                                             'user__speaker_profile',
+                                             'sponsor__level',
+                                             'user__profile',
                                              'shirtsize',
                                              'ticket_type') \
-                             .prefetch_related('user__profile__tags',
-                                               'user__profile__badge_status',
-                                               'user__profile__sessions_attending') \
                              .order_by('last_name',
-                                       'first_name'):
+                                       'first_name').iterator():
             if not isinstance(ticket, VenueTicket):
                 LOG.warn('Ticket %d is of type %s. Skipping' % (
                     ticket.pk, ticket.__class__.__name__))
@@ -159,14 +225,10 @@ class BadgeExporter(object):
                 'status': None,  # set below
                 'trainings': None,
             }
-            days = None
             if ticket.ticket_type.valid_on:
-                days = [ticket.ticket_type.valid_on.isoformat()]
+                badge['days'] = [ticket.ticket_type.valid_on.isoformat()]
             else:
-                dtstart = current_conference().start_date
-                until = current_conference().end_date
-                days = [d.date().isoformat() for d in rrule(DAILY, dtstart=dtstart, until=until)]
-            badge['days'] = days
+                badge['days'] = conference_days
             status_keys = set()
             if ticket.sponsor_id and ticket.sponsor.active:
                 sponsor = ticket.sponsor
@@ -178,34 +240,34 @@ class BadgeExporter(object):
                 status_keys.add('sponsor')
 
             if profile:
-                status_keys |= set(profile.badge_status.values_list('slug', flat=True).all())
+                status_keys |= profile_status[profile.pk]
 
-                speaker = user.speaker_profile
-                if 'talk' in speaker_involvements[speaker.id]:
+                involvements = speaker_involvements[user.id]
+                if 'talk' in involvements:
                     status_keys.add('speaker')
-                if 'training' in speaker_involvements[speaker.id]:
+                if 'training' in involvements:
                     status_keys.add('trainer')
-                if 'keynote' in speaker_involvements[speaker.id]:
+                if 'keynote' in involvements:
                     status_keys.add('keynote')
 
-                tags = [t.name for t in profile.tags.all()]
+                tags = profile_tags[profile.pk]
                 if tags:
                     badge['tags'] = tags
 
-                trainings = profile.sessions_attending\
-                        .filter(kind__slug='training').all()
-                if trainings:
-                    attendings = defaultdict(list)
-                    for t in trainings:
-                        index, start = trainings_pk_index[t.id]
+                attendings = defaultdict(list)
+                for session_id in profile_trainings[profile.pk]:
+                    if session_id in trainings_pk_index:
+                        index, start = trainings_pk_index[session_id]
                         attendings[start].append(index)
+                if attendings:
+                    for indexes in attendings.values():
+                        indexes.sort()
                     badge['trainings'] = attendings
 
             if status_keys:
                 badge['status'] = list(status_keys)
 
-            result.append(badge)
-        return result
+            yield badge
 
     def _user_url(self, user):
         if user:
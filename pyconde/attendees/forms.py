@@ -86,10 +86,10 @@ class TicketQuantityForm(forms.Form):
         max_value = self.fields['quantity'].max_value
 
         if value > 0 and available is not None:
-            if self.ticket_type.available_tickets < 1:
+            if available < 1:
                 raise forms.ValidationError(_('Tickets sold out.'))
 
-            if value > self.ticket_type.available_tickets:
+            if value > available:
                 raise forms.ValidationError(_('Not enough tickets left.'))
 
         if max_value is not None and value > max_value:
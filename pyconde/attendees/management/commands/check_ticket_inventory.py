@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+from django.core.management.base import BaseCommand, make_option
+
+from ... import models
+
+
+class Command(BaseCommand):
+    help = ('Checks that the inventory counters of every ticket type match'
+            ' the tickets of completed purchases and the reservations. Meant'
+            ' to be run periodically.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--fix', action='store_true', dest='fix', default=False,
+                    help='Update inconsistent counters'),
+    )
+
+    def handle(self, *args, **options):
+        inconsistent = models.TicketType.objects.rebuild_inventory(
+            fix=options['fix'])
+        for ticket_type in models.TicketType.objects.filter(pk__in=inconsistent):
+            print("Inconsistent inventory counters:", ticket_type)
+        if inconsistent and options['fix']:
+            print("Fixed {0} ticket type(s)".format(len(inconsistent)))
@@ -38,4 +38,4 @@ class Command(BaseCommand):
             qs = qs.exclude(ticket_type_id__in=excluded_tt_ids)
         exporter = BadgeExporter(qs, base_url=options['base_url'],
             indent=options['indent'])
-        self.stdout.write(exporter.json)
+        exporter.write_json(self.stdout)
@@ -21,6 +21,9 @@ class Command(BaseCommand):
     )
 
     def handle(self, *args, **options):
+        # Reservations are usually released once they expire but that might
+        # not have happened if no worker was running at that time.
+        models.TicketReservation.objects.release_expired()
         print("Purging orders older than {0} day(s):".format(options['days']))
         date = now() - timedelta(days=options['days'])
         for purchase in models.Purchase.objects.filter(
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import collections
 import decimal
+import logging
 import uuid
 import os
 import string
@@ -10,16 +12,20 @@ from email.utils import formataddr
 from django.contrib.auth.models import User
 from django.contrib.contenttypes import models as content_models
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Q, signals
 from django.utils.encoding import force_text
 from django.utils.timezone import now
 from django.utils.translation import ugettext, ugettext_lazy as _
 
 from . import settings
+from .exceptions import TicketNotAvailable
 from .validators import during_conference
 
 
+LOG = logging.getLogger(__name__)
+
+
 PURCHASE_STATES = (
     ('incomplete', _('Purchase incomplete')),
     ('new', _('new')),
@@ -108,6 +114,69 @@ class Voucher(models.Model):
 
 class TicketTypeManager(models.Manager):
 
+    def reserve(self, quantities):
+        """
+        Reserves tickets of several ticket types given as a dict mapping
+        ticket type ids to quantities. The ticket types are locked while
+        their availability is checked so that concurrent checkouts cannot
+        oversell them. Raises TicketNotAvailable if there are not enough
+        tickets left of one of them.
+
+        This has to be called within a transaction that is rolled back in
+        that case, see TicketReservationManager.reserve().
+        """
+        # Always lock in the same order to prevent deadlocks.
+        for ticket_type in self.select_for_update()\
+                .filter(pk__in=quantities.keys()).order_by('pk'):
+            available = ticket_type.available_tickets
+            if available is not None and available < quantities[ticket_type.pk]:
+                raise TicketNotAvailable(ticket_type)
+        for ticket_type_id, quantity in quantities.items():
+            self.filter(pk=ticket_type_id).update(
+                reserved_count=models.F('reserved_count') + quantity)
+
+    def release(self, ticket_type_id, quantity):
+        """
+        Releases tickets reserved with reserve(). Once a purchase is
+        completed its tickets are counted as sold by the signal handlers
+        below, so this is also used to commit a reservation.
+        """
+        if not self.filter(pk=ticket_type_id, reserved_count__gte=quantity)\
+                .update(reserved_count=models.F('reserved_count') - quantity):
+            # The counter has drifted from the reservations (see the
+            # check_ticket_inventory command).
+            reserved = list(self.filter(pk=ticket_type_id)
+                            .values_list('reserved_count', flat=True))
+            LOG.warning('Releasing %d tickets of ticket type %s but only %s '
+                        'are reserved, resetting the counter to 0', quantity,
+                        ticket_type_id, reserved[0] if reserved else None)
+            self.filter(pk=ticket_type_id).update(reserved_count=0)
+
+    def rebuild_inventory(self, fix=True):
+        """
+        Compares the inventory counters of all ticket types with the actual
+        number of tickets in completed purchases and reservations and
+        returns the ids of all ticket types where these differ. If fix is
+        True, the counters are updated.
+        """
+        sold = dict(Ticket.objects.exclude(purchase__state='incomplete')
+                    .values_list('ticket_type').order_by()
+                    .annotate(num=models.Count('pk')))
+        reserved = dict(TicketReservation.objects
+                        .values_list('ticket_type').order_by()
+                        .annotate(num=models.Sum('quantity')))
+        inconsistent = []
+        for pk, sold_count, reserved_count in self.values_list(
+                'pk', 'sold_count', 'reserved_count'):
+            counts = {'sold_count': sold.get(pk, 0),
+                      'reserved_count': reserved.get(pk, 0)}
+            if counts != {'sold_count': sold_count,
+                          'reserved_count': reserved_count}:
+                inconsistent.append(pk)
+                if fix:
+                    self.filter(pk=pk).update(**counts)
+        return sorted(inconsistent)
+
     def available(self):
         return self.filter(date_valid_from__lte=now(),
                            date_valid_to__gte=now(), is_active=True)
@@ -144,6 +213,13 @@ class TicketType(models.Model):
         _('Max. purchases'),
         default=0, help_text=_('0 means no limit'))
 
+    # These counters are only changed atomically through the manager and the
+    # signal handlers at the end of this module and never by save().
+    sold_count = models.PositiveIntegerField(
+        _('Sold'), default=0, editable=False)
+    reserved_count = models.PositiveIntegerField(
+        _('Reserved'), default=0, editable=False)
+
     is_active = models.BooleanField(_('Is active'), default=False)
     is_on_desk_active = models.BooleanField(_('Allow on desk purchase'), default=False)
 
@@ -177,6 +253,8 @@ class TicketType(models.Model):
 
     objects = TicketTypeManager()
 
+    inventory_fields = ('sold_count', 'reserved_count')
+
     class Meta:
         ordering = ('tutorial_ticket', 'product_number', 'vouchertype_needed',)
         verbose_name = _('Ticket type')
@@ -204,17 +282,25 @@ class TicketType(models.Model):
     def available_tickets(self):
         """
         Returns a number of still purchasable tickets or None if there is no
-        limit.
+        limit. This is based on the inventory counters of this instance and
+        doesn't hit the database.
         """
         if self.max_purchases < 1:
             return None
         else:
-            available_tickets = self.max_purchases - self.purchases_count
+            available_tickets = (self.max_purchases - self.sold_count -
+                                 self.reserved_count)
             return available_tickets if available_tickets > 0 else 0
 
     def save(self, *args, **kwargs):
         if not self.pk:
             self.product_number = TicketType.objects.get_next_product_number()
+        elif not self._state.adding and 'update_fields' not in kwargs \
+                and not kwargs.get('force_insert'):
+            # Don't overwrite the inventory counters with stale values.
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.local_fields
+                if not f.primary_key and f.name not in self.inventory_fields]
         super(TicketType, self).save(*args, **kwargs)
 
     def clean(self):
@@ -233,6 +319,68 @@ class TicketType(models.Model):
         return val
 
 
+class TicketReservationManager(models.Manager):
+
+    def reserve(self, key, quantities, expires):
+        """
+        Reserves the given quantities of tickets (a dict mapping ticket type
+        ids to quantities) until the given date. Either all or none of them
+        are reserved. Raises TicketNotAvailable if there are not enough
+        tickets left.
+        """
+        self.release_expired()
+        with transaction.commit_on_success():
+            TicketType.objects.reserve(quantities)
+            self.bulk_create([
+                TicketReservation(key=key, ticket_type_id=ticket_type_id,
+                                  quantity=quantity, expires=expires)
+                for ticket_type_id, quantity in quantities.items()])
+
+    def release(self, key):
+        """
+        Releases all tickets reserved with the given key.
+        """
+        self._release(self.filter(key=key))
+
+    def release_expired(self):
+        self._release(self.filter(expires__lt=now()))
+
+    def _release(self, reservations):
+        with transaction.commit_on_success():
+            # Locking the reservations ensures that they are only released
+            # once even if this runs concurrently. The ticket types are
+            # updated in the same order as TicketTypeManager.reserve() locks
+            # them to prevent deadlocks.
+            released = list(reservations.select_for_update()
+                            .order_by('ticket_type', 'pk'))
+            for reservation in released:
+                TicketType.objects.release(reservation.ticket_type_id,
+                                           reservation.quantity)
+            if released:
+                self.filter(pk__in=[r.pk for r in released]).delete()
+
+
+class TicketReservation(models.Model):
+    """
+    Tickets of a limited ticket type that are held for a checkout until it
+    is either completed, aborted or expires.
+    """
+    key = models.CharField(_('Key'), max_length=32, db_index=True)
+    ticket_type = models.ForeignKey(TicketType, verbose_name=_('Ticket type'),
+                                    related_name='reservations')
+    quantity = models.PositiveIntegerField(_('Quantity'))
+    expires = models.DateTimeField(_('Expires'), db_index=True)
+
+    objects = TicketReservationManager()
+
+    class Meta:
+        verbose_name = _('Ticket reservation')
+        verbose_name_plural = _('Ticket reservations')
+
+    def __unicode__(self):
+        return '%d × %s' % (self.quantity, self.ticket_type)
+
+
 class PurchaseManager(models.Manager):
     def get_exportable_purchases(self):
         return self.filter(exported=False)
@@ -558,3 +706,134 @@ class SIMCardTicket(Ticket):
     def invoice_item_title(self):
         return force_text('1 SIM Card for:<br /><i>%s %s</i>' %
             (self.first_name, self.last_name))
+
+
+def _bulk_insert(model, objs, fields, using):
+    # QuerySet.bulk_create() refuses models with multi-table inheritance as
+    # it cannot retrieve the primary keys of the parent rows. We insert
+    # these separately and only the table of the subclass here.
+    ops = connections[using].ops
+    batch_size = max(ops.bulk_batch_size(fields, objs), 1)
+    for idx in range(0, len(objs), batch_size):
+        model._base_manager._insert(objs[idx:idx + batch_size], fields=fields,
+                                    using=using)
+
+
+def bulk_create_tickets(purchase, tickets):
+    """
+    Stores the given (unsaved) tickets of any ticket class including their
+    related data for the purchase with a constant number of queries. The
+    purchase must not have any other tickets yet.
+
+    Raises an ``IntegrityError`` and stores nothing if the purchase has any
+    other tickets, as the new tickets couldn't be told apart from them.
+    """
+    using = router.db_for_write(Ticket)
+    with transaction.commit_on_success(using=using):
+        _bulk_create_tickets(purchase, tickets, using)
+    return tickets
+
+
+def _bulk_create_tickets(purchase, tickets, using):
+    parent_fields = [f for f in Ticket._meta.local_fields if not f.primary_key]
+    parents = []
+    for ticket in tickets:
+        ticket.purchase = purchase
+        parents.append(Ticket(**dict((f.attname, getattr(ticket, f.attname))
+                                     for f in parent_fields)))
+    Ticket.objects.using(using).bulk_create(parents)
+    # The parent rows are inserted in order, so their primary keys are
+    # ascending in the same order as the tickets. This only holds as long
+    # as nobody else added a ticket to the purchase in the meantime.
+    pks = list(Ticket.objects.using(using).filter(purchase=purchase)
+               .order_by('pk').values_list('pk', flat=True))
+    if len(pks) != len(tickets):
+        raise IntegrityError(
+            "Purchase %s has %d tickets instead of the %d created ones" % (
+                purchase.pk, len(pks), len(tickets)))
+    children = {}
+    relations = {}
+    for ticket, pk in zip(tickets, pks):
+        ticket.id = ticket.pk = pk
+        ticket._state.adding = False
+        ticket._state.db = using
+        if ticket.__class__ is not Ticket:
+            children.setdefault(ticket.__class__, []).append(ticket)
+        for name, values in ticket.related_data.items():
+            field = ticket._meta.get_field(name)
+            through = relations.setdefault(field.rel.through, [])
+            for value in values:
+                through.append(field.rel.through(**{
+                    field.m2m_field_name(): ticket,
+                    field.m2m_reverse_field_name(): value}))
+    for ticket_cls, objs in children.items():
+        _bulk_insert(ticket_cls, objs, ticket_cls._meta.local_fields, using)
+    for through, objs in relations.items():
+        through.objects.using(using).bulk_create(objs)
+    # bulk_create() doesn't send any signals, so the tickets have to be
+    # counted here if they are sold already.
+    if purchase.state != 'incomplete':
+        quantities = collections.defaultdict(int)
+        for ticket in tickets:
+            quantities[ticket.ticket_type_id] += 1
+        for ticket_type_id, quantity in quantities.items():
+            _update_sold_count(ticket_type_id, quantity)
+
+
+def _update_sold_count(ticket_type_id, delta):
+    TicketType.objects.filter(pk=ticket_type_id).update(
+        sold_count=models.F('sold_count') + delta)
+
+
+def remember_purchase_state(sender, instance, **kwargs):
+    """
+    Keeps the state a purchase was loaded with in order to detect if it has
+    been completed once it is saved.
+    """
+    instance._stored_state = instance.state if instance.pk else None
+
+
+def purchase_saved(sender, instance, created, **kwargs):
+    """
+    Counts the tickets of a purchase as sold once it leaves the "incomplete"
+    state (and vice versa).
+    """
+    was_incomplete = getattr(instance, '_stored_state', None) in (None, 'incomplete')
+    is_incomplete = instance.state == 'incomplete'
+    instance._stored_state = instance.state
+    if created or was_incomplete == is_incomplete:
+        return
+    delta = 1 if was_incomplete else -1
+    for ticket_type_id, num in Ticket.objects.filter(purchase=instance)\
+            .values_list('ticket_type').order_by()\
+            .annotate(num=models.Count('pk')):
+        _update_sold_count(ticket_type_id, delta * num)
+
+
+def _is_sold(ticket):
+    purchase = getattr(ticket, '_purchase_cache', None)
+    if purchase is not None:
+        return purchase.state != 'incomplete'
+    return Purchase.objects.filter(pk=ticket.purchase_id)\
+        .exclude(state='incomplete').exists()
+
+
+def ticket_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and _is_sold(instance):
+        _update_sold_count(instance.ticket_type_id, 1)
+
+
+def ticket_deleted(sender, instance, **kwargs):
+    # This has to happen before the deletion as the purchase might be
+    # deleted along with its tickets.
+    if _is_sold(instance):
+        _update_sold_count(instance.ticket_type_id, -1)
+
+
+signals.post_init.connect(remember_purchase_state, sender=Purchase, dispatch_uid='attendees.remember_purchase_state')
+signals.post_save.connect(purchase_saved, sender=Purchase, dispatch_uid='attendees.purchase_sold_count')
+# post_save is only sent for the concrete ticket class while pre_delete is
+# also sent for the Ticket parent of every subclass.
+for ticket_cls in (Ticket, SupportTicket, VenueTicket, SIMCardTicket):
+    signals.post_save.connect(ticket_saved, sender=ticket_cls, dispatch_uid='attendees.ticket_sold_count_%s' % ticket_cls.__name__.lower())
+signals.pre_delete.connect(ticket_deleted, sender=Ticket, dispatch_uid='attendees.ticket_sold_count_del')
@@ -25,6 +25,11 @@ INVOICE_NUMBER_SEQUENCE_NAME = getattr(settings,
                                        'PURCHASE_INVOICE_NUMBER_SEQUENCE_NAME',
                                        'invoice_number')
 
+# Number of invoices rendered by a single render_invoices task.
+INVOICE_RENDER_BATCH_SIZE = getattr(settings,
+                                    'PURCHASE_INVOICE_RENDER_BATCH_SIZE',
+                                    50)
+
 INVOICE_ROOT = getattr(settings,
                        'PURCHASE_INVOICE_ROOT',
                        'invoices/')
@@ -50,6 +55,9 @@ MIN_TOTAL_FOR_PAYMENT_METHOD = getattr(
     }
 )
 
+# Number of purchases mailed by a single send_payment_mails task.
+MAIL_BATCH_SIZE = getattr(settings, 'PURCHASE_MAIL_BATCH_SIZE', 100)
+
 PAYMENT_METHODS = getattr(settings, 'PAYMENT_METHODS', None)
 
 TERMS_OF_USE_URL = getattr(settings, 'PURCHASE_TERMS_OF_USE_URL', '')
@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import collections
+import io
+import logging
 import os
+import time
 
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 from django.template.loader import render_to_string
 from django.utils.crypto import get_random_string
 from django.utils.translation import ugettext as _
@@ -14,6 +18,12 @@ from pyconde.celery import app
 from . import settings as app_settings
 
 
+LOG = logging.getLogger(__name__)
+
+InvoiceRenderResult = collections.namedtuple('InvoiceRenderResult',
+                                             'purchase_id seconds error')
+
+
 if app_settings.INVOICE_DISABLE_RENDERING:
     def do_render(filepath, data, **kwargs):
         from django.core.serializers.json import DjangoJSONEncoder
@@ -26,38 +36,74 @@ else:
         return generate_invoice.render(filepath=filepath, data=data, **kwargs)
 
 
-@app.task(ignore_result=True)
-def render_invoice(purchase_id, send_purchaser=True, send_orga=True):
+class InvoiceRenderer(object):
+    """
+    Renders invoice PDFs based on the configured template and fonts. One
+    renderer is kept per worker process (see get_invoice_renderer()), so the
+    invoice generator is imported and the template is read only once. Every
+    invoice gets its own in-memory copy of the template file.
+    """
+    password_chars = 'abcdefghijklmnopqrstuvwxyz0123456789!@#$%^&*(-_=+)'
+
+    def __init__(self, render=do_render, attempts=3):
+        self.render_func = render
+        self.attempts = attempts
+        self.template = None
+        self.options = {
+            'fontdir': app_settings.INVOICE_FONT_ROOT,
+            'fontconfig': app_settings.INVOICE_FONT_CONFIG,
+        }
+        if not app_settings.INVOICE_DISABLE_RENDERING:
+            # Fails the whole batch right away instead of every single
+            # invoice if the generator or the template is missing.
+            import invoicegenerator.generate_invoice  # noqa (imported to load reportlab once)
+            template_path = app_settings.INVOICE_TEMPLATE_PATH
+            if not os.path.exists(template_path or ''):
+                raise RuntimeError('Invoice template %r not found' %
+                                   template_path)
+            with open(template_path, 'rb') as fp:
+                self.template = fp.read()
+
+    def render(self, filepath, data):
+        success, error = False, ''
+        iteration = 0
+        while not success and iteration < self.attempts:
+            try:
+                password = bytes(get_random_string(32, self.password_chars))
+                basepdf = None
+                if self.template is not None:
+                    basepdf = io.BytesIO(self.template)
+                success, error = self.render_func(
+                    filepath=filepath, data=data, modify_password=password,
+                    basepdf=basepdf, **self.options)
+            except Exception as e:
+                error = e
+            finally:
+                iteration += 1
+        return success, error
+
+
+_invoice_renderer = None
+
+
+def get_invoice_renderer():
+    global _invoice_renderer
+    if _invoice_renderer is None:
+        _invoice_renderer = InvoiceRenderer()
+    return _invoice_renderer
+
+
+def _render_invoice(purchase, renderer):
     from .exporters import PurchaseExporter
-    from .models import Purchase
     from .utils import generate_invoice_filename
 
-    try:
-        purchase = Purchase.objects.get_exportable_purchases().get(pk=purchase_id)
-    except Purchase.DoesNotExist:
-        raise RuntimeError('No exportable purchase found with pk %d' % purchase_id)
-
     generate_invoice_filename(purchase)
     filepath = purchase.invoice_filepath
     if not os.path.exists(app_settings.INVOICE_ROOT):
         os.makedirs(app_settings.INVOICE_ROOT)
     data = PurchaseExporter(purchase).export()
 
-    success, error = False, ''
-    iteration = 0
-    while not success and iteration < 3:
-        try:
-            chars = 'abcdefghijklmnopqrstuvwxyz0123456789!@#$%^&*(-_=+)'
-            password = bytes(get_random_string(32, chars))
-            success, error = do_render(filepath, data,
-                basepdf=app_settings.INVOICE_TEMPLATE_PATH,
-                fontdir=app_settings.INVOICE_FONT_ROOT,
-                fontconfig=app_settings.INVOICE_FONT_CONFIG,
-                modify_password=password)
-        except Exception as e:
-            error = e
-        finally:
-            iteration += 1
+    success, error = renderer.render(filepath, data)
 
     if not success:
         purchase.invoice_filename = None
@@ -65,7 +111,7 @@ def render_invoice(purchase_id, send_purchaser=True, send_orga=True):
         if isinstance(error, Exception):
             raise error
         else:
-            raise RuntimeError('Error exporting purchase pk %d: %s' % (purchase_id, error))
+            raise RuntimeError('Error exporting purchase pk %d: %s' % (purchase.pk, error))
     else:
         purchase.exported = True
         if purchase.payment_method == 'invoice' and purchase.state == 'new':
@@ -79,12 +125,132 @@ def render_invoice(purchase_id, send_purchaser=True, send_orga=True):
                 purchase.state = 'invoice_created'
         purchase.save(update_fields=['exported', 'state'])
 
+
+def _get_invoice_recipients(purchase, send_purchaser=True, send_orga=True):
+    recipients = []
     # Send invoice to buyer
     if send_purchaser and purchase.send_invoice_to_user:
-        send_invoice.delay(purchase_id, (purchase.email_receiver,))
+        recipients.append((purchase.email_receiver,))
     # Send invoice to orga
-    if send_orga:
-        send_invoice.delay(purchase_id, app_settings.INVOICE_EXPORT_RECIPIENTS)
+    if send_orga and app_settings.INVOICE_EXPORT_RECIPIENTS:
+        recipients.append(app_settings.INVOICE_EXPORT_RECIPIENTS)
+    return recipients
+
+
+def _create_invoice_message(purchase, recipients):
+    subject = _('Your EuroPython 2014 Invoice %(full_invoice_number)s') % {
+        'full_invoice_number': purchase.full_invoice_number,
+    }
+    message = render_to_string('attendees/mail_payment_invoice.txt', {
+        'first_name': purchase.first_name,
+        'last_name': purchase.last_name,
+        'conference': purchase.conference,
+    })
+    msg = EmailMessage(subject, message, to=recipients)
+    msg.encoding = 'utf-8'
+    ext = '.json' if app_settings.INVOICE_DISABLE_RENDERING else '.pdf'
+    filename = '%s%s' % (purchase.full_invoice_number, ext)  # attachment filename
+    with open(purchase.invoice_filepath, 'rb') as f:
+        content = f.read()
+    msg.attach(filename, content)
+    return msg
+
+
+@app.task(ignore_result=True)
+def render_invoice(purchase_id, send_purchaser=True, send_orga=True):
+    from .models import Purchase
+
+    try:
+        purchase = Purchase.objects.get_exportable_purchases().get(pk=purchase_id)
+    except Purchase.DoesNotExist:
+        raise RuntimeError('No exportable purchase found with pk %d' % purchase_id)
+
+    _render_invoice(purchase, get_invoice_renderer())
+
+    for recipients in _get_invoice_recipients(purchase, send_purchaser,
+                                              send_orga):
+        send_invoice.delay(purchase_id, recipients)
+
+
+@app.task(ignore_result=True)
+def render_invoices(purchase_ids, send_purchaser=True, send_orga=True,
+                    export_id=None):
+    """
+    Renders the invoices of all given purchases in this worker, reusing the
+    same renderer. Purchases without an invoice number are numbered from a
+    block reserved for the whole chunk. A failing invoice doesn't abort the
+    batch; the time spent on and the error of every invoice are logged and
+    returned as a list of InvoiceRenderResult.
+
+    The invoices are mailed afterwards using a single connection to the
+    mail server. If an export_id is given, the progress of that
+    InvoiceExport is updated.
+    """
+    from .models import Purchase
+    from .utils import InvoiceExport, generate_invoice_numbers
+
+    export = InvoiceExport(export_id) if export_id is not None else None
+    try:
+        purchases = Purchase.objects.get_exportable_purchases()\
+            .select_related('conference').in_bulk(purchase_ids)
+        unnumbered = sorted(pk for pk, purchase in purchases.items()
+                            if purchase.invoice_number is None)
+        if unnumbered:
+            numbers = generate_invoice_numbers(len(unnumbered))
+            for pk, invoice_number in zip(unnumbered, numbers):
+                purchases[pk].invoice_number = invoice_number
+        renderer = get_invoice_renderer()
+    except Exception as e:
+        # None of the invoices can be rendered, so they all count as failed
+        # for the export to be finished nonetheless.
+        LOG.exception('Failed to render the invoices of %d purchases',
+                      len(purchase_ids))
+        if export is not None:
+            export.increment('failed', len(purchase_ids))
+        return [InvoiceRenderResult(purchase_id, 0, '%s' % e)
+                for purchase_id in purchase_ids]
+    results = []
+    messages = []
+    started = time.time()
+    for purchase_id in purchase_ids:
+        start = time.time()
+        error = None
+        purchase = purchases.get(purchase_id)
+        if purchase is None:
+            error = 'No exportable purchase found with pk %d' % purchase_id
+        else:
+            try:
+                if purchase.pk in unnumbered:
+                    purchase.save(update_fields=['invoice_number'])
+                _render_invoice(purchase, renderer)
+                for recipients in _get_invoice_recipients(
+                        purchase, send_purchaser, send_orga):
+                    messages.append(_create_invoice_message(purchase,
+                                                            recipients))
+            except Exception as e:
+                LOG.exception('Failed to render invoice of purchase %d',
+                              purchase_id)
+                error = '%s' % e
+        result = InvoiceRenderResult(purchase_id, time.time() - start, error)
+        LOG.info('Invoice of purchase %d: %.1fms%s', purchase_id,
+                 result.seconds * 1000, ' (failed)' if error else '')
+        if export is not None:
+            export.increment('failed' if error else 'rendered')
+        results.append(result)
+    LOG.info('Rendered %d invoices in %.1fs, %d failed', len(results),
+             time.time() - started,
+             len([result for result in results if result.error]))
+
+    if messages:
+        connection = get_connection()
+        try:
+            sent = connection.send_messages(messages) or 0
+        except Exception:
+            LOG.exception('Failed to send %d invoice mails', len(messages))
+            sent = 0
+        if export is not None:
+            export.increment('sent', sent)
+    return results
 
 
 @app.task(ignore_result=True)
@@ -105,22 +271,97 @@ def send_invoice(purchase_id, recipients):
         render_invoice.delay(purchase_id)
         raise RuntimeError('Invoked rendering of invoice pk %d' % purchase_id)
 
-    subject = _('Your EuroPython 2014 Invoice %(full_invoice_number)s') % {
-        'full_invoice_number': purchase.full_invoice_number,
-    }
-    message = render_to_string('attendees/mail_payment_invoice.txt', {
-        'first_name': purchase.first_name,
-        'last_name': purchase.last_name,
-        'conference': purchase.conference,
-    })
-    msg = EmailMessage(subject, message, to=recipients)
-    msg.encoding = 'utf-8'
-    ext = '.json' if app_settings.INVOICE_DISABLE_RENDERING else '.pdf'
-    filename = '%s%s' % (purchase.full_invoice_number, ext)  # attachment filename
-    with open(purchase.invoice_filepath, 'rb') as f:
-        content = f.read()
-    msg.attach(filename, content)
-    msg.send()
+    _create_invoice_message(purchase, recipients).send()
+
+
+@app.task(ignore_result=True)
+def send_payment_mails(kind, purchase_ids, mailing_id=None, due_date=None,
+                       cc=None):
+    """
+    Sends the payment confirmations (kind 'confirmation') or payment
+    reminders (kind 'reminder') for the given purchases using a single
+    connection to the mail server.
+
+    Confirmed purchases are marked as paid even if their mail could not be
+    sent, reminders include the invoice of exported purchases. A mail that
+    cannot be created or sent counts as failed without aborting the chunk.
+    The due_date is passed to the reminder template, cc is an optional
+    additional recipient. If a mailing_id is given, the progress of that
+    PaymentMailing is updated.
+    """
+    from .models import Purchase
+    from .utils import PaymentMailing
+
+    mailing = PaymentMailing(mailing_id) if mailing_id is not None else None
+    purchases = Purchase.objects.filter(pk__in=purchase_ids)\
+        .select_related('conference')
+    if kind == 'confirmation':
+        purchases = purchases.filter(
+            state__in=('invoice_created', 'payment_received'))
+    elif kind == 'reminder':
+        purchases = purchases.filter(state='invoice_created')
+    else:
+        raise ValueError('Unknown kind of payment mail: %s' % kind)
+
+    sent_ids = []
+    paid_ids = []
+    connection = get_connection(fail_silently=True)
+    connection.open()
+    try:
+        for purchase in purchases:
+            if kind == 'confirmation':
+                # The payment has been received whether or not the mail
+                # can be sent.
+                paid_ids.append(purchase.pk)
+            try:
+                msgs = _create_payment_messages(kind, purchase, due_date, cc)
+                if connection.send_messages(msgs):
+                    sent_ids.append(purchase.pk)
+            except Exception:
+                LOG.exception('Failed to send the payment %s mail of '
+                              'purchase %d', kind, purchase.pk)
+    finally:
+        connection.close()
+
+    # Saved one by one so that post_save reaches the checkin data.
+    for purchase in Purchase.objects.filter(pk__in=paid_ids,
+                                            state='invoice_created'):
+        purchase.state = 'payment_received'
+        purchase.save(update_fields=['state'])
+    if mailing is not None:
+        mailing.increment('sent', len(sent_ids))
+        mailing.increment('failed', len(purchase_ids) - len(sent_ids))
+    LOG.info('Sent %d of %d payment %s mails', len(sent_ids),
+             len(purchase_ids), kind)
+
+
+def _create_payment_messages(kind, purchase, due_date=None, cc=None):
+    if kind == 'confirmation':
+        return [EmailMessage(
+            _('Payment receipt confirmation'),
+            render_to_string('attendees/mail_payment_received.txt', {
+                'purchase': purchase,
+                'conference': purchase.conference
+            }),
+            settings.DEFAULT_FROM_EMAIL,
+            [purchase.email_receiver, settings.DEFAULT_FROM_EMAIL])]
+    recipients = [purchase.email_receiver]
+    if cc:
+        recipients.append(cc)
+    msgs = [EmailMessage(
+        _('%(conference)s payment reminder') % {
+            'conference': purchase.conference.title,
+        },
+        render_to_string('attendees/mail_payment_pending.txt', {
+            'purchase': purchase,
+            'conference': purchase.conference,
+            'due_date': due_date
+        }),
+        settings.DEFAULT_FROM_EMAIL, recipients)]
+    if purchase.exported:
+        msgs.append(_create_invoice_message(
+            purchase, (purchase.email_receiver,)))
+    return msgs
 
 
 @app.task(ignore_result=True)
@@ -176,3 +417,14 @@ def cancel_purchase(purchase_id, recipients):
 
         send_mail(ticket_subject, ticket_message, settings.DEFAULT_FROM_EMAIL,
             [ticket_recipient], fail_silently=True)
+
+
+@app.task(ignore_result=True)
+def release_expired_reservations():
+    """
+    Releases the ticket reservations of checkouts that have expired. Run
+    periodically by celery beat (see CELERYBEAT_SCHEDULE).
+    """
+    from .models import TicketReservation
+
+    TicketReservation.objects.release_expired()
@@ -3,21 +3,32 @@ from __future__ import unicode_literals
 
 import datetime
 import mock
+import tempfile
 
 from decimal import Decimal
 from os import path, unlink
 
+from django.conf import settings
 from django.contrib.auth import models as auth_models
 from django.contrib.contenttypes.models import ContentType
+from django.core import mail
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse
+from django.db import IntegrityError
 from django.db.models import Max
-from django.test import TestCase
+from django.db.models.signals import post_save
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
 
+from . import exceptions
+from . import exporters
 from . import utils
 from . import forms
 from . import models
+from . import tasks
+from . import views
 from ..conference.models import Conference
+from ..core.metrics import record
 
 
 def escape_redirect(s):
@@ -352,7 +363,7 @@ class PurchaseProcessTest(TestCase):
 
     def tearDown(self):
         for purchase in models.Purchase.objects.all():
-            if path.exists(purchase.invoice_filepath):
+            if purchase.invoice_filepath and path.exists(purchase.invoice_filepath):
                 unlink(purchase.invoice_filepath)
 
         for klass in [models.Purchase, models.VenueTicket, models.SIMCardTicket,
@@ -495,7 +506,8 @@ class PurchaseProcessTest(TestCase):
         self.assertRedirects(response, reverse('attendees_purchase_names'))
 
         # check for created tickets
-        tickets = self.client.session['purchase_state']['tickets']
+        tickets = utils.load_tickets(
+            self.client.session['purchase_state']['tickets'])
         self.assertIsInstance(tickets[0], models.VenueTicket)
         self.assertIsInstance(tickets[1], models.VenueTicket)
         self.assertIsInstance(tickets[2], models.VenueTicket)
@@ -535,7 +547,8 @@ class PurchaseProcessTest(TestCase):
         self.assertContains(response, '<legend>2. TT:SIM</legend>', count=1, html=True)
 
         # check for form fields
-        tickets = self.client.session['purchase_state']['tickets']
+        tickets = utils.load_tickets(
+            self.client.session['purchase_state']['tickets'])
         for i in range(4):
             self.assertNameForm(response, tickets[i], models.VenueTicket)
         for i in range(4, 6):
@@ -621,6 +634,59 @@ class PurchaseProcessTest(TestCase):
         # check we are on the completion page
         self.assertContains(response, '<li class="active">Complete</li>', html=True)
 
+    def test_limited_tickets_reserved_during_checkout(self):
+        data = {
+            'tq-%d-quantity' % self.tt_conf_standard.pk: 5,
+            'city': 'P:Berlin',
+            'country': 'P:Germany',
+            'email': 'purchase@example.com',
+            'first_name': 'P:FirstName',
+            'last_name': 'P:LastName',
+            'street': 'P:Street 123',
+            'zip_code': 'P:Z1P-2345',
+        }
+        response = self.client.post(reverse('attendees_purchase'), data=data)
+        self.assertRedirects(response, reverse('attendees_purchase_names'))
+        ticket_type = models.TicketType.objects.get(pk=self.tt_conf_standard.pk)
+        self.assertEqual(5, ticket_type.reserved_count)
+        self.assertEqual(2, ticket_type.available_tickets)
+
+        # The own reservation is still available when restarting the checkout
+        response = self.client.get(reverse('attendees_purchase'))
+        quantity_form = [form for form in response.context['quantity_forms']
+                         if form.ticket_type.pk == self.tt_conf_standard.pk][0]
+        self.assertEqual(7, quantity_form.fields['quantity'].max_value)
+
+        # The reservation is checked without loading the tickets
+        view = views.PurchaseNamesView()
+        view.request = RequestFactory().get('/')
+        view.request.session = self.client.session
+        view.request.user = self.user
+        with mock.patch.object(utils, 'load_tickets') as load_tickets:
+            view.get_previous_state()
+        self.assertFalse(load_tickets.called)
+        self.assertEqual([(self.tt_conf_standard.pk, 5)],
+                         [(t['type'].pk, t['qty']) for t in view.limited_tickets])
+
+        # Other checkouts can't get more than what is left
+        reservation = self.client.session['purchase_state']['reservation']
+        with self.assertRaises(exceptions.TicketNotAvailable):
+            models.TicketReservation.objects.reserve(
+                'other', {self.tt_conf_standard.pk: 3},
+                datetime.datetime.now() + datetime.timedelta(minutes=30))
+
+        # Once the reservation is gone, the checkout is aborted.
+        models.TicketReservation.objects.release(reservation)
+        response = self.client.get(reverse('attendees_purchase_names'))
+        self.assertRedirects(response, reverse('attendees_purchase'))
+        self.assertNotIn('purchase_state', self.client.session)
+
+        # Restarting the checkout releases the previous reservation.
+        self.client.post(reverse('attendees_purchase'), data=data)
+        self.client.post(reverse('attendees_purchase'), data=data)
+        ticket_type = models.TicketType.objects.get(pk=self.tt_conf_standard.pk)
+        self.assertEqual(5, ticket_type.reserved_count)
+
     def test_information_restoration_from_step2_to_step1(self):
         """
         When the user goes back from the "names" page to the start page
@@ -669,6 +735,111 @@ class PurchaseProcessTest(TestCase):
             self.assertEqual(qty, response.context['quantity_forms'][idx].initial['quantity'])
 
 
+    def test_checkout_state_round_trip(self):
+        purchase = models.Purchase(
+            conference=self.conference, first_name='First', last_name='Last',
+            email='purchase@example.com', payment_total=300)
+        preference = models.DietaryPreference.objects.create(name='Vegan')
+        venue_ticket = models.VenueTicket(
+            pk=0, purchase=purchase, ticket_type=self.tt_conf_student,
+            first_name='First', shirtsize=self.ts_mxl, voucher=self.v_student)
+        venue_ticket.related_data['dietary_preferences'] = [preference]
+        sim_ticket = models.SIMCardTicket(
+            pk=1, purchase=purchase, ticket_type=self.tt_sim,
+            date_of_birth=datetime.date(1980, 1, 1), gender='female')
+
+        purchase_data = utils.dump_purchase(purchase)
+        tickets_data = utils.dump_tickets([venue_ticket, sim_ticket])
+        self.assertEqual(self.tt_conf_student.pk,
+                         tickets_data[0]['fields']['ticket_type_id'])
+        self.assertEqual(self.v_student.pk,
+                         tickets_data[0]['fields']['voucher_id'])
+        self.assertEqual([preference.pk],
+                         tickets_data[0]['related']['dietary_preferences'])
+
+        purchase = utils.load_purchase(purchase_data)
+        self.assertIsNone(purchase.pk)
+        self.assertEqual('purchase@example.com', purchase.email)
+        with self.assertNumQueries(2):
+            tickets = utils.load_tickets(tickets_data, purchase=purchase)
+            self.assertEqual('VT:Student', tickets[0].ticket_type.vouchertype_needed.name)
+        self.assertIsInstance(tickets[0], models.VenueTicket)
+        self.assertIsInstance(tickets[1], models.SIMCardTicket)
+        self.assertEqual([0, 1], [ticket.pk for ticket in tickets])
+        self.assertEqual(self.ts_mxl.pk, tickets[0].shirtsize_id)
+        self.assertEqual([preference],
+                         tickets[0].related_data['dietary_preferences'])
+        self.assertEqual(datetime.date(1980, 1, 1), tickets[1].date_of_birth)
+        self.assertIs(purchase, tickets[1].purchase)
+
+    def test_outdated_checkout_state_restarts_checkout(self):
+        data = {
+            'tq-%d-quantity' % self.tt_conf_standard.pk: 1,
+            'city': 'P:Berlin',
+            'country': 'P:Germany',
+            'email': 'purchase@example.com',
+            'first_name': 'P:FirstName',
+            'last_name': 'P:LastName',
+            'street': 'P:Street 123',
+            'zip_code': 'P:Z1P-2345',
+        }
+        self.client.post(reverse('attendees_purchase'), data=data)
+        response = self.client.get(reverse('attendees_purchase_names'))
+        self.assertEqual(200, response.status_code)
+
+        session = self.client.session
+        session['purchase_state']['version'] = None
+        session.save()
+        response = self.client.get(reverse('attendees_purchase_names'))
+        self.assertRedirects(response, reverse('attendees_purchase'))
+
+    def _persist_purchase(self, count):
+        mixin = views.PurchaseMixin()
+        mixin.purchase = models.Purchase(
+            conference=self.conference, user=self.user, first_name='First',
+            last_name='Last', email='purchase@example.com', street='Street',
+            zip_code='12345', city='City', country='Country',
+            payment_method='invoice', payment_total=count * 200)
+        preference = models.DietaryPreference.objects.get_or_create(
+            name='Vegetarian')[0]
+        mixin.tickets = []
+        for i in range(count):
+            ticket = models.VenueTicket(
+                ticket_type=self.tt_conf_standard, first_name='First %d' % i,
+                last_name='Last %d' % i, shirtsize=self.ts_fm)
+            ticket.related_data = {'dietary_preferences': [preference]}
+            mixin.tickets.append(ticket)
+            mixin.tickets.append(models.SupportTicket(
+                ticket_type=self.tt_support10))
+        with record() as metrics:
+            mixin.persist_purchase()
+        return mixin.purchase, metrics
+
+    def test_persist_purchase_in_bulk(self):
+        purchase, small = self._persist_purchase(2)
+        self.assertEqual(4, purchase.ticket_set.count())
+        purchase, large = self._persist_purchase(20)
+        self.assertEqual(small.queries, large.queries)
+
+        tickets = models.VenueTicket.objects.filter(purchase=purchase)
+        self.assertEqual(20, tickets.count())
+        self.assertEqual(['First 0', 'First 1'],
+                         [t.first_name for t in tickets.order_by('pk')[:2]])
+        self.assertEqual(20, models.SupportTicket.objects.filter(
+            purchase=purchase).count())
+        self.assertEqual(20, models.VenueTicket.dietary_preferences.through
+                         .objects.filter(venueticket__purchase=purchase).count())
+        # Incomplete purchases don't count as sold yet
+        ticket_type = models.TicketType.objects.get(pk=self.tt_conf_standard.pk)
+        self.assertEqual(0, ticket_type.sold_count)
+
+    def test_bulk_create_tickets_with_existing_tickets(self):
+        purchase, _ = self._persist_purchase(1)
+        tickets = [models.SupportTicket(ticket_type=self.tt_support10)]
+        with self.assertRaises(IntegrityError):
+            models.bulk_create_tickets(purchase, tickets)
+        self.assertIsNone(tickets[0].pk)
+
 class TestPurchaseModel(TestCase):
 
     def setUp(self):
@@ -782,6 +953,224 @@ class TestPurchaseModel(TestCase):
         self.assertTrue(purchase.send_invoice_to_user)
 
 
+class InvoiceRenderingTests(TestCase):
+
+    def setUp(self):
+        self.conference = Conference.objects.create(title='TestConf')
+        self.purchases = [
+            models.Purchase.objects.create(
+                conference=self.conference, first_name='Max', last_name='Mustermann',
+                email='max@mustermann.de', street='Musterstraße',
+                zip_code='12345', city='Musterhausen', country='Musterland',
+                payment_method='invoice', payment_total=total, state='new',
+                invoice_number=idx + 1)
+            for idx, total in enumerate([100, 0])]
+
+    def tearDown(self):
+        for purchase in models.Purchase.objects.all():
+            if purchase.invoice_filepath and path.exists(purchase.invoice_filepath):
+                unlink(purchase.invoice_filepath)
+
+    def test_render_invoices(self):
+        pks = [purchase.pk for purchase in self.purchases]
+        results = tasks.render_invoices(pks + [pks[-1] + 1])
+        self.assertEqual(pks + [pks[-1] + 1],
+                         [result.purchase_id for result in results])
+        self.assertEqual([None, None],
+                         [result.error for result in results[:2]])
+        self.assertIn('No exportable purchase', results[2].error)
+
+        purchases = models.Purchase.objects.in_bulk(pks)
+        self.assertTrue(purchases[pks[0]].exported)
+        self.assertEqual('invoice_created', purchases[pks[0]].state)
+        self.assertEqual('payment_received', purchases[pks[1]].state)
+        self.assertTrue(path.exists(purchases[pks[0]].invoice_filepath))
+
+        # Already exported purchases are skipped
+        results = tasks.render_invoices(pks[:1])
+        self.assertIsNotNone(results[0].error)
+
+    def test_renderer_reads_template_once(self):
+        templates = []
+
+        def render(filepath, data, basepdf=None, **kwargs):
+            templates.append(basepdf.read())
+            return True, ''
+
+        with tempfile.NamedTemporaryFile() as template:
+            template.write(b'%PDF template')
+            template.flush()
+            with mock.patch.multiple(tasks.app_settings,
+                                     INVOICE_DISABLE_RENDERING=False,
+                                     INVOICE_TEMPLATE_PATH=template.name):
+                with mock.patch.dict('sys.modules', {
+                        'invoicegenerator': mock.Mock(),
+                        'invoicegenerator.generate_invoice': mock.Mock()}):
+                    renderer = tasks.InvoiceRenderer(render=render)
+        # The template file is gone by now
+        renderer.render('first.pdf', {})
+        renderer.render('second.pdf', {})
+        self.assertEqual([b'%PDF template'] * 2, templates)
+
+    def test_failing_invoice_does_not_abort_batch(self):
+        calls = []
+
+        def render(filepath, data, **kwargs):
+            calls.append(data['pk'])
+            if data['pk'] == self.purchases[0].pk:
+                return False, 'broken'
+            return True, ''
+
+        renderer = tasks.InvoiceRenderer(render=render)
+        with mock.patch('pyconde.attendees.tasks.get_invoice_renderer',
+                        return_value=renderer):
+            results = tasks.render_invoices(
+                [purchase.pk for purchase in self.purchases])
+        self.assertEqual([self.purchases[0].pk] * 3 + [self.purchases[1].pk],
+                         calls)
+        self.assertIn('broken', results[0].error)
+        self.assertIsNone(results[1].error)
+        purchase = models.Purchase.objects.get(pk=self.purchases[0].pk)
+        self.assertFalse(purchase.exported)
+        self.assertIsNone(purchase.invoice_filename)
+
+    @mock.patch('pyconde.attendees.tasks.render_invoices.delay')
+    @mock.patch('pyconde.attendees.utils.generate_invoice_numbers',
+                return_value=[42])
+    def test_invoices_numbered_by_chunk(self, mock_gen_inv_nrs, mock_delay):
+        models.Purchase.objects.filter(pk=self.purchases[1].pk)\
+            .update(invoice_number=None)
+        pks = [purchase.pk for purchase in self.purchases]
+        with self.assertNumQueries(1):
+            utils.InvoiceExport.start(models.Purchase.objects.all())
+        self.assertFalse(mock_gen_inv_nrs.called)
+        self.assertEqual(pks, mock_delay.call_args[0][0])
+
+        tasks.render_invoices(pks)
+        mock_gen_inv_nrs.assert_called_once_with(1)
+        self.assertEqual([1, 42], [models.Purchase.objects.get(pk=pk)
+                                   .invoice_number for pk in pks])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch('pyconde.attendees.tasks.get_invoice_renderer',
+                side_effect=RuntimeError('No renderer'))
+    def test_missing_renderer_fails_batch(self, mock_get_renderer):
+        pks = [purchase.pk for purchase in self.purchases]
+        export = utils.InvoiceExport.create(len(pks))
+        results = tasks.render_invoices(pks, export_id=export.job_id)
+        self.assertEqual(['No renderer'] * 2,
+                         [result.error for result in results])
+        self.assertEqual({'total': 2, 'rendered': 0, 'failed': 2, 'sent': 0,
+                          'finished': True}, export.get_progress())
+        self.assertFalse(models.Purchase.objects.filter(
+            pk__in=pks, exported=True).exists())
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch('pyconde.attendees.utils.generate_invoice_numbers',
+                return_value=[42])
+    def test_bulk_export(self, mock_gen_inv_nrs):
+        purchase = models.Purchase.objects.create(
+            first_name='Erika', last_name='Mustermann',
+            email='erika@mustermann.de', street='Musterstraße',
+            zip_code='12345', city='Musterhausen', country='Musterland',
+            payment_method='invoice', payment_total=50, state='new')
+        models.Purchase.objects.filter(pk=self.purchases[1].pk)\
+            .update(exported=True)
+        auth_models.User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+        self.client.login(username='admin', password='admin')
+
+        response = self.client.post(
+            reverse('admin:attendees_purchase_changelist'), {
+                'action': 'export_and_send_invoices',
+                '_selected_action': [self.purchases[0].pk,
+                                     self.purchases[1].pk, purchase.pk],
+            })
+        mock_gen_inv_nrs.assert_called_once_with(1)
+        self.assertEqual(42, models.Purchase.objects.get(pk=purchase.pk)
+                         .invoice_number)
+        self.assertEqual(2, models.Purchase.objects.filter(
+            pk__in=[self.purchases[0].pk, purchase.pk], exported=True).count())
+        self.assertEqual(2, len(mail.outbox))
+
+        response = self.client.get(response['Location'])
+        self.assertEqual({'total': 2, 'rendered': 2, 'failed': 0, 'sent': 2,
+                          'finished': True}, response.context['progress'])
+        self.assertContains(response, 'All 2 purchases have been processed.')
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_payment_mails(self):
+        models.Purchase.objects.filter(pk=self.purchases[0].pk)\
+            .update(state='invoice_created')
+        models.Purchase.objects.filter(pk=self.purchases[1].pk)\
+            .update(state='payment_received')
+        tasks.render_invoice(self.purchases[0].pk, send_purchaser=False)
+        auth_models.User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+        self.client.login(username='admin', password='admin')
+        changelist = reverse('admin:attendees_purchase_changelist')
+        pks = [purchase.pk for purchase in self.purchases]
+
+        response = self.client.post(changelist, {
+            'action': 'send_payment_reminder', '_selected_action': pks})
+        # Only the first purchase is still unpaid, its reminder includes
+        # the invoice.
+        self.assertEqual(2, len(mail.outbox))
+        self.assertEqual(['max@mustermann.de', 'admin@example.com'],
+                         [addr.split('<')[-1].rstrip('>')
+                          for addr in mail.outbox[0].to])
+        self.assertEqual(1, len(mail.outbox[1].attachments))
+        response = self.client.get(response['Location'])
+        self.assertEqual({'total': 1, 'sent': 1, 'failed': 0,
+                          'finished': True}, response.context['progress'])
+
+        mail.outbox = []
+        saved = []
+        receiver = lambda sender, instance, update_fields=None, **kwargs: \
+            saved.append((instance.pk, instance.state, update_fields))
+        post_save.connect(receiver, sender=models.Purchase, weak=False)
+        self.addCleanup(post_save.disconnect, receiver, sender=models.Purchase)
+        response = self.client.post(changelist, {
+            'action': 'send_payment_confirmation', '_selected_action': pks})
+        self.assertEqual(2, len(mail.outbox))
+        self.assertEqual(2, models.Purchase.objects.filter(
+            pk__in=pks, state='payment_received').count())
+        # The paid purchase is saved so that e.g. the checkin data is updated
+        self.assertEqual([(pks[0], 'payment_received', frozenset(['state']))],
+                         saved)
+        response = self.client.get(response['Location'])
+        self.assertContains(response, 'All 2 purchases have been processed.')
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_payment_mail_failures(self):
+        pks = [purchase.pk for purchase in self.purchases]
+        models.Purchase.objects.filter(pk__in=pks).update(
+            state='invoice_created')
+        models.Purchase.objects.filter(pk=pks[0]).update(
+            exported=True, invoice_filename='missing.pdf')
+
+        # The missing invoice file only fails the reminder of its purchase
+        mailing = utils.PaymentMailing.create(2)
+        tasks.send_payment_mails('reminder', pks, mailing_id=mailing.job_id)
+        self.assertEqual(1, len(mail.outbox))
+        self.assertEqual({'total': 2, 'sent': 1, 'failed': 1,
+                          'finished': True}, mailing.get_progress())
+
+        # Purchases are paid even if the mail server is down
+        mailing = utils.PaymentMailing.create(2)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend'
+                        '.send_messages', return_value=0):
+            tasks.send_payment_mails('confirmation', pks,
+                                     mailing_id=mailing.job_id)
+        self.assertEqual({'total': 2, 'sent': 0, 'failed': 2,
+                          'finished': True}, mailing.get_progress())
+        self.assertEqual(2, models.Purchase.objects.filter(
+            pk__in=pks, state='payment_received').count())
+
 class TestTicketTypeModel(TestCase):
     def setUp(self):
         self.vt_ct = ContentType.objects.get(app_label='attendees', model='venueticket')
@@ -901,6 +1290,127 @@ class TestTicketTypeModel(TestCase):
                          [active_ondesk, on_desk])
 
 
+class TicketInventoryTests(TestCase):
+    def setUp(self):
+        now = datetime.datetime.now()
+        self.ticket_type = models.TicketType.objects.create(
+            name="limited", fee=100, max_purchases=5,
+            date_valid_from=now - datetime.timedelta(days=1),
+            date_valid_to=now + datetime.timedelta(days=1),
+            content_type=ctype(models.VenueTicket))
+        self.purchase = models.Purchase.objects.create(
+            first_name='First', last_name='Last', email='purchase@example.com',
+            street='Street', zip_code='12345', city='City', country='Country')
+
+    def get_ticket_type(self):
+        return models.TicketType.objects.get(pk=self.ticket_type.pk)
+
+    def test_reserve_and_release(self):
+        models.TicketType.objects.reserve({self.ticket_type.pk: 3})
+        self.assertEqual(2, self.get_ticket_type().available_tickets)
+        with self.assertRaises(exceptions.TicketNotAvailable):
+            models.TicketType.objects.reserve({self.ticket_type.pk: 3})
+        models.TicketType.objects.release(self.ticket_type.pk, 3)
+        self.assertEqual(5, self.get_ticket_type().available_tickets)
+
+    def test_release_too_many_warns(self):
+        models.TicketType.objects.reserve({self.ticket_type.pk: 1})
+        with mock.patch.object(models.LOG, 'warning') as warning:
+            models.TicketType.objects.release(self.ticket_type.pk, 2)
+        self.assertEqual((2, self.ticket_type.pk, 1), warning.call_args[0][1:])
+        self.assertEqual(0, self.get_ticket_type().reserved_count)
+
+    def test_reservations(self):
+        expires = datetime.datetime.now() + datetime.timedelta(minutes=30)
+        models.TicketReservation.objects.reserve(
+            'first', {self.ticket_type.pk: 2}, expires)
+        models.TicketReservation.objects.reserve(
+            'second', {self.ticket_type.pk: 3}, expires)
+        self.assertEqual(0, self.get_ticket_type().available_tickets)
+        with self.assertRaises(exceptions.TicketNotAvailable):
+            models.TicketReservation.objects.reserve(
+                'third', {self.ticket_type.pk: 1}, expires)
+        self.assertFalse(models.TicketReservation.objects.filter(key='third').exists())
+        models.TicketReservation.objects.release('first')
+        self.assertEqual(2, self.get_ticket_type().available_tickets)
+        self.assertEqual([], models.TicketType.objects.rebuild_inventory(fix=False))
+
+    def test_expired_reservations_are_released(self):
+        models.TicketReservation.objects.reserve(
+            'expired', {self.ticket_type.pk: 4},
+            datetime.datetime.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(1, self.get_ticket_type().available_tickets)
+        models.TicketReservation.objects.reserve(
+            'new', {self.ticket_type.pk: 5},
+            datetime.datetime.now() + datetime.timedelta(minutes=30))
+        self.assertEqual(['new'], list(models.TicketReservation.objects
+                                       .values_list('key', flat=True)))
+
+    def test_expired_reservations_released_periodically(self):
+        entry = settings.CELERYBEAT_SCHEDULE['release-expired-ticket-reservations']
+        self.assertEqual(tasks.release_expired_reservations.name, entry['task'])
+        models.TicketReservation.objects.reserve(
+            'expired', {self.ticket_type.pk: 4},
+            datetime.datetime.now() - datetime.timedelta(seconds=1))
+        tasks.release_expired_reservations()
+        self.assertEqual(5, self.get_ticket_type().available_tickets)
+
+    def test_tickets_counted_once_purchase_is_completed(self):
+        for i in range(2):
+            models.VenueTicket.objects.create(
+                purchase=self.purchase, ticket_type=self.ticket_type)
+        self.assertEqual(0, self.get_ticket_type().sold_count)
+        purchase = models.Purchase.objects.get(pk=self.purchase.pk)
+        purchase.state = 'new'
+        purchase.save()
+        self.assertEqual(2, self.get_ticket_type().sold_count)
+        self.assertEqual(3, self.get_ticket_type().available_tickets)
+        models.VenueTicket.objects.create(
+            purchase=purchase, ticket_type=self.ticket_type)
+        self.assertEqual(3, self.get_ticket_type().sold_count)
+        purchase.delete()
+        self.assertEqual(0, self.get_ticket_type().sold_count)
+        self.assertEqual([], models.TicketType.objects.rebuild_inventory(fix=False))
+
+    @mock.patch('pyconde.attendees.tasks.render_invoice')
+    @mock.patch('pyconde.attendees.utils.generate_invoice_number', return_value=1)
+    def test_reservation_released_when_purchase_is_completed(self, mock_gen_inv_nrs,
+                                                             mock_render_invoice):
+        models.TicketReservation.objects.reserve(
+            'checkout', {self.ticket_type.pk: 2},
+            datetime.datetime.now() + datetime.timedelta(minutes=30))
+        for i in range(2):
+            models.VenueTicket.objects.create(
+                purchase=self.purchase, ticket_type=self.ticket_type)
+        request = RequestFactory().get('/')
+        request.session = {}
+        self.purchase.payment_total = 200
+        utils.complete_purchase(request, self.purchase, 'checkout')
+        ticket_type = self.get_ticket_type()
+        self.assertEqual(2, ticket_type.sold_count)
+        self.assertEqual(0, ticket_type.reserved_count)
+        self.assertEqual(3, ticket_type.available_tickets)
+        self.assertFalse(models.TicketReservation.objects.exists())
+
+    def test_save_keeps_counters(self):
+        ticket_type = self.get_ticket_type()
+        models.TicketType.objects.reserve({self.ticket_type.pk: 1})
+        ticket_type.name = 'renamed'
+        ticket_type.save()
+        self.assertEqual(1, self.get_ticket_type().reserved_count)
+
+    def test_rebuild_inventory(self):
+        self.purchase.state = 'new'
+        self.purchase.save()
+        models.VenueTicket.objects.create(
+            purchase=self.purchase, ticket_type=self.ticket_type)
+        models.TicketType.objects.filter(pk=self.ticket_type.pk)\
+            .update(sold_count=4)
+        self.assertEqual([self.ticket_type.pk],
+                         models.TicketType.objects.rebuild_inventory())
+        self.assertEqual(1, self.get_ticket_type().sold_count)
+
+
 class TestTicketModel(TestCase):
     def test_ticket_editable_if_enabled_on_tickettype(self):
         user = auth_models.User()
@@ -975,3 +1485,39 @@ class TestSupportTicketModel(TestCase):
         expected = set()
         fields = models.SupportTicket.get_fields()
         self.assertEqual(expected, fields)
+
+
+class BadgeExporterTests(TestCase):
+
+    def setUp(self):
+        from ..core.benchmark import SyntheticConference
+        SyntheticConference(sections=1, locations=2, days=2, sessions=10,
+                            speakers=5, side_events=2, attendees=10).create()
+        self.tickets = models.VenueTicket.objects.only_valid().order_by('pk')
+
+    def _export(self, tickets):
+        with record() as metrics:
+            data = exporters.BadgeExporter(tickets, base_url='/u{uid}').export()
+        return data, metrics.queries
+
+    def test_queries_independent_of_ticket_count(self):
+        pks = list(self.tickets.values_list('pk', flat=True))
+        few, few_queries = self._export(self.tickets.filter(pk__in=pks[:2]))
+        many, many_queries = self._export(self.tickets)
+        self.assertEqual(2, len(few))
+        self.assertEqual(10, len(many))
+        self.assertEqual(few_queries, many_queries)
+
+    def test_profile_data(self):
+        from ..accounts.models import BadgeStatus
+        ticket = self.tickets[0]
+        profile = ticket.user.profile
+        profile.badge_status.add(BadgeStatus.objects.create(name='Volunteer',
+                                                            slug='volunteer'))
+        profile.tags.add('python')
+        badge = exporters.BadgeExporter(self.tickets.filter(pk=ticket.pk),
+                                        base_url='/u{uid}').export()[0]
+        self.assertEqual(['volunteer'], badge['status'])
+        self.assertEqual(['python'], badge['tags'])
+        self.assertEqual('/u%d' % ticket.user_id, badge['profile'])
+        self.assertEqual(2, len(badge['days']))
@@ -10,6 +10,7 @@ from django.core.cache import get_cache
 from django.conf import settings
 from django.core.mail import send_mail
 from django.core.urlresolvers import reverse
+from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.template.loader import render_to_string
 from django.utils.translation import gettext_lazy as _
@@ -37,11 +38,15 @@ def validate_vatid(own_vatid, other_vatid):
         return False
 
 
-def complete_purchase(request, purchase):
+def complete_purchase(request, purchase, reservation=None):
     """
     This method finalizes a purchase, clears voucher locks and sends the
     confirmation email.
+
+    The tickets reserved for the checkout under the given reservation key
+    are released as they are counted as sold from now on.
     """
+    from .models import TicketReservation, Voucher
     if purchase.payment_method == 'invoice':
         purchase.state = 'new'
     else:
@@ -49,14 +54,17 @@ def complete_purchase(request, purchase):
         # if they enter this stage.
         purchase.state = 'payment_received'
 
-    for ticket in purchase.ticket_set.filter(venueticket__isnull=False).filter(venueticket__voucher__isnull=False).all():
-        voucher = ticket.venueticket.voucher
-        voucher.is_used = True
-        voucher.save()
+    with transaction.commit_on_success():
+        vouchers = list(Voucher.objects.filter(venueticket__purchase=purchase))
+        if vouchers:
+            Voucher.objects.filter(pk__in=[v.pk for v in vouchers])\
+                .update(is_used=True)
+        purchase.invoice_number = generate_invoice_number()
+        purchase.save()
+        if reservation:
+            TicketReservation.objects.release(reservation)
+    for voucher in vouchers:
         unlock_voucher(request, voucher)
-    purchase.save()
-    purchase.invoice_number = generate_invoice_number()
-    purchase.save()
     send_purchase_confirmation_mail(purchase)
     tasks.render_invoice.delay(purchase_id=purchase.id)
     return HttpResponseRedirect(reverse('attendees_purchase_done'))
@@ -162,6 +170,93 @@ def unlock_voucher(request, voucher):
     cache.delete(cache_key)
 
 
+
+# Version of the checkout state stored in the session. Checkouts started
+# with another version are restarted.
+CHECKOUT_STATE_VERSION = 1
+
+
+def _dump_fields(instance):
+    """
+    Returns the values of all concrete fields except for the primary key
+    that differ from the field's default.
+    """
+    data = {}
+    for field in instance._meta.fields:
+        if field.primary_key:
+            continue
+        value = getattr(instance, field.attname)
+        if value != field.get_default():
+            data[field.attname] = value
+    return data
+
+
+def dump_purchase(purchase):
+    """
+    Converts the (maybe unsaved) purchase of a checkout into a dict of
+    primitive values that can be stored in the session.
+    """
+    return {'pk': purchase.pk, 'fields': _dump_fields(purchase)}
+
+
+def load_purchase(data):
+    from .models import Purchase
+    purchase = Purchase(**data['fields'])
+    purchase.pk = data['pk']
+    return purchase
+
+
+def dump_tickets(tickets):
+    """
+    Converts the tickets of a checkout into a list of dicts of primitive
+    values. The ticket class is determined by the ticket type when the
+    tickets are loaded again, m2m data that has not been persisted yet is
+    stored by primary key.
+    """
+    result = []
+    for ticket in tickets:
+        fields = _dump_fields(ticket)
+        fields.pop('purchase_id', None)
+        result.append({
+            'pk': ticket.pk,
+            'fields': fields,
+            'related': dict((name, [obj.pk for obj in values])
+                            for name, values in ticket.related_data.items()),
+        })
+    return result
+
+
+def load_tickets(data, purchase=None):
+    """
+    Re-creates the tickets stored with dump_tickets() with a constant number
+    of queries.
+    """
+    from .models import TicketType
+    ticket_types = TicketType.objects\
+        .select_related('content_type', 'vouchertype_needed')\
+        .in_bulk(set(item['fields']['ticket_type_id'] for item in data))
+    tickets = []
+    related = {}
+    for item in data:
+        ticket_type = ticket_types[item['fields']['ticket_type_id']]
+        ticket = ticket_type.content_type.model_class()(**item['fields'])
+        ticket.id = ticket.pk = item['pk']
+        ticket.ticket_type = ticket_type
+        if purchase is not None:
+            ticket.purchase = purchase
+        for name, pks in item['related'].items():
+            field = ticket._meta.get_field(name)
+            related.setdefault(field.rel.to, set()).update(pks)
+        tickets.append(ticket)
+    objects = dict((model, model._default_manager.in_bulk(pks))
+                   for model, pks in related.items())
+    for ticket, item in zip(tickets, data):
+        for name, pks in item['related'].items():
+            model = ticket._meta.get_field(name).rel.to
+            ticket.related_data[name] = [objects[model][pk] for pk in pks
+                                         if pk in objects[model]]
+    return tickets
+
 def generate_invoice_number(sequence_name=None):
     """
     WARNING: This method changes the state in Redis!
@@ -170,3 +265,138 @@ def generate_invoice_number(sequence_name=None):
         sequence_name = app_settings.INVOICE_NUMBER_SEQUENCE_NAME
     conn = get_redis_connection()
     return int(conn.incr(sequence_name))
+
+
+def generate_invoice_numbers(count, sequence_name=None):
+    """
+    Reserves count consecutive invoice numbers with a single round trip to
+    Redis and returns them as a list.
+
+    WARNING: This method changes the state in Redis!
+    """
+    if sequence_name is None:
+        sequence_name = app_settings.INVOICE_NUMBER_SEQUENCE_NAME
+    conn = get_redis_connection()
+    last = int(conn.incrby(sequence_name, count))
+    return range(last - count + 1, last + 1)
+
+
+class BatchJob(object):
+    """
+    Base class for jobs that process many purchases in chunks of Celery
+    tasks. The progress is kept in the cache where all workers can update
+    it; a job is finished once the counters in done_counters add up to the
+    total number of purchases.
+    """
+    title = None
+    key_prefix = None
+    counters = ()
+    done_counters = ()
+    timeout = 60 * 60 * 24
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def _get_key(self, name):
+        return '{0}:{1}:{2}'.format(self.key_prefix, self.job_id, name)
+
+    @classmethod
+    def create(cls, total):
+        job = cls(uuid.uuid4().hex)
+        values = dict((job._get_key(name), 0) for name, label in cls.counters)
+        values[job._get_key('total')] = total
+        get_cache('default').set_many(values, cls.timeout)
+        return job
+
+    def increment(self, counter, delta=1):
+        try:
+            get_cache('default').incr(self._get_key(counter), delta)
+        except ValueError:
+            # The progress has already expired.
+            pass
+
+    def get_progress(self):
+        """
+        Returns a dict with the total number of purchases, the value of
+        every counter and whether the job is finished or None if the job is
+        unknown.
+        """
+        names = ['total'] + [name for name, label in self.counters]
+        values = get_cache('default').get_many(
+            [self._get_key(name) for name in names])
+        if self._get_key('total') not in values:
+            return None
+        progress = dict((name, values.get(self._get_key(name), 0))
+                        for name in names)
+        progress['finished'] = progress['total'] <= sum(
+            progress[name] for name in self.done_counters)
+        return progress
+
+
+class InvoiceExport(BatchJob):
+    """
+    A bulk export of invoices. The invoices are rendered and mailed by
+    render_invoices tasks in chunks of INVOICE_RENDER_BATCH_SIZE purchases.
+    """
+    title = _('Invoice export')
+    key_prefix = 'invoice_export'
+    counters = (
+        ('rendered', _('Rendered')),
+        ('failed', _('Failed')),
+        ('sent', _('Mails sent')),
+    )
+    done_counters = ('rendered', 'failed')
+
+    @classmethod
+    def start(cls, queryset):
+        """
+        Queues the rendering of all purchases in the queryset that have not
+        been exported yet. Missing invoice numbers are assigned by the
+        render_invoices tasks. Returns the new InvoiceExport or None if
+        there is nothing to export.
+        """
+        purchase_ids = list(queryset.filter(exported=False).order_by('pk')
+                            .values_list('pk', flat=True))
+        if not purchase_ids:
+            return None
+
+        export = cls.create(len(purchase_ids))
+        batch_size = app_settings.INVOICE_RENDER_BATCH_SIZE
+        for idx in range(0, len(purchase_ids), batch_size):
+            tasks.render_invoices.delay(purchase_ids[idx:idx + batch_size],
+                                        export_id=export.job_id)
+        return export
+
+
+class PaymentMailing(BatchJob):
+    """
+    Sends payment confirmations or reminders for many purchases with
+    send_payment_mails tasks in chunks of MAIL_BATCH_SIZE purchases.
+    """
+    title = _('Payment mails')
+    key_prefix = 'payment_mailing'
+    counters = (
+        ('sent', _('Mails sent')),
+        ('failed', _('Failed')),
+    )
+    done_counters = ('sent', 'failed')
+
+    @classmethod
+    def start(cls, kind, queryset, **kwargs):
+        """
+        Queues the mails of the given kind ('confirmation' or 'reminder')
+        for all purchases in the queryset. Additional keyword arguments are
+        passed on to the send_payment_mails task. Returns the new
+        PaymentMailing or None if there are no purchases.
+        """
+        purchase_ids = list(queryset.order_by('pk')
+                            .values_list('pk', flat=True))
+        if not purchase_ids:
+            return None
+        mailing = cls.create(len(purchase_ids))
+        batch_size = app_settings.MAIL_BATCH_SIZE
+        for idx in range(0, len(purchase_ids), batch_size):
+            tasks.send_payment_mails.delay(
+                kind, purchase_ids[idx:idx + batch_size],
+                mailing_id=mailing.job_id, **kwargs)
+        return mailing
@@ -15,6 +15,7 @@ import datetime
 import logging
 import hashlib
 import json
+import uuid
 from collections import OrderedDict
 
 import pymill
@@ -24,6 +25,7 @@ from django.core.urlresolvers import reverse
 from django.contrib.contenttypes.models import ContentType
 from django.contrib import messages
 from django.contrib.auth import models as auth_models
+from django.db import transaction
 from django.db.models import Q
 from django.http import HttpResponseRedirect, Http404, HttpResponseForbidden, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
@@ -35,7 +37,8 @@ import django.views.generic as generic_views
 from pyconde.conference.models import current_conference
 from braces.views import LoginRequiredMixin
 
-from .models import TicketType, Ticket, VenueTicket, SIMCardTicket, Purchase
+from .models import TicketType, Ticket, VenueTicket, SIMCardTicket, Purchase,\
+    TicketReservation, bulk_create_tickets
 from .tasks import send_invoice
 from . import forms
 from . import utils
@@ -63,23 +66,46 @@ class PurchaseMixin(object):
     def __init__(self, *args, **kwargs):
         self.purchase = None
         self.tickets = []
+        self.reservation = None
+
+    @property
+    def tickets(self):
+        # The tickets of a previous state are only loaded once they are
+        # actually needed.
+        if self._tickets is None:
+            self._tickets = utils.load_tickets(self._ticket_data,
+                                               purchase=self.purchase)
+            self._ticket_data = None
+        return self._tickets
+
+    @tickets.setter
+    def tickets(self, tickets):
+        self._tickets = tickets
+        self._ticket_data = None
 
     def save_state(self, step=None):
         # Warning: To keep the form interaction as simple as possible
         #          we are storing a temporary pk with each ticket if non
         #          has been set yet.
-        if self.tickets:
-            for idx, ticket in enumerate(self.tickets):
+        if self._tickets is None:
+            tickets = self._ticket_data
+        else:
+            for idx, ticket in enumerate(self._tickets):
                 if ticket.pk is None:
                     ticket.pk = idx
+            tickets = utils.dump_tickets(self._tickets)
         expires = self.request.session.get('purchase_state', {}).get('expires')
         if expires is None:
             expires = datetime.datetime.utcnow() + datetime.timedelta(
                 seconds=settings.MAX_CHECKOUT_DURATION)
+        # Only primitive values are stored in the session. See
+        # utils.dump_purchase() and utils.dump_tickets().
         self.request.session['purchase_state'] = {
-            'purchase': self.purchase,
+            'version': utils.CHECKOUT_STATE_VERSION,
+            'purchase': utils.dump_purchase(self.purchase),
             'previous_step': step if step is not None else self.step,
-            'tickets': self.tickets,
+            'tickets': tickets,
+            'reservation': self.reservation,
             'expires': expires,
         }
 
@@ -87,46 +113,71 @@ class PurchaseMixin(object):
         state = self.request.session.get('purchase_state')
         if state is None:
             return None
+        if state.get('version') != utils.CHECKOUT_STATE_VERSION:
+            return None
         if datetime.datetime.utcnow() > state['expires']:
             return None
         self.previous_step = state['previous_step']
-        self.purchase = state['purchase']
-        self.tickets = state.get('tickets', [])
+        self.purchase = utils.load_purchase(state['purchase'])
+        self._tickets = None
+        self._ticket_data = state['tickets']
+        self.reservation = state.get('reservation')
 
         self.limited_tickets = []
         if self.step != 'done':
-            # For steps before the confirmation we calculate the number of
-            # available tickets to be rendered to the user. If we at this
-            # point run into the situation that the requested quantity can
-            # no longer be fulfilled, the checkout is aborted.
-            ticket_types = {}
-            for ticket in self.tickets:
-                if ticket.ticket_type.pk not in ticket_types:
-                    ticket_type = TicketType.objects.get(
-                        pk=ticket.ticket_type.pk)
-                    available = ticket_type.available_tickets
-                    if available is None:
-                        continue
-                    if available <= 0:
-                        raise exceptions.TicketNotAvailable(ticket_type)
-                    ticket_types[ticket_type.pk] = {
-                        'type': ticket_type,
-                        'qty': 0,
-                        'available': available
-                    }
-                ticket_types[ticket.ticket_type.pk]['qty'] += 1
-            for _, ticket_type in ticket_types.items():
-                if ticket_type['available'] - ticket_type['qty'] < 0:
-                    raise exceptions.TicketNotAvailable(ticket_type['type'])
-                self.limited_tickets.append(ticket_type)
+            # Limited tickets are reserved on the start page until the
+            # checkout expires. If the reservation no longer covers the
+            # requested quantity, the checkout is aborted.
+            quantities = self.get_limited_quantities()
+            reservations = {}
+            if quantities and self.reservation:
+                reservations = dict(
+                    (reservation.ticket_type_id, reservation)
+                    for reservation in TicketReservation.objects
+                    .filter(key=self.reservation).select_related('ticket_type'))
+            for pk, qty in quantities.items():
+                reservation = reservations.get(pk)
+                if reservation is None or reservation.quantity < qty:
+                    raise exceptions.TicketNotAvailable(
+                        TicketType.objects.get(pk=pk))
+                self.limited_tickets.append({
+                    'type': reservation.ticket_type,
+                    'qty': qty,
+                    'available': reservation.ticket_type.available_tickets + qty
+                })
 
         if self.request.user.is_authenticated():
             self.purchase.user = self.request.user
         return state
 
+    def get_limited_quantities(self):
+        """
+        Returns a dict mapping the ids of limited ticket types to the
+        number of tickets of that type in this checkout. Tickets that have
+        not been loaded yet are counted by their stored data.
+        """
+        quantities = collections.defaultdict(int)
+        if self._tickets is None:
+            for item in self._ticket_data:
+                quantities[item['fields']['ticket_type_id']] += 1
+            limited = TicketType.objects.filter(
+                pk__in=quantities.keys(), max_purchases__gt=0
+            ).values_list('pk', flat=True)
+            return dict((pk, quantities[pk]) for pk in limited)
+        for ticket in self.tickets:
+            if ticket.ticket_type.max_purchases > 0:
+                quantities[ticket.ticket_type.pk] += 1
+        return quantities
+
     def clear_purchase_info(self):
+        reservation = self.reservation
         if 'purchase_state' in self.request.session:
+            reservation = self.request.session['purchase_state'].get(
+                'reservation', reservation)
             del self.request.session['purchase_state']
+        if reservation:
+            TicketReservation.objects.release(reservation)
+        self.reservation = None
         if 'paymentform' in self.request.session:
             del self.request.session['paymentform']
         self.tickets = []
@@ -134,24 +185,23 @@ class PurchaseMixin(object):
         self.previous_step = None
 
     def persist_purchase(self):
-        # If we get into this method a second time because of a failed CC
-        # payment, we have to remove all elements attached to this purchase
-        # object and also reset things like the transaction ID.
-        self.purchase.ticket_set.all().delete()
-        self.purchase.payment_transaction = ""
-        self.purchase.save()
-
-        # Now we create the actual tickets (again)
-        for ticket in self.tickets:
-            # NOTE: At this point the ticket availability is decreased.
-            #       This is corrected by the "purge_stale_purchases"
-            #       command.
-            #       Vouchers are invalidated by complete_purchase().
-            ticket.pk = None
-            ticket.purchase = self.purchase
-            LOG.warning("persisting ticket %s of purchase %d" % (str(ticket), self.purchase.pk))
-            ticket.save()
-            ticket.save_related_data()
+        with transaction.commit_on_success():
+            # If we get into this method a second time because of a failed CC
+            # payment, we have to remove all elements attached to this
+            # purchase object and also reset things like the transaction ID.
+            if self.purchase.pk is not None:
+                self.purchase.ticket_set.all().delete()
+            self.purchase.payment_transaction = ""
+            self.purchase.save()
+
+            # Now we create the actual tickets (again). They are counted as
+            # sold once the purchase is completed and vouchers are
+            # invalidated by complete_purchase().
+            for ticket in self.tickets:
+                ticket.pk = None
+            bulk_create_tickets(self.purchase, self.tickets)
+            LOG.debug("persisted %d tickets of purchase %d" % (
+                len(self.tickets), self.purchase.pk))
 
     def setup(self):
         steps = self.steps.keys()
@@ -169,7 +219,8 @@ class PurchaseMixin(object):
         try:
             resp = self.setup()
         except exceptions.TicketNotAvailable, e:
-            messages.error(request, _("Sorry, the following ticket is no longer available in your requested quantity: %s" % e.ticket_type))
+            self.clear_purchase_info()
+            messages.error(request, _("Sorry, the following ticket is no longer available in your requested quantity: %s") % e.ticket_type)
             return HttpResponseRedirect(
                 reverse(self.steps[self.steps.keys()[0]]))
         if resp is not None:
@@ -222,6 +273,14 @@ class StartPurchaseView(LoginRequiredMixin, PurchaseMixin, generic_views.View):
             if self.tickets:
                 for ticket in self.tickets:
                     ticket_type_qty[ticket.ticket_type.pk] += 1
+            if self.reservation:
+                # The tickets reserved for this checkout are still
+                # available to it.
+                ticket_types = list(ticket_types)
+                for ticket_type in ticket_types:
+                    if ticket_type.max_purchases > 0:
+                        ticket_type.reserved_count = max(
+                            0, ticket_type.reserved_count - ticket_type_qty[ticket_type.pk])
             self.quantity_forms = [
                 forms.TicketQuantityForm(ticket_type=ticket_type, initial={
                     'quantity': ticket_type_qty[ticket_type.pk] if ticket_type_qty[ticket_type.pk] != 0 else None})
@@ -294,6 +353,21 @@ class StartPurchaseView(LoginRequiredMixin, PurchaseMixin, generic_views.View):
                                ticket_type=quantity_form.ticket_type))
             purchase.payment_total = purchase.calculate_payment_total(
                 tickets=self.tickets)
+
+            # Limited tickets are held for this checkout until it expires.
+            quantities = self.get_limited_quantities()
+            if quantities:
+                reservation = uuid.uuid4().hex
+                try:
+                    TicketReservation.objects.reserve(
+                        reservation, quantities,
+                        now() + datetime.timedelta(
+                            seconds=settings.MAX_CHECKOUT_DURATION))
+                except exceptions.TicketNotAvailable, e:
+                    messages.error(self.request, _("Sorry, the following ticket is no longer available in your requested quantity: %s") % e.ticket_type)
+                    self.tickets = []
+                    return self.get(*args, **kwargs)
+                self.reservation = reservation
             self.purchase = purchase
 
             # Please note that we don't save the purchase object nor the
@@ -440,7 +514,9 @@ class PurchaseOverviewView(LoginRequiredMixin, PurchaseMixin,
         purchase.payment_method = form.cleaned_data['payment_method']
         if purchase.payment_method == 'invoice':
             self.persist_purchase()
-            resp = utils.complete_purchase(self.request, purchase)
+            resp = utils.complete_purchase(self.request, purchase,
+                                           self.reservation)
+            self.reservation = None
             self.save_state('payment')  # We can skip this step
             return resp
         else:
@@ -517,8 +593,11 @@ class HandlePaymentView(LoginRequiredMixin, PurchaseMixin,
                     self.error = _(api.response_code2text(transaction.response_code))
                     return self.get(*args, **kwargs)
                 purchase.payment_transaction = transaction.id
+                resp = utils.complete_purchase(self.request, purchase,
+                                               self.reservation)
+                self.reservation = None
                 self.save_state()
-                return utils.complete_purchase(self.request, purchase)
+                return resp
         else:
             if purchase.payment_transaction:
                 self.error = _("Transaction already processed.")  # + purchase.payment_transaction
@@ -1,20 +1,127 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import hashlib
+import json
+import logging
+
 from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from ..core import deferred
+
+
+LOG = logging.getLogger(__name__)
+
+
+BADGE_BASE_URL = 'https://ep14.org/u{uid}'
+
+BADGE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
 
 
-def generate_badge(data):
-    try:
+class BadgeRenderer(object):
+    """
+    Renders badges to PDF. One renderer is kept per process (see
+    get_badge_renderer()), so the fonts and logos are only loaded once and
+    not for every badge.
+    """
+
+    def __init__(self):
         from badge_exporter import BadgeMaker, PAGE_SIZE, registerAdditionalFonts
-    except ImportError:
+
+        registerAdditionalFonts(settings.PURCHASE_INVOICE_FONT_ROOT)
+        ps = PAGE_SIZE[0], PAGE_SIZE[1] * 2
+        logos = getattr(settings, 'ATTENDEES_BADGE_LOGOS', {})
+        self.maker = BadgeMaker(ps, 'badge.pdf', rotate=True, logos=logos)
+
+    def render(self, data):
+        # Every badge is printed on both halves of the page
+        d = []
+        for t in data:
+            d.extend([t, t])
+        return self.maker.createBadges(d)
+
+
+_badge_renderer = None
+
+
+def get_badge_renderer():
+    """
+    Returns the renderer of this process or None if the badge exporter is
+    not installed (which is only checked once) or could not be set up.
+    """
+    global _badge_renderer
+    if _badge_renderer is None:
+        try:
+            _badge_renderer = BadgeRenderer()
+        except ImportError:
+            _badge_renderer = False
+        except Exception:
+            LOG.exception('Failed to set up the badge renderer')
+            return None
+    return _badge_renderer or None
+
+
+def get_badge_cache_key(ticket_ids):
+    if len(ticket_ids) == 1:
+        return 'checkin:badge:%d' % ticket_ids[0]
+    ids = ','.join('%d' % pk for pk in sorted(ticket_ids))
+    return 'checkin:badges:%s' % hashlib.md5(ids).hexdigest()
+
+
+def get_badge_data_hash(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True,
+                                   cls=DjangoJSONEncoder)).hexdigest()
+
+
+def generate_badge(data, renderer=None):
+    """
+    Returns the PDF with the badges for the given badge data (see
+    pyconde.attendees.exporters.BadgeExporter) or None if the badges could
+    not be rendered.
+
+    The PDF is cached per ticket (or set of tickets) together with a hash of
+    the badge data, so that it is only rendered again if the data changed.
+    """
+    if renderer is None:
+        renderer = get_badge_renderer()
+    if renderer is None:
         return None
+    key = get_badge_cache_key([badge['id'] for badge in data])
+    digest = get_badge_data_hash(data)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == digest:
+        return cached[1]
+    pdf = renderer.render(data)
+    if pdf is not None:
+        cache.set(key, (digest, pdf), BADGE_CACHE_TIMEOUT)
+    return pdf
+
+
+def get_purchase_badge_tickets(purchase_ids):
+    """
+    Returns the tickets whose badges are printed together for each of the
+    given purchases (a list of ids or a values queryset).
+    """
+    from ..attendees.models import VenueTicket
+
+    return VenueTicket.objects.filter(purchase__in=purchase_ids, canceled=False)
+
+
+def invalidate_badges(ticket_ids, render=True):
+    """
+    Removes the cached badges of the given tickets and, unless render is
+    False, renders them again in the background once the current request
+    is done (see pyconde.core.deferred), so that the workers see the
+    committed data.
+    """
+    from .tasks import queue_badge_rendering
 
-    registerAdditionalFonts(settings.PURCHASE_INVOICE_FONT_ROOT)
-    ps = PAGE_SIZE[0], PAGE_SIZE[1] * 2
-    logos = getattr(settings, 'ATTENDEES_BADGE_LOGOS', {})
-    bm = BadgeMaker(ps, 'badge.pdf', rotate=True, logos=logos)
-    d = []
-    for t in data:
-        d.extend([t, t])
-    return bm.createBadges(d)
+    ticket_ids = list(ticket_ids)
+    if not ticket_ids:
+        return
+    cache.delete_many([get_badge_cache_key([pk]) for pk in ticket_ids])
+    if render:
+        deferred.defer('checkin.render_badges', queue_badge_rendering,
+                       ticket_ids)
@@ -3,7 +3,7 @@ from __future__ import unicode_literals
 
 from django import forms
 from django.contrib.auth.models import User
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import reverse, reverse_lazy
 from django.forms import formsets
 from django.utils.translation import ugettext_lazy as _
 
@@ -12,6 +12,7 @@ from crispy_forms.layout import Field, Fieldset, Layout, Submit
 from crispy_forms.bootstrap import FieldWithButtons
 
 from ..accounts.forms import UserModelChoiceField
+from ..accounts.widgets import UserAutocompleteWidget
 from ..attendees.models import TicketType
 from ..sponsorship.models import Sponsor
 
@@ -92,7 +93,11 @@ class EditOnDeskTicketForm(forms.Form):
     last_name = forms.CharField(label=_('Last name'), max_length=250)
 
     organisation = forms.CharField(label=_('Organization'), max_length=100, required=False)
-    user_id = UserModelChoiceField(label=_('User'), queryset=None, required=False)
+    # The users are looked up by primary key only, the widget doesn't render
+    # any choices.
+    user_id = UserModelChoiceField(
+        label=_('User'), queryset=None, required=False,
+        widget=UserAutocompleteWidget(source=reverse_lazy('checkin_users')))
     sponsor_id = forms.ModelChoiceField(label=_('Sponsor'), queryset=None, required=False)
 
     def __init__(self, users, sponsors, *args, **kwargs):
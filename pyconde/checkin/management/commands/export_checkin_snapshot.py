@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from ... import snapshot
+
+
+class Command(BaseCommand):
+    help = """Exports a signed snapshot of the checkin data or, with --since,
+the changes since then."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--since', action='store', dest='since', default=None,
+                    help='Only export tickets changed since this ISO timestamp '
+                         '(the next_since of the previous snapshot)'),
+        make_option('--output', action='store', dest='output', default=None,
+                    help='File to write the snapshot to instead of stdout'),
+    )
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                raise CommandError("Invalid timestamp: {0}".format(options['since']))
+        data = snapshot.dumps(snapshot.create_snapshot(since=since or None))
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(data)
+        else:
+            self.stdout.write(data)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ... import models
+
+
+class Command(BaseCommand):
+    help = """Rebuilds the search index of the checkin."""
+
+    def handle(self, *args, **kwargs):
+        with transaction.commit_on_success():
+            count = models.update_search_index()
+        self.stdout.write("Indexed {0} ticket(s)".format(count))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ... import tasks
+
+
+class Command(BaseCommand):
+    help = """Renders the badges of all valid venue tickets into the cache in
+the background, so that the checkin desks don't have to wait for them."""
+
+    def handle(self, *args, **kwargs):
+        count = tasks.queue_badge_rendering()
+        self.stdout.write("Queued {0} badge(s)".format(count))
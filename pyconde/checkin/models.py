@@ -1,2 +1,206 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+
+import re
+
+from django.contrib.auth.models import User
+from django.db import models
+from django.db.models import Q, signals
+from django.utils.timezone import now
+
+from ..accounts.models import Profile
+from ..attendees.models import Purchase, SIMCardTicket, Ticket, VenueTicket
+from ..sponsorship.models import Sponsor
+
+from .exporters import invalidate_badges
+
+
+WORD_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+class SearchWordManager(models.Manager):
+
+    def matching(self, term):
+        """
+        Returns the ids of all tickets with a word starting with the given
+        term.
+        """
+        return self.filter(word__startswith=normalize(term))\
+            .values('ticket_id')
+
+
+class SearchWord(models.Model):
+    """
+    A normalized word (names, e-mail addresses, user names and ids) of a
+    venue or SIM card ticket, its purchase and the users involved. The
+    checkin search looks up tickets by prefixes of these words using the
+    index on the word column instead of scanning and joining all the tables
+    the words stem from.
+    """
+    ticket = models.ForeignKey(Ticket, related_name='checkin_search_words')
+    word = models.CharField(max_length=100, db_index=True)
+
+    objects = SearchWordManager()
+
+
+class IndexedTicket(models.Model):
+    """
+    Records when the checkin data of a ticket last changed or that the ticket
+    has been deleted. Used for the delta feed of the checkin snapshots (see
+    pyconde.checkin.snapshot).
+    """
+    ticket_id = models.IntegerField(primary_key=True)
+    modified = models.DateTimeField(db_index=True)
+    deleted = models.BooleanField(default=False)
+
+
+def normalize(value):
+    return ('%s' % value).strip().lower()[:SearchWord._meta.get_field('word').max_length]
+
+
+def get_words(*values):
+    """
+    Returns the normalized values together with all their parts and the
+    remainders starting at each part, so that e.g. "jane.roe@example.com"
+    can be found by "roe" and "example.com".
+    """
+    words = set()
+    for value in values:
+        if value is None or value == '':
+            continue
+        value = normalize(value)
+        words.add(value)
+        for match in WORD_RE.finditer(value):
+            words.add(match.group())
+            words.add(value[match.start():])
+    return words
+
+
+def get_ticket_words(ticket):
+    purchase = ticket.purchase
+    real_ticket = ticket.real_ticket
+    values = [ticket.pk, purchase.pk, purchase.company_name,
+              purchase.first_name, purchase.last_name, purchase.email,
+              purchase.invoice_number]
+    if real_ticket is not None:
+        values.extend([real_ticket.first_name, real_ticket.last_name])
+    for user in (ticket.user, purchase.user):
+        if user is None:
+            continue
+        values.extend([user.pk, user.username, user.email])
+        try:
+            profile = user.profile
+        except Profile.DoesNotExist:
+            continue
+        values.extend([profile.full_name, profile.display_name])
+    return get_words(*values)
+
+
+def update_search_index(tickets=None):
+    """
+    Rebuilds the search words of the given venue and SIM card tickets or of
+    all of them and marks them as modified. Returns the number of indexed
+    tickets.
+
+    This doesn't manage transactions itself as it is called from signal
+    handlers within other transactions.
+    """
+    queryset = Ticket.objects.filter(
+        Q(simcardticket__isnull=False) | Q(venueticket__isnull=False)
+    ).select_related(
+        'user__profile', 'purchase__user__profile', 'simcardticket',
+        'venueticket', 'ticket_type__content_type')
+    if tickets is not None:
+        queryset = queryset.filter(pk__in=tickets)
+    search_words = []
+    ticket_ids = []
+    for ticket in queryset:
+        ticket_ids.append(ticket.pk)
+        search_words.extend(SearchWord(ticket_id=ticket.pk, word=word)
+                            for word in get_ticket_words(ticket))
+    stale = SearchWord.objects.all()
+    if tickets is not None:
+        stale = stale.filter(ticket__in=tickets)
+    stale.delete()
+    SearchWord.objects.bulk_create(search_words)
+
+    modified = now()
+    if tickets is None:
+        IndexedTicket.objects.exclude(pk__in=ticket_ids)\
+            .update(modified=modified, deleted=True)
+    IndexedTicket.objects.filter(pk__in=ticket_ids).delete()
+    IndexedTicket.objects.bulk_create([
+        IndexedTicket(ticket_id=ticket_id, modified=modified)
+        for ticket_id in ticket_ids])
+    return len(ticket_ids)
+
+
+def _update_fields_changed(update_fields, fields):
+    return update_fields is None or bool(set(update_fields) & set(fields))
+
+
+def tickets_changed(ticket_ids):
+    """
+    Updates the search index and the cached badges of the given tickets.
+    """
+    ticket_ids = list(ticket_ids)
+    if not ticket_ids:
+        return
+    update_search_index(ticket_ids)
+    invalidate_badges(ticket_ids)
+
+
+def ticket_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    tickets_changed([instance.pk])
+
+
+def ticket_deleted(sender, instance, **kwargs):
+    IndexedTicket.objects.filter(pk=instance.pk)\
+        .update(modified=now(), deleted=True)
+    invalidate_badges([instance.pk], render=False)
+
+
+def purchase_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _update_fields_changed(update_fields, (
+            'company_name', 'first_name', 'last_name', 'email',
+            'invoice_number', 'user', 'state')):
+        return
+    tickets_changed(Ticket.objects.filter(purchase=instance)
+                    .values_list('pk', flat=True))
+
+
+def user_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Logging in only updates last_login.
+    if raw or not _update_fields_changed(update_fields, ('username', 'email')):
+        return
+    tickets_changed(Ticket.objects.filter(
+        Q(user=instance) | Q(purchase__user=instance))
+        .values_list('pk', flat=True))
+
+
+def profile_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _update_fields_changed(update_fields, (
+            'full_name', 'display_name', 'organisation')):
+        return
+    tickets_changed(Ticket.objects.filter(
+        Q(user=instance.user_id) | Q(purchase__user=instance.user_id))
+        .values_list('pk', flat=True))
+
+
+def sponsor_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    tickets_changed(VenueTicket.objects.filter(sponsor=instance)
+                    .values_list('pk', flat=True))
+
+
+signals.post_save.connect(ticket_saved, sender=Ticket, dispatch_uid='checkin.ticket_saved')
+signals.post_save.connect(ticket_saved, sender=VenueTicket, dispatch_uid='checkin.venueticket_saved')
+signals.post_save.connect(ticket_saved, sender=SIMCardTicket, dispatch_uid='checkin.simcardticket_saved')
+signals.post_delete.connect(ticket_deleted, sender=Ticket, dispatch_uid='checkin.ticket_deleted')
+signals.post_save.connect(purchase_saved, sender=Purchase, dispatch_uid='checkin.purchase_saved')
+signals.post_save.connect(user_saved, sender=User, dispatch_uid='checkin.user_saved')
+signals.post_save.connect(profile_saved, sender=Profile, dispatch_uid='checkin.profile_saved')
+signals.post_save.connect(sponsor_saved, sender=Sponsor, dispatch_uid='checkin.sponsor_saved')
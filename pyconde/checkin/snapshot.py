@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Compact, signed exports of the checkin relevant ticket data for the desk
+clients. A client loads a full snapshot once and afterwards only fetches the
+changes since the creation time of the last snapshot it got, so that
+searching works locally and syncing happens in batches.
+
+Changes are tracked by the IndexedTicket rows which are maintained together
+with the search index (see pyconde.checkin.models). Their modification time
+is taken before the change is committed, so a change may only become visible
+after a snapshot created later than that. Clients therefore have to ask for
+the changes since the "next_since" of their last snapshot, which lies a bit
+before its creation, and apply the tickets and deletions by id.
+"""
+from __future__ import unicode_literals
+
+import datetime
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils.timezone import now
+
+from ..accounts.models import Profile
+from ..attendees.exporters import BadgeExporter
+from ..attendees.models import Ticket, VenueTicket
+
+from .exporters import BADGE_BASE_URL
+from .models import IndexedTicket
+
+
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_SALT = 'pyconde.checkin.snapshot'
+
+
+def _get_ticket_data(ticket):
+    purchase = ticket.purchase
+    real_ticket = ticket.real_ticket
+    profile = None
+    if ticket.user is not None:
+        try:
+            profile = ticket.user.profile
+        except Profile.DoesNotExist:
+            pass
+    name = profile and profile.full_name or ' '.join(filter(None, [
+        getattr(real_ticket, 'first_name', None),
+        getattr(real_ticket, 'last_name', None)]))
+    return {
+        'id': ticket.pk,
+        'purchase': purchase.pk,
+        'invoice_number': purchase.invoice_number,
+        'state': purchase.state,
+        'canceled': ticket.canceled,
+        'ticket_type': ticket.ticket_type.name,
+        'kind': ticket.ticket_type.content_type.model,
+        'user': ticket.user_id,
+        'name': name,
+        'organisation': (getattr(real_ticket, 'organisation', None) or
+                         purchase.company_name or
+                         profile and profile.organisation or None),
+        'email': ticket.user.email if ticket.user_id else purchase.email,
+        'badge': None,
+    }
+
+
+def get_tickets_data(ticket_ids=None):
+    """
+    Returns the data of the given or all venue and SIM card tickets including
+    the badge data of paid venue tickets.
+    """
+    queryset = Ticket.objects.filter(
+        Q(simcardticket__isnull=False) | Q(venueticket__isnull=False)
+    ).select_related(
+        'user__profile', 'purchase', 'simcardticket', 'venueticket',
+        'ticket_type__content_type')
+    venue_tickets = VenueTicket.objects.all()
+    if ticket_ids is not None:
+        queryset = queryset.filter(pk__in=ticket_ids)
+        venue_tickets = venue_tickets.filter(pk__in=ticket_ids)
+    tickets = dict((ticket.pk, _get_ticket_data(ticket))
+                   for ticket in queryset.order_by('pk'))
+    badges = BadgeExporter(venue_tickets, BADGE_BASE_URL, indent=False)
+    for badge in badges.export():
+        if badge['id'] in tickets:
+            tickets[badge['id']]['badge'] = badge
+    return [tickets[pk] for pk in sorted(tickets)]
+
+
+def create_snapshot(since=None):
+    """
+    Returns the data of all tickets or, if since is given, of all tickets
+    that changed since then together with the ids of deleted tickets.
+
+    The creation time is taken before querying the tickets. The next delta
+    has to be requested since next_since, which overlaps with this snapshot
+    by CHECKIN_SNAPSHOT_OVERLAP seconds to include changes that were
+    committed only afterwards.
+    """
+    created = now()
+    overlap = datetime.timedelta(
+        seconds=getattr(settings, 'CHECKIN_SNAPSHOT_OVERLAP', 300))
+    deleted = []
+    if since is None:
+        tickets = get_tickets_data()
+    else:
+        changed = IndexedTicket.objects.filter(modified__gte=since)
+        deleted = list(changed.filter(deleted=True)
+                       .values_list('ticket_id', flat=True))
+        tickets = get_tickets_data(changed.filter(deleted=False)
+                                   .values_list('ticket_id', flat=True))
+    return {
+        'version': SNAPSHOT_VERSION,
+        'created': created.isoformat(),
+        'next_since': (created - overlap).isoformat(),
+        'since': since.isoformat() if since is not None else None,
+        'tickets': tickets,
+        'deleted': sorted(deleted),
+    }
+
+
+def _get_key():
+    return getattr(settings, 'CHECKIN_SNAPSHOT_KEY', None) or settings.SECRET_KEY
+
+
+def dumps(snapshot):
+    """
+    Returns the snapshot as signed and compressed string (see
+    django.core.signing).
+    """
+    return signing.dumps(snapshot, key=_get_key(), salt=SNAPSHOT_SALT,
+                         compress=True)
+
+
+def loads(data):
+    return signing.loads(data, key=_get_key(), salt=SNAPSHOT_SALT)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import collections
+import logging
+
+from django.conf import settings
+
+from pyconde.celery import app
+
+
+LOG = logging.getLogger(__name__)
+
+# Number of badges rendered by a single render_badges task.
+BADGE_RENDER_BATCH_SIZE = getattr(settings, 'CHECKIN_BADGE_RENDER_BATCH_SIZE', 50)
+
+
+@app.task(ignore_result=True)
+def render_badges(ticket_ids):
+    """
+    Renders the badges of all given (valid) venue tickets into the cache
+    using the renderer of this worker. The combined badges of their
+    purchases with several tickets are rendered as well. Returns the number
+    of rendered PDFs.
+    """
+    from ..attendees.exporters import BadgeExporter
+    from ..attendees.models import VenueTicket
+    from .exporters import (BADGE_BASE_URL, generate_badge, get_badge_renderer,
+                            get_purchase_badge_tickets)
+
+    renderer = get_badge_renderer()
+    if renderer is None:
+        LOG.warn('The badge renderer is not available. Skipping')
+        return 0
+    # Canceled tickets change the combined badges of their purchases, too.
+    purchase_ids = VenueTicket.objects.filter(
+        pk__in=ticket_ids, purchase__state='payment_received'
+    ).values('purchase_id')
+    # All valid tickets of these purchases are exported at once and the
+    # badges are grouped by purchase afterwards.
+    tickets = get_purchase_badge_tickets(purchase_ids)
+    ticket_purchases = dict(tickets.values_list('pk', 'purchase_id'))
+    data = BadgeExporter(tickets, BADGE_BASE_URL, indent=False).export()
+    ticket_ids = set(ticket_ids)
+    batches = [[badge] for badge in data if badge['id'] in ticket_ids]
+    purchase_badges = collections.defaultdict(list)
+    for badge in data:
+        if badge['id'] in ticket_purchases:
+            purchase_badges[ticket_purchases[badge['id']]].append(badge)
+    for purchase_id in sorted(purchase_badges):
+        if len(purchase_badges[purchase_id]) > 1:
+            batches.append(purchase_badges[purchase_id])
+    count = 0
+    for batch in batches:
+        try:
+            if generate_badge(batch, renderer=renderer) is not None:
+                count += 1
+        except Exception:
+            LOG.exception('Error rendering the badges of tickets %s',
+                          [badge['id'] for badge in batch])
+    return count
+
+
+def queue_badge_rendering(ticket_ids=None):
+    """
+    Queues render_badges tasks in chunks of BADGE_RENDER_BATCH_SIZE for the
+    given or all valid venue tickets. Returns the number of queued tickets.
+    """
+    from ..attendees.models import VenueTicket
+
+    if ticket_ids is None:
+        ticket_ids = VenueTicket.objects.only_valid()\
+            .values_list('pk', flat=True)
+    ticket_ids = sorted(ticket_ids)
+    for idx in range(0, len(ticket_ids), BADGE_RENDER_BATCH_SIZE):
+        render_badges.delay(ticket_ids[idx:idx + BADGE_RENDER_BATCH_SIZE])
+    return len(ticket_ids)
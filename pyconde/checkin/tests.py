@@ -2,15 +2,27 @@
 from __future__ import unicode_literals
 
 import datetime
+import json
+import re
 
+import mock
+
+from django.conf import settings
 from django.contrib.auth.models import Permission, User
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import get_cache
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 
 from ..accounts.models import Profile
 from ..attendees.models import Purchase, TicketType, VenueTicket
+from ..core import deferred
+from ..core.metrics import MetricsBudgetMixin, record
+
+from . import exporters, snapshot, tasks
+from .models import IndexedTicket
 
 
 def escape_redirect(s):
@@ -36,7 +48,7 @@ class ViewTests(TestCase):
         self.client.login(username='user', password='password')
 
 
-class SearchViewTests(ViewTests):
+class SearchViewTests(MetricsBudgetMixin, ViewTests):
 
     def test_search_required_login(self):
         url = reverse('checkin_search')
@@ -60,6 +72,178 @@ class SearchViewTests(ViewTests):
             self.client.get(url, follow=True).status_code,
             200)
 
+    def test_search_queries_independent_of_result_count(self):
+        self._create_user(permissions=True)
+        user = User.objects.get(username='user')
+        purchase = Purchase.objects.create(user=user, first_name='John',
+                                           last_name='Doe')
+        tt = TicketType.objects.create(name='ticket_type',
+            date_valid_from=now() - datetime.timedelta(days=1),
+            date_valid_to=now() + datetime.timedelta(days=1),
+            content_type=self.vt_ct)
+        url = reverse('checkin_search') + '?query=Doe'
+        VenueTicket.objects.create(purchase=purchase, ticket_type=tt,
+                                   user=user, first_name='John',
+                                   last_name='Doe')
+        baseline = self.client.get(url).metrics
+        for idx in range(10):
+            VenueTicket.objects.create(purchase=purchase, ticket_type=tt,
+                                       user=user, first_name='John %d' % idx,
+                                       last_name='Doe')
+        self.assertMetricsBudget(self.client.get(url), queries=baseline.queries)
+
+
+    def test_search_index(self):
+        self._create_user(permissions=True)
+        user = User.objects.get(username='user')
+        buyer = User.objects.create_user(username='buyer',
+                                         email='buyer@example.com')
+        Profile.objects.create(user=buyer)
+        purchase = Purchase.objects.create(user=buyer, first_name='Jane',
+                                           last_name='Roe',
+                                           company_name='ACME Corp.')
+        tt = TicketType.objects.create(name='ticket_type',
+            date_valid_from=now() - datetime.timedelta(days=1),
+            date_valid_to=now() + datetime.timedelta(days=1),
+            content_type=self.vt_ct)
+        ticket = VenueTicket.objects.create(purchase=purchase, ticket_type=tt,
+                                            first_name='John',
+                                            last_name='Doe')
+        url = reverse('checkin_search')
+
+        def search(query):
+            response = self.client.get(url, {'query': query})
+            return [obj['ticket']['id'] for obj in response.context['results']]
+
+        self.assertEqual([ticket.pk], search('jo do'))
+        self.assertEqual([ticket.pk], search('ACME'))
+        self.assertEqual([ticket.pk], search('example.com'))
+        self.assertEqual([ticket.pk], search('buyer@exa'))
+        self.assertEqual([], search('oh'))
+        self.assertEqual([], search('john smith'))
+
+        # The index follows changes of the purchase, the users and profiles
+        purchase.company_name = 'Initech'
+        purchase.save()
+        self.assertEqual([], search('acme'))
+        self.assertEqual([ticket.pk], search('initech'))
+        ticket.user = user
+        ticket.save()
+        profile = Profile.objects.get(user=user)
+        profile.full_name = 'Johnny Walker'
+        profile.save()
+        self.assertEqual([ticket.pk], search('walk'))
+        ticket.delete()
+        self.assertEqual([], search('walk'))
+
+
+class SnapshotViewTests(ViewTests):
+
+    def test_snapshot_required_permission(self):
+        self._create_user()
+        url = reverse('checkin_snapshot')
+        self.assertRedirects(
+            self.client.get(url, follow=True),
+            '/en/accounts/login/?next=' + escape_redirect(url))
+
+    def test_snapshot_and_delta(self):
+        self._create_user(permissions=True)
+        purchase = Purchase.objects.create(first_name='Jane', last_name='Roe',
+                                           company_name='ACME Corp.')
+        tt = TicketType.objects.create(name='ticket_type',
+            date_valid_from=now() - datetime.timedelta(days=1),
+            date_valid_to=now() + datetime.timedelta(days=1),
+            content_type=self.vt_ct)
+        tickets = [VenueTicket.objects.create(purchase=purchase, ticket_type=tt,
+                                              first_name='John %d' % idx,
+                                              last_name='Doe')
+                   for idx in range(3)]
+        url = reverse('checkin_snapshot')
+
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        data = snapshot.loads(response.content)
+        self.assertEqual([t.pk for t in tickets],
+                         [t['id'] for t in data['tickets']])
+        self.assertEqual('John 0 Doe', data['tickets'][0]['name'])
+        self.assertEqual('ACME Corp.', data['tickets'][0]['organisation'])
+        self.assertEqual([], data['deleted'])
+
+        # Move the previous changes out of the overlap of the deltas.
+        created = parse_datetime(data['created'])
+        overlap = datetime.timedelta(seconds=settings.CHECKIN_SNAPSHOT_OVERLAP)
+        self.assertEqual(created - overlap, parse_datetime(data['next_since']))
+        IndexedTicket.objects.update(modified=created - 2 * overlap)
+
+        tickets[0].last_name = 'Smith'
+        tickets[0].save()
+        deleted_pk = tickets[1].pk
+        tickets[1].delete()
+        data = snapshot.loads(self.client.get(url, {'since': data['next_since']}).content)
+        self.assertEqual([tickets[0].pk], [t['id'] for t in data['tickets']])
+        self.assertEqual('John 0 Smith', data['tickets'][0]['name'])
+        self.assertEqual([deleted_pk], data['deleted'])
+
+        # A change stamped before the last snapshot but committed only
+        # afterwards is part of the next delta.
+        created = parse_datetime(data['created'])
+        IndexedTicket.objects.update(modified=created - 2 * overlap)
+        IndexedTicket.objects.filter(pk=tickets[2].pk)\
+            .update(modified=created - datetime.timedelta(seconds=1))
+        data = snapshot.loads(self.client.get(url, {'since': data['next_since']}).content)
+        self.assertEqual([tickets[2].pk], [t['id'] for t in data['tickets']])
+        self.assertEqual([], data['deleted'])
+
+        IndexedTicket.objects.update(
+            modified=parse_datetime(data['created']) - 2 * overlap)
+        data = snapshot.loads(self.client.get(url, {'since': data['next_since']}).content)
+        self.assertEqual([], data['tickets'])
+        self.assertEqual([], data['deleted'])
+        self.assertEqual(400, self.client.get(url, {'since': 'yesterday'}).status_code)
+
+
+class UserAutocompleteViewTests(MetricsBudgetMixin, ViewTests):
+
+    def _create_users(self, count, offset=0):
+        for idx in range(offset, offset + count):
+            user = User.objects.create_user(username='attendee%02d' % idx)
+            Profile.objects.create(user=user, full_name='Attendee %d' % idx)
+
+    def test_users_required_permission(self):
+        self._create_user()
+        url = reverse('checkin_users')
+        self.assertRedirects(
+            self.client.get(url, follow=True),
+            '/en/accounts/login/?next=' + escape_redirect(url))
+
+    def test_users(self):
+        self._create_user(permissions=True)
+        self._create_users(25)
+        url = reverse('checkin_users')
+
+        data = json.loads(self.client.get(url, {'term': 'attendee'}).content)
+        self.assertEqual(20, len(data['results']))
+        self.assertTrue(data['more'])
+        self.assertEqual('Attendee 0 (attendee00)', data['results'][0]['label'])
+        data = json.loads(self.client.get(url, {'term': 'attendee', 'page': 2}).content)
+        self.assertEqual(5, len(data['results']))
+        self.assertFalse(data['more'])
+        data = json.loads(self.client.get(url, {'term': 'attendee 12'}).content)
+        self.assertEqual([User.objects.get(username='attendee12').pk],
+                         [r['value'] for r in data['results']])
+        data = json.loads(self.client.get(url, {'term': 'a'}).content)
+        self.assertEqual([], data['results'])
+
+    def test_purchase_form_independent_of_user_count(self):
+        self._create_user(permissions=True)
+        url = reverse('checkin_purchase')
+        self._create_users(1)
+        baseline = self.client.get(url).metrics
+        self._create_users(10, offset=1)
+        response = self.client.get(url)
+        self.assertMetricsBudget(response, queries=baseline.queries)
+        self.assertNotContains(response, 'attendee')
+
 
 class PurchaseViewTests(ViewTests):
 
@@ -247,6 +431,93 @@ class TicketViewTests(ViewTests):
             self.client.get(url, follow=True).status_code,
             200)
 
+    def test_ticket_badge_cached(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        cache.clear()
+        patcher = mock.patch.object(exporters, 'cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._create_user(permissions=True)
+        self.purchase.state = 'payment_received'
+        self.purchase.save()
+        self.ticket_type.valid_on = datetime.date.today()
+        self.ticket_type.save()
+        renderer = mock.Mock()
+        renderer.render.side_effect = lambda data: 'PDF %s' % data[0]['name']
+
+        url = reverse('checkin_ticket_badge', kwargs={'pk': self.ticket.pk})
+        with mock.patch('pyconde.checkin.exporters.get_badge_renderer',
+                        return_value=renderer):
+            self.assertEqual(b'PDF John Doe', self.client.get(url).content)
+            self.assertEqual(b'PDF John Doe', self.client.get(url).content)
+            self.assertEqual(1, renderer.render.call_count)
+
+            # Changing the ticket renders the badge again in the background
+            self.ticket.first_name = 'Jane'
+            self.ticket.save()
+            self.assertEqual(2, renderer.render.call_count)
+            self.assertEqual(b'PDF Jane Doe', self.client.get(url).content)
+            self.assertEqual(2, renderer.render.call_count)
+
+    def test_badges_rendered_after_request(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        cache.clear()
+        patcher = mock.patch.object(exporters, 'cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self._create_user(permissions=True)
+        self.purchase.state = 'payment_received'
+        self.purchase.save()
+        renderer = mock.Mock()
+        renderer.render.side_effect = lambda data: 'PDF %s' % ', '.join(
+            badge['name'] for badge in data)
+
+        with mock.patch('pyconde.checkin.exporters.get_badge_renderer',
+                        return_value=renderer):
+            with deferred.collect():
+                other = VenueTicket.objects.create(
+                    purchase=self.purchase, ticket_type=self.ticket_type,
+                    first_name='Jane', last_name='Doe')
+                self.ticket.save()
+                self.assertFalse(renderer.render.called)
+            # Both badges and the badges of the purchase were rendered in
+            # a single task after the changes.
+            self.assertEqual(3, renderer.render.call_count)
+            url = reverse('checkin_purchase_badges', kwargs={'pk': self.purchase.pk})
+            self.assertEqual(b'PDF Jane Doe, John Doe', self.client.get(url).content)
+            url = reverse('checkin_ticket_badge', kwargs={'pk': other.pk})
+            self.assertEqual(b'PDF Jane Doe', self.client.get(url).content)
+            self.assertEqual(3, renderer.render.call_count)
+
+    def _render_badges_of_purchases(self, count):
+        ticket_ids = []
+        for i in range(count):
+            purchase = Purchase.objects.create(state='payment_received')
+            for name in ('Jane', 'John'):
+                ticket_ids.append(VenueTicket.objects.create(
+                    purchase=purchase, ticket_type=self.ticket_type,
+                    first_name=name, last_name='Doe %d' % i).pk)
+        renderer = mock.Mock()
+        renderer.render.return_value = 'PDF'
+        with mock.patch('pyconde.checkin.exporters.get_badge_renderer',
+                        return_value=renderer):
+            with record() as metrics:
+                self.assertEqual(3 * count, tasks.render_badges(ticket_ids))
+        return metrics.queries
+
+    def test_render_badges_queries(self):
+        self.assertEqual(self._render_badges_of_purchases(1),
+                         self._render_badges_of_purchases(5))
+
+    def test_badge_renderer_failure(self):
+        with mock.patch.object(exporters, '_badge_renderer', None), \
+                mock.patch.object(exporters, 'BadgeRenderer',
+                                  side_effect=IOError('No fonts')):
+            self.ticket.first_name = 'Jane'
+            self.ticket.save()
+            self.assertIsNone(exporters.get_badge_renderer())
+        self.assertEqual('Jane', VenueTicket.objects.get(pk=self.ticket.pk).first_name)
+
     def test_ticket_update_required_login(self):
         url = reverse('checkin_ticket_update', kwargs={'pk': self.ticket.pk})
         self.assertRedirects(
@@ -278,3 +549,34 @@ class TicketViewTests(ViewTests):
         ticket = VenueTicket.objects.get(id=ticket.pk)
         self.assertEqual(ticket.first_name, 'Jane')
         self.assertEqual(ticket.last_name, 'Smith')
+
+    def test_ticket_update_user(self):
+        self._create_user(permissions=True)
+        user = User.objects.get(username='user')
+
+        url = reverse('checkin_ticket_update', kwargs={'pk': self.ticket.pk})
+        data = {'first_name': 'John', 'last_name': 'Doe', 'user_id': user.pk}
+        self.client.post(url, data=data)
+        self.assertEqual(user.pk, VenueTicket.objects.get(id=self.ticket.pk).user_id)
+        # The current user is shown by name
+        self.assertContains(self.client.get(url), 'value="user"')
+
+        data['user_id'] = 0
+        response = self.client.post(url, data=data)
+        self.assertIn('user_id', response.context['form'].errors)
+
+    def test_ticket_update_user_autocomplete(self):
+        self._create_user(permissions=True)
+        response = self.client.get(
+            reverse('checkin_ticket_update', kwargs={'pk': self.ticket.pk}))
+        # The autocompletion needs jQuery UI and the checkin script, which
+        # reads the endpoint from the visible input and fills the hidden one.
+        self.assertContains(response, 'jquery-ui.min.js')
+        self.assertContains(response, 'assets/js/ui.checkin.js')
+        widget = re.search(r'<span class="user-autocomplete">(.*?)</span>',
+                           response.content.decode('utf-8')).group(1)
+        hidden, visible = re.findall(r'<input[^>]*>', widget)
+        self.assertIn('name="user_id"', hidden)
+        self.assertIn('type="hidden"', hidden)
+        self.assertIn('class="user-autocomplete-input"', visible)
+        self.assertIn('data-source="%s"' % reverse('checkin_users'), visible)
@@ -17,4 +17,6 @@ urlpatterns = patterns(
     url(r'^ticket/(?P<pk>\d+)/edit/$', 'ticket_update_view', name='checkin_ticket_update'),
 
     url(r'^search/$', 'search_view', name='checkin_search'),
+    url(r'^users/$', 'user_autocomplete_view', name='checkin_users'),
+    url(r'^snapshot/$', 'snapshot_view', name='checkin_snapshot'),
 )
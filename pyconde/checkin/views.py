@@ -1,10 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-import operator
+import json
 import uuid
 
-from functools import reduce
 from itertools import chain
 
 from django.conf import settings
@@ -15,14 +14,17 @@ from django.core import signing
 from django.core.urlresolvers import reverse
 from django.db import models, transaction
 from django.forms.formsets import formset_factory
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import (HttpResponse, HttpResponseBadRequest,
+    HttpResponseRedirect, Http404)
 from django.shortcuts import get_object_or_404
+from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
 from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _, ungettext_lazy
-from django.views.generic import DetailView, FormView, ListView
+from django.views.generic import DetailView, FormView, ListView, View
 from django.views.decorators.http import require_POST
 
+from ..accounts.utils import get_full_name
 from ..attendees.exporters import BadgeExporter
 from ..attendees.models import (Purchase, Ticket, TicketType, SIMCardTicket,
     SupportTicket, VenueTicket)
@@ -30,7 +32,10 @@ from ..attendees.tasks import render_invoice
 from ..attendees.utils import generate_invoice_number
 from ..conference.models import current_conference
 
-from .exporters import generate_badge
+from . import snapshot
+from .exporters import (BADGE_BASE_URL, generate_badge,
+                        get_purchase_badge_tickets)
+from .models import SearchWord
 from .forms import (OnDeskPurchaseForm, EditOnDeskTicketForm,
     NewOnDeskTicketForm, BaseOnDeskTicketFormSet, SearchForm, get_users,
     get_sponsors)
@@ -58,30 +63,6 @@ class SearchView(CheckinViewMixin, SearchFormMixin, ListView):
     template_name = 'checkin/search.html'
     model = Ticket
     context_object_name = 'results'
-    search_fields = (
-        'user__id',
-        'user__username',
-        'user__email',
-        'user__profile__full_name',
-        'user__profile__display_name',
-        'id',
-        'purchase__id',
-        'purchase__company_name',
-        'purchase__first_name',
-        'purchase__last_name',
-        'purchase__email',
-        'purchase__invoice_number',
-        'purchase__user__id',
-        'purchase__user__username',
-        'purchase__user__email',
-        'purchase__user__profile__full_name',
-        'purchase__user__profile__display_name',
-        'simcardticket__first_name',
-        'simcardticket__last_name',
-        'venueticket__first_name',
-        'venueticket__last_name',
-    )
-
     def get_context_data(self, **kwargs):
         context = super(SearchView, self).get_context_data(**kwargs)
         context['searched'] = 'query' in self.request.GET
@@ -102,12 +83,10 @@ class SearchView(CheckinViewMixin, SearchFormMixin, ListView):
             models.Q(simcardticket__isnull=False) |
             models.Q(venueticket__isnull=False)
         )
+        # Every term has to match the beginning of one of the words in the
+        # search index of a ticket (see models.SearchWord).
         for term in self.search_terms:
-            queries = [
-                models.Q(**{search_field + '__icontains': term})
-                for search_field in self.search_fields
-            ]
-            queryset = queryset.filter(reduce(operator.or_, queries))
+            queryset = queryset.filter(pk__in=SearchWord.objects.matching(term))
         return queryset
 
     def get(self, *args, **kwargs):
@@ -164,6 +143,48 @@ class SearchView(CheckinViewMixin, SearchFormMixin, ListView):
 search_view = SearchView.as_view()
 
 
+class UserAutocompleteView(CheckinViewMixin, View):
+    """
+    Returns one page of the users matching all words of the "term" parameter
+    as JSON for the user selection of the on-desk forms.
+    """
+    paginate_by = 20
+    min_length = 2
+
+    def get_queryset(self, term):
+        queryset = get_users().order_by('username')
+        for word in term.split():
+            queryset = queryset.filter(
+                models.Q(username__icontains=word) |
+                models.Q(email__icontains=word) |
+                models.Q(profile__full_name__icontains=word) |
+                models.Q(profile__display_name__icontains=word))
+        return queryset
+
+    def get(self, request):
+        term = request.GET.get('term', '').strip()
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        users = []
+        if len(term) >= self.min_length:
+            offset = (page - 1) * self.paginate_by
+            # Fetch one more user than shown to know if there is another page
+            # without counting all matches.
+            users = list(self.get_queryset(term)[offset:offset + self.paginate_by + 1])
+        result = {
+            'results': [{
+                'value': user.pk,
+                'label': '{0} ({1})'.format(get_full_name(user), user.username),
+            } for user in users[:self.paginate_by]],
+            'more': len(users) > self.paginate_by,
+        }
+        return HttpResponse(json.dumps(result), content_type='application/json')
+
+user_autocomplete_view = UserAutocompleteView.as_view()
+
+
 class OnDeskPurchaseView(CheckinViewMixin, SearchFormMixin, FormView):
     form_class = OnDeskPurchaseForm
     salt = 'pyconde.checkin.purchase'
@@ -384,7 +405,7 @@ def purchase_invoice_view(request, pk):
 @permission_required('accounts.see_checkin_info')
 def purchase_badges_view(request, pk):
     purchase = get_object_or_404(Purchase, pk=pk)
-    tickets = VenueTicket.objects.filter(purchase_id=purchase.pk)
+    tickets = get_purchase_badge_tickets([purchase.pk]).select_related('purchase')
     return ticket_badge_view(request, tickets)
 
 
@@ -491,7 +512,7 @@ def ticket_badge_view(request, pk):
         url = reverse('checkin_purchase_detail', kwargs={'pk': ticket[0].purchase_id})
         return HttpResponseRedirect(url)
 
-    be = BadgeExporter(ticket, 'https://ep14.org/u{uid}', indent=False)
+    be = BadgeExporter(ticket, BADGE_BASE_URL, indent=False)
     data = be.export()
     pdf = generate_badge(data)
     if pdf is not None:
@@ -506,3 +527,21 @@ def ticket_badge_view(request, pk):
         messages.error(request, msg)
         url = reverse('checkin_purchase_detail', kwargs={'pk': ticket[0].purchase_id})
         return HttpResponseRedirect(url)
+
+
+@permission_required('accounts.see_checkin_info')
+def snapshot_view(request):
+    """
+    Returns a signed snapshot of all checkin relevant ticket data or, with
+    the since parameter, the changes since then (see
+    pyconde.checkin.snapshot).
+    """
+    since = request.GET.get('since')
+    if since:
+        since = parse_datetime(since)
+        if since is None:
+            return HttpResponseBadRequest('Invalid since parameter')
+    else:
+        since = None
+    data = snapshot.create_snapshot(since=since)
+    return HttpResponse(snapshot.dumps(data), content_type='text/plain')
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the schedule builder and the various exporters based on
+synthetic conferences of configurable size.
+
+The data is generated into the current conference (see the CONFERENCE_ID
+setting). Use :func:`run_benchmarks` inside a transaction that is rolled back
+afterwards (as the ``benchmark_schedule`` management command does) unless
+you are working with a throw-away database.
+"""
+from __future__ import unicode_literals
+
+import collections
+import datetime
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+
+from pyconde.accounts.models import Profile
+from pyconde.attendees import models as attendees_models
+from pyconde.attendees.exporters import BadgeExporter
+from pyconde.conference import models as conference_models
+from pyconde.schedule import exporters as schedule_exporters
+from pyconde.schedule import models as schedule_models
+from pyconde.schedule import utils as schedule_utils
+from pyconde.speakers.models import Speaker
+
+
+BenchmarkResult = collections.namedtuple('BenchmarkResult',
+                                         'name seconds queries memory items')
+
+
+class SyntheticConference(object):
+    """
+    Generates a conference with the given number of sections, locations,
+    sessions, speakers, side events and attendees.
+
+    Sessions are distributed over all days, sections and locations and are
+    never overlapping within a location. Every day additionally gets a global
+    lunch break that counts towards the side events.
+    """
+
+    day_start = datetime.time(9, 0)
+    lunch_start = datetime.time(12, 30)
+    lunch_end = datetime.time(13, 30)
+    day_end = datetime.time(18, 0)
+
+    def __init__(self, sections=2, locations=8, days=3, sessions=200,
+                 speakers=150, side_events=10, attendees=500, seed=0):
+        self.num_sections = sections
+        self.num_locations = locations
+        self.num_days = days
+        self.num_sessions = sessions
+        self.num_speakers = speakers
+        self.num_side_events = side_events
+        self.num_attendees = attendees
+        self.random = random.Random(seed)
+
+    def create(self):
+        """
+        Creates all objects and returns the conference they belong to.
+        """
+        self.conference = self._create_conference()
+        self.sections = self._create_sections()
+        self.locations = self._create_locations()
+        self._create_session_metadata()
+        self.speakers = self._create_speakers()
+        self.sessions = self._create_sessions()
+        self._create_side_events()
+        self._create_attendees()
+        return self.conference
+
+    def _create_conference(self):
+        # Not using current_conference() as its cache may be outdated.
+        try:
+            conference = conference_models.Conference.objects.get(
+                pk=settings.CONFERENCE_ID)
+        except conference_models.Conference.DoesNotExist:
+            today = datetime.date.today()
+            conference = conference_models.Conference.objects.create(
+                pk=settings.CONFERENCE_ID, title='Synthetic conference',
+                start_date=today, end_date=today + datetime.timedelta(days=self.num_days - 1))
+        if conference.start_date is None:
+            conference.start_date = datetime.date.today()
+            conference.end_date = conference.start_date + datetime.timedelta(days=self.num_days - 1)
+            conference.save()
+        conference_models.CONFERENCE_CACHE[settings.CONFERENCE_ID] = conference
+        return conference
+
+    def _create_sections(self):
+        conference_models.Section.objects.bulk_create([
+            conference_models.Section(
+                conference=self.conference, name='Synthetic section %d' % i,
+                slug='synthetic-section-%d' % i, order=i,
+                start_date=self.conference.start_date,
+                end_date=self.conference.end_date)
+            for i in range(self.num_sections)])
+        return list(conference_models.Section.objects.filter(
+            conference=self.conference, slug__startswith='synthetic-section-'))
+
+    def _create_locations(self):
+        conference_models.Location.objects.bulk_create([
+            conference_models.Location(
+                conference=self.conference, name='Synthetic room %d' % i,
+                slug='synthetic-room-%d' % i, order=i)
+            for i in range(self.num_locations)])
+        return list(conference_models.Location.objects.filter(
+            conference=self.conference, slug__startswith='synthetic-room-'))
+
+    def _create_session_metadata(self):
+        self.audience_level = conference_models.AudienceLevel.objects.create(
+            conference=self.conference, name='Synthetic level',
+            slug='synthetic-level', level=1)
+        self.durations = [
+            conference_models.SessionDuration.objects.create(
+                conference=self.conference, label='%d minutes' % minutes,
+                slug='synthetic-%d' % minutes, minutes=minutes)
+            for minutes in (30, 45, 60)]
+        self.kinds = [
+            conference_models.SessionKind.objects.create(
+                conference=self.conference, name=slug.title(), slug=slug,
+                closed=True)
+            for slug in ('talk', 'training', 'keynote')]
+        self.track = conference_models.Track.objects.create(
+            conference=self.conference, name='Synthetic track',
+            slug='synthetic-track')
+
+    def _create_users(self, prefix, count):
+        User.objects.bulk_create([
+            User(username='%s-%d' % (prefix, i), email='%s-%d@example.com' % (prefix, i),
+                 first_name='First %d' % i, last_name='Last %d' % i)
+            for i in range(count)])
+        users = list(User.objects.filter(username__startswith='%s-' % prefix).order_by('pk'))
+        Profile.objects.bulk_create([
+            Profile(user=user, full_name='%s %s' % (user.first_name, user.last_name),
+                    short_info='Synthetic user', organisation='Synthetic Inc.')
+            for user in users])
+        Speaker.objects.bulk_create([Speaker(user=user) for user in users])
+        return users
+
+    def _create_speakers(self):
+        users = self._create_users('synthetic-speaker', self.num_speakers)
+        return list(Speaker.objects.filter(user__in=users).order_by('pk'))
+
+    def _iter_slots(self):
+        """
+        Yields (section, location, duration, start, end) for non-overlapping
+        sessions. The number of sessions is capped by the available time.
+        """
+        count = 0
+        for day in range(self.num_days):
+            date = self.conference.start_date + datetime.timedelta(days=day)
+            for idx, location in enumerate(self.locations):
+                section = self.sections[idx % len(self.sections)]
+                for start_time, end_time in ((self.day_start, self.lunch_start),
+                                             (self.lunch_end, self.day_end)):
+                    start = datetime.datetime.combine(date, start_time)
+                    until = datetime.datetime.combine(date, end_time)
+                    while count < self.num_sessions:
+                        duration = self.random.choice(self.durations)
+                        end = start + datetime.timedelta(minutes=duration.minutes)
+                        if end > until:
+                            break
+                        yield section, location, duration, start, end
+                        count += 1
+                        start = end
+
+    def _create_sessions(self):
+        slots = list(self._iter_slots())
+        schedule_models.Session.objects.bulk_create([
+            schedule_models.Session(
+                conference=self.conference, section=section,
+                title='Synthetic session %d' % idx,
+                description='Description of session %d' % idx,
+                abstract='Abstract of *session* %d' % idx,
+                speaker=self.random.choice(self.speakers),
+                kind=self.random.choice(self.kinds),
+                audience_level=self.audience_level, duration=duration,
+                track=self.track, start=start, end=end, released=True)
+            for idx, (section, location, duration, start, end) in enumerate(slots)])
+        sessions = list(schedule_models.Session.objects.filter(
+            conference=self.conference, title__startswith='Synthetic session ').order_by('pk'))
+        schedule_models.Session.location.through.objects.bulk_create([
+            schedule_models.Session.location.through(session=session, location=slot[1])
+            for session, slot in zip(sessions, slots)])
+        additional = []
+        for session in sessions:
+            if self.random.random() < 0.2:
+                additional.append(schedule_models.Session.additional_speakers.through(
+                    session=session, speaker=self.random.choice(self.speakers)))
+        schedule_models.Session.additional_speakers.through.objects.bulk_create(additional)
+        return sessions
+
+    def _create_side_events(self):
+        side_events = []
+        for day in range(self.num_days):
+            date = self.conference.start_date + datetime.timedelta(days=day)
+            if len(side_events) < self.num_side_events:
+                side_events.append(schedule_models.SideEvent(
+                    conference=self.conference, name='Synthetic lunch %d' % day,
+                    description='Lunch break',
+                    start=datetime.datetime.combine(date, self.lunch_start),
+                    end=datetime.datetime.combine(date, self.lunch_end),
+                    is_global=True, is_pause=True))
+        idx = 0
+        while len(side_events) < self.num_side_events:
+            date = self.conference.start_date + datetime.timedelta(days=idx % self.num_days)
+            start = datetime.datetime.combine(date, self.day_end) + datetime.timedelta(hours=idx // self.num_days)
+            side_events.append(schedule_models.SideEvent(
+                conference=self.conference, name='Synthetic side event %d' % idx,
+                description='Description of side event %d' % idx, start=start, end=start + datetime.timedelta(hours=1)))
+            idx += 1
+        schedule_models.SideEvent.objects.bulk_create(side_events)
+        locations = []
+        for evt in schedule_models.SideEvent.objects.filter(
+                conference=self.conference, is_global=False,
+                name__startswith='Synthetic side event '):
+            locations.append(schedule_models.SideEvent.location.through(
+                sideevent=evt, location=self.random.choice(self.locations)))
+        schedule_models.SideEvent.location.through.objects.bulk_create(locations)
+
+    def _create_attendees(self):
+        users = self._create_users('synthetic-attendee', self.num_attendees)
+        ticket_type = attendees_models.TicketType.objects.create(
+            conference=self.conference, name='Synthetic ticket', fee=100,
+            date_valid_from=datetime.datetime.now(),
+            date_valid_to=datetime.datetime.now() + datetime.timedelta(days=1),
+            content_type=ContentType.objects.get_for_model(attendees_models.VenueTicket))
+        profiles = dict(Profile.objects.filter(user__in=users).values_list('user', 'pk'))
+        trainings = [s for s in self.sessions if s.kind_id == self.kinds[1].pk]
+        purchase = None
+        attending = []
+        for idx, user in enumerate(users):
+            if idx % 5 == 0:
+                purchase = attendees_models.Purchase.objects.create(
+                    conference=self.conference, user=user,
+                    first_name=user.first_name, last_name=user.last_name,
+                    email=user.email, street='Street', zip_code='12345',
+                    city='City', country='Country', state='payment_received',
+                    payment_total=500)
+            # Multi-table inheritance prevents bulk_create for tickets.
+            attendees_models.VenueTicket.objects.create(
+                purchase=purchase, ticket_type=ticket_type, user=user,
+                first_name=user.first_name, last_name=user.last_name)
+            if trainings and self.random.random() < 0.3:
+                attending.append(Profile.sessions_attending.through(
+                    profile_id=profiles[user.pk], session=self.random.choice(trainings)))
+        Profile.sessions_attending.through.objects.bulk_create(attending)
+
+
+def get_rss():
+    """
+    Returns the current resident set size of this process in kB or None if
+    it is not available (only Linux is supported).
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            pages = int(fp.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() // 1024
+
+
+class RSSSampler(threading.Thread):
+    """
+    Samples the resident set size of this process in the background to
+    determine how much it grew at most while the sampler was running.
+    """
+
+    def __init__(self, interval=0.005):
+        super(RSSSampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.baseline = get_rss()
+        self.peak = self.baseline
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.sample()
+            self._stopped.wait(self.interval)
+
+    def sample(self):
+        rss = get_rss()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+    @property
+    def growth(self):
+        if self.baseline is None:
+            return None
+        return self.peak - self.baseline
+
+
+def measure(name, func):
+    """
+    Calls func, which has to return the number of items it produced, and
+    returns a BenchmarkResult with the wall time, the number of SQL queries,
+    the peak growth of the resident set size in kB (sampled, so short spikes
+    may be missed; None if not available) and the number of items.
+
+    Memory that is already held by the process (e.g. from a previous
+    benchmark) is reused without showing up as growth.
+    """
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    queries_before = len(connection.queries)
+    sampler = RSSSampler()
+    sampler.start()
+    try:
+        start = time.time()
+        items = func()
+        seconds = time.time() - start
+        queries = len(connection.queries) - queries_before
+    finally:
+        sampler.stop()
+        connection.use_debug_cursor = use_debug_cursor
+    return BenchmarkResult(name, seconds, queries, sampler.growth, items)
+
+
+def _export_xml(path, base_url):
+    schedule_exporters.XMLExporter(path, base_url=base_url).export()
+    with open(path) as fp:
+        return fp.read().count('<entry ')
+
+
+def run_benchmarks(base_url='http://example.com'):
+    """
+    Runs the schedule builder and all exporters against the data currently
+    stored in the database and returns a list of BenchmarkResults.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Every benchmark returns the number of sections, events or badges
+        # it produced.
+        benchmarks = [
+            ('create_schedule', lambda: len(schedule_utils.create_schedule(
+                row_duration=15, uncached=True))),
+            ('create_schedule (merged)', lambda: len(schedule_utils.create_schedule(
+                row_duration=15, uncached=True, merge_sections=True))),
+            ('XMLExporter', lambda: _export_xml(
+                os.path.join(tmpdir, 'schedule.xml'), base_url)),
+            ('XMLExporterPentabarf', lambda: schedule_exporters.XMLExporterPentabarf()
+                .export().getvalue().count('<vevent>')),
+            ('GuidebookExporterSessions', lambda: len(
+                schedule_exporters.GuidebookExporterSessions()())),
+            ('BadgeExporter', lambda: len(BadgeExporter(
+                attendees_models.VenueTicket.objects.only_valid(),
+                base_url=base_url + '/{uid}').export())),
+        ]
+        return [measure(name, func) for name, func in benchmarks]
+    finally:
+        shutil.rmtree(tmpdir)
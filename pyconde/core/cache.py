@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Cache backends that report hits and misses to the request metrics (see
+pyconde.core.metrics).
+"""
+import threading
+
+from django.core.cache.backends import locmem
+
+from redis_cache import cache as redis_cache
+
+from . import metrics
+
+
+_missing = object()
+
+
+class MetricsCacheMixin(object):
+    """
+    Counts the results of get and get_many. Backends implementing get_many
+    on top of get only count the outer get_many call.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MetricsCacheMixin, self).__init__(*args, **kwargs)
+        self._metrics_local = threading.local()
+
+    def get(self, key, default=None, version=None, **kwargs):
+        value = super(MetricsCacheMixin, self).get(key, _missing,
+                                                   version=version, **kwargs)
+        hit = value is not _missing
+        if not getattr(self._metrics_local, 'in_get_many', False):
+            metrics.record_cache_lookup(hits=int(hit), misses=int(not hit))
+        return value if hit else default
+
+    def get_many(self, keys, version=None, **kwargs):
+        keys = list(keys)
+        self._metrics_local.in_get_many = True
+        try:
+            result = super(MetricsCacheMixin, self).get_many(
+                keys, version=version, **kwargs)
+        finally:
+            self._metrics_local.in_get_many = False
+        metrics.record_cache_lookup(hits=len(result),
+                                    misses=len(keys) - len(result))
+        return result
+
+
+class RedisCache(MetricsCacheMixin, redis_cache.RedisCache):
+    pass
+
+
+class LocMemCache(MetricsCacheMixin, locmem.LocMemCache):
+    pass
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Defers work triggered by model changes (e.g. in signal handlers) until the
+current request has been processed and coalesces repeated calls.
+
+Django 1.5 has no hook for running code after a transaction has been
+committed. As requests are not wrapped in a transaction, all transaction
+blocks of a view are done once the view returns, so the
+DeferredCallsMiddleware in pyconde.core.middleware runs the deferred calls
+at that point. Outside of a request (or a :func:`collect` block) the calls
+are made right away.
+
+Exceptions raised by deferred calls are logged and never propagate to the
+code that triggered them.
+"""
+import contextlib
+import logging
+import threading
+
+from django.utils.datastructures import SortedDict
+
+
+LOG = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def defer(key, func, items=()):
+    """
+    Calls func with the set of the given items once the current request is
+    done. All calls deferred with the same key are merged into a single
+    call of the function deferred first with the union of all items.
+    """
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        _call(key, func, set(items))
+        return
+    if key not in pending:
+        pending[key] = (func, set())
+    pending[key][1].update(items)
+
+
+def _call(key, func, items):
+    try:
+        func(items)
+    except Exception:
+        LOG.exception('Deferred call %s failed', key)
+
+
+def start():
+    """
+    Starts collecting deferred calls in this thread. Returns False if calls
+    are already being collected.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        return False
+    _local.pending = SortedDict()
+    return True
+
+
+def flush():
+    """
+    Makes all deferred calls and stops collecting them. Calls deferred
+    while flushing are made right away.
+    """
+    pending = getattr(_local, 'pending', None)
+    _local.pending = None
+    if pending:
+        for key, (func, items) in pending.items():
+            _call(key, func, items)
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Collects all calls deferred within the wrapped block and makes them
+    at its end. Nested blocks are part of the outermost one.
+    """
+    started = start()
+    try:
+        yield
+    finally:
+        if started:
+            flush()
@@ -0,0 +1,59 @@
+from optparse import make_option
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from ... import benchmark
+
+
+class Command(BaseCommand):
+    help = ("Generates a synthetic conference and measures the schedule "
+            "builder and the exporters against it. All generated data is "
+            "rolled back afterwards.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sections', action='store', type='int',
+                    dest='sections', default=2,
+                    help='Number of sections'),
+        make_option('--locations', action='store', type='int',
+                    dest='locations', default=8,
+                    help='Number of locations'),
+        make_option('--days', action='store', type='int',
+                    dest='days', default=3,
+                    help='Number of conference days'),
+        make_option('--sessions', action='store', type='int',
+                    dest='sessions', default=200,
+                    help='Number of sessions (capped by the available rooms and days)'),
+        make_option('--speakers', action='store', type='int',
+                    dest='speakers', default=150,
+                    help='Number of speakers'),
+        make_option('--side-events', action='store', type='int',
+                    dest='side_events', default=10,
+                    help='Number of side events including lunch breaks'),
+        make_option('--attendees', action='store', type='int',
+                    dest='attendees', default=500,
+                    help='Number of attendees with a venue ticket'),
+        make_option('--seed', action='store', type='int',
+                    dest='seed', default=0,
+                    help='Seed for the random generator'),
+    )
+
+    def handle(self, *args, **options):
+        generator = benchmark.SyntheticConference(
+            sections=options['sections'], locations=options['locations'],
+            days=options['days'], sessions=options['sessions'],
+            speakers=options['speakers'],
+            side_events=options['side_events'],
+            attendees=options['attendees'], seed=options['seed'])
+        with transaction.commit_manually():
+            try:
+                generator.create()
+                results = benchmark.run_benchmarks()
+            finally:
+                transaction.rollback()
+        self.stdout.write('{0:<30} {1:>8} {2:>10} {3:>8} {4:>16}'.format(
+            'Benchmark', 'Items', 'Seconds', 'Queries', 'RSS growth (kB)'))
+        for result in results:
+            self.stdout.write('{0:<30} {1:>8} {2:>10.3f} {3:>8} {4:>16}'.format(
+                result.name, result.items, result.seconds, result.queries,
+                'n/a' if result.memory is None else result.memory))
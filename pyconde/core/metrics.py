@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Collects the number of SQL queries, the time spent in them, the overall wall
+time and the number of cache hits and misses while a request (or any other
+block of code) is processed.
+
+The RequestMetricsMiddleware in pyconde.core.middleware uses this for every
+request, while tests can assert budgets on the collected numbers using the
+MetricsBudgetMixin.
+"""
+import contextlib
+import threading
+import time
+
+from django.db import connections
+
+
+_local = threading.local()
+
+
+class RequestMetrics(object):
+    """
+    Counters for a single request. Queries are counted by a
+    CountingCursorWrapper around the cursors of every database connection.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.duration = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._started = None
+        self._parent = None
+
+    def start(self):
+        self._started = time.time()
+        for conn in connections.all():
+            install_counting_cursor(conn)
+        self._parent = get_current_metrics()
+        _local.metrics = self
+
+    def stop(self):
+        if get_current_metrics() is self:
+            _local.metrics = self._parent
+        self.duration = time.time() - self._started
+
+    def as_headers(self):
+        return {
+            'X-Request-Time': '%.1f' % (self.duration * 1000),
+            'X-SQL-Queries': str(self.queries),
+            'X-SQL-Time': '%.1f' % (self.query_time * 1000),
+            'X-Cache-Hits': str(self.cache_hits),
+            'X-Cache-Misses': str(self.cache_misses),
+        }
+
+    def __unicode__(self):
+        return u'%.1fms, %d queries (%.1fms), cache %d hits / %d misses' % (
+            self.duration * 1000, self.queries, self.query_time * 1000,
+            self.cache_hits, self.cache_misses)
+
+
+def get_current_metrics():
+    """
+    Returns the metrics currently being recorded in this thread or None.
+    """
+    return getattr(_local, 'metrics', None)
+
+
+class CountingCursorWrapper(object):
+    """
+    Counts the queries executed through a cursor and the time spent in them
+    for the metrics currently being recorded. Unlike Django's debug cursor
+    it doesn't keep the SQL, so it is cheap enough to be used in
+    production.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, *args, **kwargs):
+        return self._timed(self.cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._timed(self.cursor.executemany, *args, **kwargs)
+
+    def _timed(self, method, *args, **kwargs):
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            record_query(time.time() - start)
+
+
+def install_counting_cursor(conn):
+    """
+    Wraps all cursors the given database connection hands out from now on
+    in a CountingCursorWrapper.
+    """
+    if getattr(conn, '_counting_cursor', False):
+        return
+    cursor = conn.cursor
+    conn.cursor = lambda: CountingCursorWrapper(cursor())
+    conn._counting_cursor = True
+
+
+def record_query(duration):
+    metrics = get_current_metrics()
+    while metrics is not None:
+        metrics.queries += 1
+        metrics.query_time += duration
+        metrics = metrics._parent
+
+
+def record_cache_lookup(hits=0, misses=0):
+    metrics = get_current_metrics()
+    while metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+        metrics = metrics._parent
+
+
+@contextlib.contextmanager
+def record():
+    """
+    Records metrics for the wrapped block. Requests made through the test
+    client in that block are included.
+    """
+    metrics = RequestMetrics()
+    metrics.start()
+    try:
+        yield metrics
+    finally:
+        metrics.stop()
+
+
+class MetricsBudgetMixin(object):
+    """
+    TestCase mixin for asserting that a response (with the
+    RequestMetricsMiddleware active) or a RequestMetrics instance stays
+    within the given budget.
+    """
+
+    def assertMetricsBudget(self, response_or_metrics, queries=None,
+                            cache_misses=None):
+        metrics = getattr(response_or_metrics, 'metrics', response_or_metrics)
+        self.assertTrue(isinstance(metrics, RequestMetrics),
+                        "No metrics were recorded for this response")
+        if queries is not None:
+            self.assertTrue(
+                metrics.queries <= queries,
+                "%d queries executed, budget is %d" % (metrics.queries, queries))
+        if cache_misses is not None:
+            self.assertTrue(
+                metrics.cache_misses <= cache_misses,
+                "%d cache misses, budget is %d" % (metrics.cache_misses, cache_misses))
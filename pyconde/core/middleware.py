@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import deferred
+from . import metrics
+
+
+LOG = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware(object):
+    """
+    Records SQL queries, timing and cache lookups for every request. In debug
+    mode the numbers are exposed as X-* response headers, otherwise they are
+    logged. The recorded metrics are available as ``response.metrics``.
+
+    This middleware should be the first one in MIDDLEWARE_CLASSES so that
+    the other middlewares are included in the numbers.
+    """
+
+    def __init__(self):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed()
+
+    def process_request(self, request):
+        request._metrics = metrics.RequestMetrics()
+        request._metrics.start()
+
+    def process_response(self, request, response):
+        request_metrics = getattr(request, '_metrics', None)
+        if request_metrics is None:
+            return response
+        del request._metrics
+        request_metrics.stop()
+        response.metrics = request_metrics
+        if settings.DEBUG:
+            for header, value in request_metrics.as_headers().items():
+                response[header] = value
+        else:
+            LOG.info(u'%s %s %d: %s', request.method, request.path,
+                     response.status_code, unicode(request_metrics))
+        return response
+
+
+class DeferredCallsMiddleware(object):
+    """
+    Makes the calls deferred while processing a request (see
+    pyconde.core.deferred) once the response is ready.
+    """
+
+    def process_request(self, request):
+        # Calls left over by a request that failed in a middleware.
+        deferred.flush()
+        deferred.start()
+
+    def process_response(self, request, response):
+        deferred.flush()
+        return response
@@ -1,7 +1,21 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
 
+from pyconde.attendees.models import VenueTicket
+from pyconde.conference import models as conference_models
+from pyconde.schedule import models as schedule_models
+
+from . import benchmark
+from . import cache
+from . import deferred
+from . import metrics
+from .middleware import DeferredCallsMiddleware, RequestMetricsMiddleware
 from .management.commands.optimize_media_images import is_thumbnail
-from .templatetags import core_tags
 
 
 class OptimizeMediaImagesTests(TestCase):
@@ -12,9 +26,142 @@ class OptimizeMediaImagesTests(TestCase):
         self.assertTrue(is_thumbnail('image.jpg.112x44_q85_crop.png'))
 
 
-class DomainFilterTests(TestCase):
-    def test_valid_url(self):
-        self.assertEquals("domain.com", core_tags.domain("http://domain.com/path"))
+class DeferredCallsTests(TestCase):
+    def test_call_outside_request(self):
+        calls = []
+        deferred.defer('test', calls.append, [1, 2])
+        self.assertEquals([set([1, 2])], calls)
+
+    def test_calls_coalesced(self):
+        calls = []
+        with deferred.collect():
+            deferred.defer('test', calls.append, [1])
+            with deferred.collect():
+                deferred.defer('test', calls.append, [2])
+            deferred.defer('other', calls.append)
+            self.assertEquals([], calls)
+        self.assertEquals([set([1, 2]), set()], calls)
+
+    def test_errors_are_logged(self):
+        calls = []
+
+        def fail(items):
+            raise RuntimeError()
+        with deferred.collect():
+            deferred.defer('fail', fail, [1])
+            deferred.defer('test', calls.append, [1])
+        self.assertEquals([set([1])], calls)
+        deferred.defer('fail', fail, [1])
+
+    def test_middleware(self):
+        calls = []
+        middleware = DeferredCallsMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        deferred.defer('test', calls.append, [1])
+        self.assertEquals([], calls)
+        middleware.process_response(request, HttpResponse())
+        self.assertEquals([set([1])], calls)
+
+
+class BenchmarkTests(TestCase):
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def test_synthetic_conference(self):
+        generator = benchmark.SyntheticConference(
+            sections=2, locations=3, days=2, sessions=20, speakers=10,
+            side_events=4, attendees=10)
+        generator.create()
+        self.assertEquals(20, len(generator.sessions))
+        self.assertEquals(4, schedule_models.SideEvent.objects.filter(
+            name__startswith='Synthetic').count())
+        self.assertEquals(10, VenueTicket.objects.only_valid().count())
+
+    def test_run_benchmarks(self):
+        benchmark.SyntheticConference(
+            sections=1, locations=2, days=1, sessions=5, speakers=5,
+            side_events=1, attendees=5).create()
+        results = benchmark.run_benchmarks()
+        self.assertEquals(
+            ['create_schedule', 'create_schedule (merged)', 'XMLExporter',
+             'XMLExporterPentabarf', 'GuidebookExporterSessions',
+             'BadgeExporter'],
+            [result.name for result in results])
+        for result in results:
+            self.assertTrue(result.queries > 0)
+            self.assertTrue(result.memory is None or result.memory >= 0)
+
+        conference = conference_models.current_conference()
+        sessions = schedule_models.Session.objects.filter(
+            conference=conference, released=True, start__isnull=False,
+            end__isnull=False)
+        side_events = schedule_models.SideEvent.objects.filter(
+            conference=conference, start__isnull=False, end__isnull=False)
+        items = dict((result.name, result.items) for result in results)
+        self.assertEquals(1, items['create_schedule (merged)'])
+        self.assertEquals(sessions.count() + side_events.count(),
+                          items['XMLExporter'])
+        self.assertEquals(
+            sessions.filter(kind__slug__in=('talk', 'keynote', 'sponsored')).count() +
+            side_events.filter(is_recordable=True).count(),
+            items['XMLExporterPentabarf'])
+        self.assertEquals(
+            sessions.exclude(kind__slug='poster').count() + side_events.count(),
+            items['GuidebookExporterSessions'])
+        self.assertEquals(VenueTicket.objects.only_valid().count(),
+                          items['BadgeExporter'])
+
+    def test_rss_sampler(self):
+        sampler = benchmark.RSSSampler()
+        sampler.start()
+        data = ' ' * (20 * 1024 * 1024)
+        sampler.stop()
+        if sampler.growth is not None:
+            self.assertTrue(sampler.growth >= 10 * 1024)
+        del data
+
+
+class RequestMetricsTests(TestCase):
+    def test_record_queries(self):
+        with metrics.record() as recorded:
+            User.objects.count()
+            User.objects.count()
+        self.assertEquals(2, recorded.queries)
+
+    def test_record_cache_lookups(self):
+        backend = cache.LocMemCache('metrics-tests', {})
+        backend.set('a', 1)
+        with metrics.record() as recorded:
+            self.assertEquals(1, backend.get('a'))
+            self.assertEquals('default', backend.get('b', 'default'))
+            self.assertEquals({'a': 1}, backend.get_many(['a', 'b', 'c']))
+        self.assertEquals(2, recorded.cache_hits)
+        self.assertEquals(3, recorded.cache_misses)
+
+    @override_settings(DEBUG=True)
+    def test_middleware_headers(self):
+        middleware = RequestMetricsMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        User.objects.count()
+        response = middleware.process_response(request, HttpResponse())
+        self.assertEquals(1, response.metrics.queries)
+        self.assertEquals('1', response['X-SQL-Queries'])
+        self.assertIn('X-Cache-Misses', response)
+
+    @override_settings(DEBUG=False)
+    def test_middleware_without_debug(self):
+        middleware = RequestMetricsMiddleware()
+        request = RequestFactory().get('/')
+        logged_queries = len(connection.queries)
+        middleware.process_request(request)
+        User.objects.count()
+        response = middleware.process_response(request, HttpResponse())
+        self.assertEquals(1, response.metrics.queries)
+        self.assertNotIn('X-SQL-Queries', response)
+        # Unlike with the debug cursor, the SQL isn't kept
+        self.assertEquals(logged_queries, len(connection.queries))
 
-    def test_invalid_url(self):
-        self.assertEquals("invalid", core_tags.domain("invalid"))
+    @override_settings(REQUEST_METRICS=False)
+    def test_middleware_disabled(self):
+        self.assertRaises(MiddlewareNotUsed, RequestMetricsMiddleware)
@@ -4,7 +4,6 @@ from django import forms
 from django.contrib import admin
 from django.contrib.auth import models as auth_models
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.db.transaction import commit_on_success
 from django.http import HttpResponse
@@ -39,7 +38,6 @@ def accept_reviewer_request(modeladmin, request, queryset):
         for reviewer in queryset.select_related('user').all():
             reviewer.user.user_permissions.add(perm)
         queryset.update(state=models.Reviewer.STATE_ACCEPTED)
-        cache.delete('reviewer_pks')
 accept_reviewer_request.short_description = _("Accept selected user requests to become a reviewer.")
 
 
@@ -49,7 +47,6 @@ def decline_reviewer_request(modeladmin, request, queryset):
         for reviewer in queryset.select_related('user').all():
             reviewer.user.user_permissions.remove(perm)
         queryset.update(state=models.Reviewer.STATE_DECLINED)
-        cache.delete('reviewer_pks')
 decline_reviewer_request.short_description = _("Decline selected user requests to become a reviewer.")
 
 
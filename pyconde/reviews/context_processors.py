@@ -1,13 +1,22 @@
+from django.utils.functional import SimpleLazyObject
+
 from . import utils
 
 
 def review_roles(request):
-    can_review = False
-    can_see_proposal_author = False
-    if hasattr(request, 'user'):
-        can_review = utils.can_review_proposal(request.user)
-        can_see_proposal_author = utils.can_see_proposal_author(request.user)
+    """
+    Adds the review roles of the current user. They are only looked up if a
+    template actually uses them.
+    """
+    user = getattr(request, 'user', None)
+    if user is None:
+        return {
+            'is_reviewer': False,
+            'can_see_proposal_author': False,
+        }
     return {
-        'is_reviewer': can_review,
-        'can_see_proposal_author': can_see_proposal_author,
+        'is_reviewer': SimpleLazyObject(
+            lambda: utils.can_review_proposal(user)),
+        'can_see_proposal_author': SimpleLazyObject(
+            lambda: utils.can_see_proposal_author(user)),
     }
@@ -9,7 +9,7 @@ from crispy_forms.layout import Layout, Field, ButtonHolder, HTML, Fieldset, But
 
 from taggit.utils import edit_string_for_tags
 
-from . import models
+from . import models, utils
 from pyconde.proposals import forms as proposal_forms
 from pyconde.conference import models as conference_models
 from pyconde.forms import Submit
@@ -166,5 +166,6 @@ class ProposalFilterForm(forms.Form):
 
     def __init__(self, *args, **kwargs):
         super(ProposalFilterForm, self).__init__(*args, **kwargs)
-        self.fields['track'].choices = [('', ugettext('Track')), ('-', '----------')] + [(t.slug, t.name) for t in conference_models.Track.objects.all()]
-        self.fields['kind'].choices = [('', ugettext('Session type')), ('-', '----------')] + [(t.slug, t.name) for t in conference_models.SessionKind.objects.exclude(slug='keynote').all()]
+        choices = utils.get_filter_choices()
+        self.fields['track'].choices = [('', ugettext('Track')), ('-', '----------')] + choices['track']
+        self.fields['kind'].choices = [('', ugettext('Session type')), ('-', '----------')] + choices['kind']
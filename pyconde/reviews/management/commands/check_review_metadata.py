@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ... import models
+
+
+class Command(BaseCommand):
+    help = """Checks that the incrementally updated metadata of proposals
+    matches the actual comments, reviews and versions. Meant to be run
+    periodically."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--fix',
+            action='store_true',
+            dest='fix',
+            default=False,
+            help='Update inconsistent metadata'),
+        )
+
+    def handle(self, *args, **options):
+        inconsistent = models.rebuild_proposal_metadata(fix=options['fix'])
+        for proposal_id in inconsistent:
+            models.logger.warning("Inconsistent review metadata for proposal %d", proposal_id)
+        if inconsistent:
+            self.stdout.write("{0} proposal(s) with inconsistent metadata{1}: {2}".format(
+                len(inconsistent), ' (fixed)' if options['fix'] else '',
+                ', '.join(map(str, inconsistent))))
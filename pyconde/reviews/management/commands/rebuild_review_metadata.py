@@ -7,5 +7,5 @@ class Command(BaseCommand):
     help = """Rebuilds metadata of proposals."""
 
     def handle(self, *args, **kwargs):
-        for proposal in models.Proposal.objects.all():
-            models._update_proposal_metadata(proposal)
+        rebuilt = models.rebuild_proposal_metadata(fix=True)
+        self.stdout.write("Updated metadata of {0} proposal(s)".format(len(rebuilt)))
@@ -7,7 +7,6 @@ from django.utils.translation import ugettext_lazy as _
 from django.utils.timezone import now
 from django.contrib.auth import models as auth_models
 from django.core.urlresolvers import reverse
-from django.core.cache import cache
 
 from pyconde.proposals import models as proposal_models
 from pyconde.conference import models as conference_models
@@ -269,7 +268,23 @@ def create_proposal_metadata(sender, instance, **kwargs):
         md.save()
 
 
+def _get_latest_activity_date(latest_comment_date, latest_version_date,
+                              latest_review_date):
+    if latest_comment_date and latest_version_date:
+        return max(latest_comment_date, latest_version_date)
+    elif latest_comment_date:
+        return latest_comment_date
+    return latest_review_date
+
+
+def _get_rating_score(rating):
+    return settings.RATING_MAPPING.get(rating, 0.0)
+
+
 def _update_proposal_metadata(proposal):
+    """
+    Recalculates the metadata of the given proposal from scratch.
+    """
     if isinstance(proposal, proposal_models.Proposal)  and not isinstance(proposal, Proposal):
         # Ugly but we have to convert this instance into our proxy model here
         # for the signal hander also to work in the admin.
@@ -280,51 +295,181 @@ def _update_proposal_metadata(proposal):
         md = proposal.review_metadata
     except ProposalMetaData.DoesNotExist:
         md = ProposalMetaData(proposal=proposal)
-    md.num_comments = proposal.comments.count()
-    md.num_reviews = proposal.reviews.count()
-
-    latest_comment_date = None
-    latest_review_date = None
-    latest_version_date = None
+    values = compute_proposal_metadata([proposal.pk])[proposal.pk]
+    for field, value in values.items():
+        setattr(md, field, value)
+    md.save()
 
-    try:
-        latest_version = ProposalVersion.objects.get_latest_for(proposal)
-        md.latest_proposalversion = latest_version
-        if latest_version:
-            latest_version_date = latest_version.pub_date
-    except Exception:
-        logger.debug("Failed to fetch latest version of proposal", exc_info=True)
-        md.latest_proposalversion = None
 
-    score = 0.0
+def compute_proposal_metadata(proposal_ids=None):
+    """
+    Calculates the metadata of all proposals (or only of those with the
+    given ids) using one aggregate query per related model. Returns a dict
+    mapping proposal ids to dicts of ProposalMetaData field values.
+    """
+    proposals = Proposal.objects.all()
+    comments = Comment.objects.all()
+    reviews = Review.objects.all()
+    versions = ProposalVersion.objects.all()
+    if proposal_ids is not None:
+        proposals = proposals.filter(pk__in=proposal_ids)
+        comments = comments.filter(proposal__in=proposal_ids)
+        reviews = reviews.filter(proposal__in=proposal_ids)
+        versions = versions.filter(original__in=proposal_ids)
+
+    result = {}
+    for pk in proposals.values_list('pk', flat=True):
+        result[pk] = {
+            'latest_proposalversion_id': None,
+            'num_comments': 0,
+            'num_reviews': 0,
+            'latest_comment_date': None,
+            'latest_review_date': None,
+            'latest_version_date': None,
+            'score': 0.0,
+        }
+
+    for row in comments.values('proposal').order_by() \
+            .annotate(num=models.Count('pk'), latest=models.Max('pub_date')):
+        values = result.get(row['proposal'])
+        if values is not None:
+            values['num_comments'] = row['num']
+            values['latest_comment_date'] = row['latest']
+
+    for row in reviews.values('proposal', 'rating').order_by() \
+            .annotate(num=models.Count('pk'), latest=models.Max('pub_date')):
+        values = result.get(row['proposal'])
+        if values is not None:
+            values['num_reviews'] += row['num']
+            values['score'] += row['num'] * _get_rating_score(row['rating'])
+            if values['latest_review_date'] is None or row['latest'] > values['latest_review_date']:
+                values['latest_review_date'] = row['latest']
+
+    # Ordered by date so that the latest version of every proposal wins.
+    for proposal_id, version_id, pub_date in versions \
+            .values_list('original', 'pk', 'pub_date') \
+            .order_by('original', 'pub_date', 'pk'):
+        values = result.get(proposal_id)
+        if values is not None:
+            values['latest_proposalversion_id'] = version_id
+            values['latest_version_date'] = pub_date
+
+    for values in result.values():
+        values['latest_activity_date'] = _get_latest_activity_date(
+            values['latest_comment_date'], values['latest_version_date'],
+            values['latest_review_date'])
+    return result
+
+
+def rebuild_proposal_metadata(proposal_ids=None, fix=True):
+    """
+    Compares the stored metadata with freshly calculated values and returns
+    the ids of all proposals whose metadata was inconsistent or missing. If
+    fix is True, these are updated.
+    """
+    expected = compute_proposal_metadata(proposal_ids)
+    existing = ProposalMetaData.objects.all()
+    if proposal_ids is not None:
+        existing = existing.filter(proposal__in=proposal_ids)
+    existing = dict((md.proposal_id, md) for md in existing)
+    inconsistent = []
+    missing = []
+    for proposal_id, values in expected.items():
+        md = existing.get(proposal_id)
+        if md is None:
+            inconsistent.append(proposal_id)
+            missing.append(ProposalMetaData(proposal_id=proposal_id, **values))
+            continue
+        changed = [field for field, value in values.items()
+                   if getattr(md, field) != value]
+        if changed == ['score'] and abs(md.score - values['score']) < 1e-6:
+            changed = []
+        if not changed:
+            continue
+        inconsistent.append(proposal_id)
+        if fix:
+            for field, value in values.items():
+                setattr(md, field, value)
+            md.save()
+    if fix and missing:
+        ProposalMetaData.objects.bulk_create(missing)
+    return sorted(inconsistent)
+
+
+def _apply_metadata_delta(proposal_id, num_comments=0, num_reviews=0,
+                          score=0.0, comment_date=None, review_date=None,
+                          version=None):
+    """
+    Adjusts the metadata of a proposal by the given deltas without
+    recalculating everything. Counters and the score are changed atomically
+    in the database, dates are only moved forward. Returns False if the
+    proposal has no metadata yet.
+    """
+    metadata = ProposalMetaData.objects.filter(proposal_id=proposal_id)
+    updates = {}
+    if num_comments:
+        updates['num_comments'] = models.F('num_comments') + num_comments
+    if num_reviews:
+        updates['num_reviews'] = models.F('num_reviews') + num_reviews
+    if score:
+        updates['score'] = models.F('score') + score
+    if updates and not metadata.update(**updates):
+        return False
+    if comment_date is None and review_date is None and version is None:
+        return True
     try:
-        latest_comment_date = proposal.comments.order_by('-pub_date')[0].pub_date
-    except:
-        pass
+        md = metadata.get()
+    except ProposalMetaData.DoesNotExist:
+        return False
+    if comment_date is not None and (md.latest_comment_date is None or comment_date > md.latest_comment_date):
+        md.latest_comment_date = comment_date
+    if review_date is not None and (md.latest_review_date is None or review_date > md.latest_review_date):
+        md.latest_review_date = review_date
+    if version is not None and (md.latest_proposalversion_id == version.pk or
+                                md.latest_version_date is None or
+                                version.pub_date >= md.latest_version_date):
+        md.latest_proposalversion = version
+        md.latest_version_date = version.pub_date
+    md.latest_activity_date = _get_latest_activity_date(
+        md.latest_comment_date, md.latest_version_date, md.latest_review_date)
+    md.save(update_fields=['latest_comment_date', 'latest_review_date',
+                           'latest_proposalversion', 'latest_version_date',
+                           'latest_activity_date'])
+    return True
+
+
+def _revert_metadata_dates(proposal_id, comment_date=None, review_date=None,
+                           version=None):
+    """
+    Called after a comment, review or version was removed. Only if it was the
+    latest one, the respective date is looked up again. Returns False if the
+    proposal has no metadata (anymore).
+    """
     try:
-        for review in proposal.reviews.order_by('pub_date'):
-            latest_review_date = review.pub_date
-            score += settings.RATING_MAPPING[review.rating]
-    except:
-        pass
-    if latest_comment_date and latest_version_date:
-        if latest_comment_date > latest_version_date:
-            md.latest_activity_date = latest_comment_date
-        else:
-            md.latest_activity_date = latest_version_date
-    elif latest_comment_date:
-        md.latest_activity_date = latest_comment_date
+        md = ProposalMetaData.objects.get(proposal_id=proposal_id)
+    except ProposalMetaData.DoesNotExist:
+        return False
+    if comment_date is not None and md.latest_comment_date == comment_date:
+        md.latest_comment_date = Comment.objects.filter(proposal=proposal_id) \
+            .aggregate(latest=models.Max('pub_date'))['latest']
+    elif review_date is not None and md.latest_review_date == review_date:
+        md.latest_review_date = Review.objects.filter(proposal=proposal_id) \
+            .aggregate(latest=models.Max('pub_date'))['latest']
+    elif version is not None and md.latest_proposalversion_id == version.pk:
+        latest_version = ProposalVersion.objects.get_latest_for(proposal_id)
+        md.latest_proposalversion = latest_version
+        md.latest_version_date = latest_version.pub_date if latest_version else None
     else:
-        md.latest_activity_date = latest_review_date
-
-    md.latest_comment_date = latest_comment_date
-    md.latest_review_date = latest_review_date
-    md.latest_version_date = latest_version_date
-    md.score = score
-    md.save()
+        return True
+    md.latest_activity_date = _get_latest_activity_date(
+        md.latest_comment_date, md.latest_version_date, md.latest_review_date)
+    md.save(update_fields=['latest_comment_date', 'latest_review_date',
+                           'latest_proposalversion', 'latest_version_date',
+                           'latest_activity_date'])
+    return True
 
 
-def update_proposal_metadata(sender, instance, **kwargs):
+def _rebuild_metadata_of(instance):
     if isinstance(instance, ProposalVersion):
         try:
             proposal = instance.original
@@ -338,23 +483,144 @@ def update_proposal_metadata(sender, instance, **kwargs):
     _update_proposal_metadata(proposal)
 
 
-def clear_reviewer_cache(sender, instance, **kwargs):
-    logger.debug("Clearing reviewer_pks cache")
-    cache.delete('reviewer_pks')
+def remember_review_rating(sender, instance, **kwargs):
+    """
+    Keeps the rating a review was loaded with in order to calculate the
+    score delta once it is saved.
+    """
+    instance._stored_rating = instance.rating if instance.pk else None
+
+
+def review_saved(sender, instance, created, **kwargs):
+    score = _get_rating_score(instance.rating)
+    if created:
+        updated = _apply_metadata_delta(instance.proposal_id, num_reviews=1,
+                                        score=score,
+                                        review_date=instance.pub_date)
+    else:
+        score -= _get_rating_score(getattr(instance, '_stored_rating', None))
+        updated = _apply_metadata_delta(instance.proposal_id, score=score,
+                                        review_date=instance.pub_date)
+    instance._stored_rating = instance.rating
+    if not updated:
+        _rebuild_metadata_of(instance)
+
+
+def review_deleted(sender, instance, **kwargs):
+    score = _get_rating_score(getattr(instance, '_stored_rating', instance.rating))
+    if not (_apply_metadata_delta(instance.proposal_id, num_reviews=-1, score=-score) and
+            _revert_metadata_dates(instance.proposal_id, review_date=instance.pub_date)):
+        _rebuild_metadata_of(instance)
+
+
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        updated = _apply_metadata_delta(instance.proposal_id, num_comments=1,
+                                        comment_date=instance.pub_date)
+    else:
+        updated = _apply_metadata_delta(instance.proposal_id,
+                                        comment_date=instance.pub_date)
+    if not updated:
+        _rebuild_metadata_of(instance)
+
+
+def comment_deleted(sender, instance, **kwargs):
+    if not (_apply_metadata_delta(instance.proposal_id, num_comments=-1) and
+            _revert_metadata_dates(instance.proposal_id, comment_date=instance.pub_date)):
+        _rebuild_metadata_of(instance)
+
+
+def version_saved(sender, instance, **kwargs):
+    if not _apply_metadata_delta(instance.original_id, version=instance):
+        _rebuild_metadata_of(instance)
+
+
+def version_deleted(sender, instance, **kwargs):
+    if not _revert_metadata_dates(instance.original_id, version=instance):
+        _rebuild_metadata_of(instance)
+
+
+def user_saved(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # Logging in only updates last_login and new users have no permissions
+    # yet, so the roles only have to be looked up again if the superuser or
+    # active status might have changed.
+    from .utils import invalidate_review_roles
+    if raw or created:
+        return
+    if update_fields is not None and not set(update_fields) & set(['is_superuser', 'is_active']):
+        return
+    invalidate_review_roles([instance.pk])
+
+
+def user_deleted(sender, instance, **kwargs):
+    from .utils import invalidate_review_roles
+    invalidate_review_roles([instance.pk])
+
+
+def user_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the roles of the users whose permissions or groups changed.
+    """
+    from .utils import clear_reviewer_cache, invalidate_review_roles
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_review_roles([instance.pk])
+    elif pk_set is not None:
+        invalidate_review_roles(pk_set)
+    else:
+        # The users of a cleared permission or group are not known anymore
+        clear_reviewer_cache()
+
+
+def group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the roles of the members of groups whose permissions
+    changed.
+    """
+    from .utils import clear_reviewer_cache, invalidate_review_roles
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_review_roles(instance.user_set.values_list('pk', flat=True))
+    elif pk_set is not None:
+        invalidate_review_roles(auth_models.User.objects.filter(groups__in=pk_set)
+                                .values_list('pk', flat=True).distinct())
+    else:
+        clear_reviewer_cache()
+
+
+def group_deleted(sender, instance, **kwargs):
+    from .utils import invalidate_review_roles
+    invalidate_review_roles(instance.user_set.values_list('pk', flat=True))
+
+
+def permission_deleted(sender, instance, **kwargs):
+    from .utils import clear_reviewer_cache
+    clear_reviewer_cache()
+
+
+def filter_choices_changed(sender, instance, **kwargs):
+    from .utils import invalidate_filter_choices
+    invalidate_filter_choices(instance.conference_id)
 
 
 signals.post_save.connect(create_proposal_metadata, sender=proposal_models.Proposal, dispatch_uid='reviews.proposal_metadata_creation')
-signals.post_save.connect(update_proposal_metadata, sender=Comment, dispatch_uid='reviews.update_proposal_comments_count')
-signals.post_save.connect(update_proposal_metadata, sender=Review, dispatch_uid='reviews.update_proposal_reviews_count')
-signals.post_save.connect(update_proposal_metadata, sender=ProposalVersion, dispatch_uid='reviews.update_proposal_version_count')
-signals.post_delete.connect(update_proposal_metadata, sender=Comment, dispatch_uid='reviews.update_proposal_comments_count_del')
-signals.post_delete.connect(update_proposal_metadata, sender=Review, dispatch_uid='reviews.update_proposal_reviews_count_del')
-signals.post_delete.connect(update_proposal_metadata, sender=ProposalVersion, dispatch_uid='reviews.update_proposal_version_count_del')
-signals.post_save.connect(clear_reviewer_cache, sender=auth_models.User, dispatch_uid='reviews.clear_reviewer_cache')
-signals.post_delete.connect(clear_reviewer_cache, sender=auth_models.User, dispatch_uid='reviews.clear_reviewer_cache_del')
-signals.post_save.connect(clear_reviewer_cache, sender=auth_models.Permission, dispatch_uid='reviews.clear_reviewer_cache_perm')
-signals.post_delete.connect(clear_reviewer_cache, sender=auth_models.Permission, dispatch_uid='reviews.clear_reviewer_cache_perm_del')
-signals.post_save.connect(clear_reviewer_cache, sender=auth_models.Group, dispatch_uid='reviews.clear_reviewer_group')
-signals.post_delete.connect(clear_reviewer_cache, sender=auth_models.Group, dispatch_uid='reviews.clear_reviewer_group_del')
-signals.post_save.connect(clear_reviewer_cache, sender=Reviewer, dispatch_uid='reviews.clear_reviewer_reviewer')
-signals.post_delete.connect(clear_reviewer_cache, sender=Reviewer, dispatch_uid='reviews.clear_reviewer_reviewer_del')
+signals.post_init.connect(remember_review_rating, sender=Review, dispatch_uid='reviews.remember_review_rating')
+signals.post_save.connect(comment_saved, sender=Comment, dispatch_uid='reviews.update_proposal_comments_count')
+signals.post_save.connect(review_saved, sender=Review, dispatch_uid='reviews.update_proposal_reviews_count')
+signals.post_save.connect(version_saved, sender=ProposalVersion, dispatch_uid='reviews.update_proposal_version_count')
+signals.post_delete.connect(comment_deleted, sender=Comment, dispatch_uid='reviews.update_proposal_comments_count_del')
+signals.post_delete.connect(review_deleted, sender=Review, dispatch_uid='reviews.update_proposal_reviews_count_del')
+signals.post_delete.connect(version_deleted, sender=ProposalVersion, dispatch_uid='reviews.update_proposal_version_count_del')
+signals.post_save.connect(user_saved, sender=auth_models.User, dispatch_uid='reviews.clear_reviewer_cache')
+signals.post_delete.connect(user_deleted, sender=auth_models.User, dispatch_uid='reviews.clear_reviewer_cache_del')
+signals.m2m_changed.connect(user_relations_changed, sender=auth_models.User.user_permissions.through, dispatch_uid='reviews.clear_reviewer_cache_user_perm')
+signals.m2m_changed.connect(user_relations_changed, sender=auth_models.User.groups.through, dispatch_uid='reviews.clear_reviewer_cache_user_group')
+signals.m2m_changed.connect(group_permissions_changed, sender=auth_models.Group.permissions.through, dispatch_uid='reviews.clear_reviewer_cache_group_perm')
+signals.pre_delete.connect(group_deleted, sender=auth_models.Group, dispatch_uid='reviews.clear_reviewer_group_del')
+signals.post_delete.connect(permission_deleted, sender=auth_models.Permission, dispatch_uid='reviews.clear_reviewer_cache_perm_del')
+signals.post_save.connect(filter_choices_changed, sender=conference_models.Track, dispatch_uid='reviews.filter_choices_track')
+signals.post_delete.connect(filter_choices_changed, sender=conference_models.Track, dispatch_uid='reviews.filter_choices_track_del')
+signals.post_save.connect(filter_choices_changed, sender=conference_models.SessionKind, dispatch_uid='reviews.filter_choices_kind')
+signals.post_delete.connect(filter_choices_changed, sender=conference_models.SessionKind, dispatch_uid='reviews.filter_choices_kind_del')
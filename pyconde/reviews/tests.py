@@ -1,11 +1,19 @@
 import unittest
 import datetime
+import mock
+from django.contrib.auth.models import AnonymousUser, Group, User
+from django.core.cache import get_cache
+from django.core.urlresolvers import reverse
 from django.test import TestCase, RequestFactory
 
+from . import context_processors
 from . import models
 from . import utils
 from . import view_mixins
+from . import views
 
+from pyconde.conference import models as conference_models
+from pyconde.core.metrics import MetricsBudgetMixin, record
 from pyconde.proposals import models as proposal_models
 
 
@@ -41,3 +49,229 @@ class OrderMappingMixinTests(TestCase):
         # to the default order
         mixin.request = req_factory.get('/?order=lala')
         self.assertEquals('-test', mixin.get_request_order())
+
+
+class ReviewRolesTests(TestCase):
+
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        patcher = mock.patch.object(utils, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'reviewer')
+
+    def get_roles(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return context_processors.review_roles(request)
+
+    def test_roles_are_lazy(self):
+        with mock.patch.object(utils, 'get_review_roles') as get_review_roles:
+            roles = self.get_roles(self.user)
+            self.assertFalse(get_review_roles.called)
+            bool(roles['is_reviewer'])
+            self.assertEquals(1, get_review_roles.call_count)
+        with record() as metrics:
+            self.assertFalse(self.get_roles(AnonymousUser())['is_reviewer'])
+        self.assertEquals(0, metrics.queries)
+
+    def test_roles_are_cached_per_user(self):
+        self.assertFalse(self.get_roles(self.user)['is_reviewer'])
+        with record() as metrics:
+            self.assertFalse(self.get_roles(self.user)['is_reviewer'])
+        self.assertEquals(0, metrics.queries)
+
+    def test_invalidation(self):
+        other = User.objects.create_user('other', 'other@example.com', 'other')
+        self.assertFalse(utils.can_review_proposal(self.user))
+        self.assertFalse(utils.can_review_proposal(other))
+
+        # Logging in and registrations don't touch the cached roles
+        self.client.login(username='reviewer', password='reviewer')
+        User.objects.create_user('new', 'new@example.com', 'new')
+        with record() as metrics:
+            self.assertFalse(utils.can_review_proposal(self.user))
+        self.assertEquals(0, metrics.queries)
+
+        # Granting the permission only invalidates the roles of that user
+        self.user.user_permissions.add(utils.get_review_permission())
+        with record() as metrics:
+            self.assertFalse(utils.can_review_proposal(other))
+        self.assertEquals(0, metrics.queries)
+        self.assertTrue(utils.can_review_proposal(User.objects.get(pk=self.user.pk)))
+
+        # The same goes for group memberships and group permissions
+        group = Group.objects.create(name='Reviewers')
+        other.groups.add(group)
+        self.assertFalse(utils.can_review_proposal(other))
+        group.permissions.add(utils.get_review_permission())
+        self.assertTrue(utils.can_review_proposal(other))
+        group.delete()
+        self.assertFalse(utils.can_review_proposal(other))
+
+
+class ListProposalsViewBudgetTests(MetricsBudgetMixin, TestCase):
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def test_queries_independent_of_proposal_count(self):
+        user = User.objects.create_user('staff', 'staff@example.com', 'staff')
+        user.is_staff = True
+        user.save()
+        self.client.login(username='staff', password='staff')
+        url = reverse('reviews-available-proposals')
+        baseline = self.client.get(url).metrics
+        for proposal in proposal_models.Proposal.objects.all():
+            proposal.pk = None
+            proposal.save()
+        self.assertMetricsBudget(self.client.get(url), queries=baseline.queries)
+
+
+class ListProposalsViewPaginationTests(TestCase):
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def setUp(self):
+        for proposal in proposal_models.Proposal.objects.all():
+            proposal.pk = None
+            proposal.save()
+        self.user = User.objects.create_user('staff', 'staff@example.com', 'staff')
+        self.user.is_staff = True
+        self.user.save()
+        self.client.login(username='staff', password='staff')
+        self.proposal = models.Proposal.objects.all()[0]
+        models.Review.objects.create(user=self.user, proposal=self.proposal,
+                                     rating='+1', summary='Good')
+        # Mix missing and equal activity dates to cover the tie-breaking.
+        md_pks = list(models.ProposalMetaData.objects.values_list('pk', flat=True))
+        models.ProposalMetaData.objects.filter(pk__in=md_pks[::2]) \
+            .update(latest_activity_date=None)
+        models.ProposalMetaData.objects.filter(pk__in=md_pks[1::2]) \
+            .update(latest_activity_date=datetime.datetime(2014, 1, 1))
+        patcher = mock.patch.object(views.ListProposalsView, 'paginate_by', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_all_pages(self, order):
+        base_url = reverse('reviews-available-proposals')
+        url = '?order=' + order
+        pages = []
+        while url:
+            response = self.client.get(base_url + url)
+            pages.append([md.proposal_id for md in response.context['proposals']])
+            url = response.context['next_page_url']
+        return pages
+
+    def test_pages_cover_all_proposals_once(self):
+        expected = sorted(models.ProposalMetaData.objects.filter(
+            proposal__conference_id=self.proposal.conference_id
+        ).values_list('proposal_id', flat=True))
+        self.assertTrue(len(expected) > 2)
+        for order in ('reviews', '-reviews', 'title', '-title', 'activity',
+                      '-activity', 'score', '-score'):
+            pages = self.get_all_pages(order)
+            self.assertTrue(all(len(page) <= 2 for page in pages))
+            seen = [pk for page in pages for pk in page]
+            self.assertEquals(expected, sorted(seen), order)
+
+    def test_reviewed_flag(self):
+        response = self.client.get(reverse('reviews-available-proposals') + '?order=-reviews')
+        proposals = response.context['proposals']
+        self.assertEquals(self.proposal.pk, proposals[0].proposal_id)
+        self.assertTrue(proposals[0].reviewed)
+        self.assertFalse(any(md.reviewed for md in proposals[1:]))
+
+    def test_invalid_cursor_shows_first_page(self):
+        url = reverse('reviews-available-proposals') + '?order=title'
+        first = self.client.get(url).context['proposals']
+        response = self.client.get(url + '&after=broken')
+        self.assertEquals(first, response.context['proposals'])
+        self.assertIsNone(response.context['first_page_url'])
+
+
+class FilterChoicesTests(TestCase):
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        patcher = mock.patch.object(utils, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_choices_cached_until_changed(self):
+        choices = utils.get_filter_choices()
+        self.assertNotIn('keynote', [slug for slug, name in choices['kind']])
+        with self.assertNumQueries(0):
+            self.assertEquals(choices, utils.get_filter_choices())
+        track = conference_models.Track.objects.create(
+            conference=conference_models.current_conference(), name='New track',
+            slug='new-track')
+        self.assertIn(('new-track', 'New track'), utils.get_filter_choices()['track'])
+        track.delete()
+        self.assertEquals(choices, utils.get_filter_choices())
+
+
+class ProposalMetaDataUpdateTests(TestCase):
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def setUp(self):
+        models.rebuild_proposal_metadata()
+        self.proposal = models.Proposal.objects.all()[0]
+        self.user = User.objects.create_user('reviewer', 'reviewer@example.com', 'reviewer')
+
+    def get_metadata(self):
+        return models.ProposalMetaData.objects.get(proposal=self.proposal)
+
+    def test_review_updates_counter_and_score(self):
+        review = models.Review.objects.create(
+            user=self.user, proposal=self.proposal, rating='+1', summary='Good')
+        md = self.get_metadata()
+        self.assertEquals(1, md.num_reviews)
+        self.assertEquals(1.0, md.score)
+        self.assertEquals(review.pub_date, md.latest_review_date)
+
+        review = models.Review.objects.get(pk=review.pk)
+        review.rating = '-1'
+        review.save()
+        md = self.get_metadata()
+        self.assertEquals(1, md.num_reviews)
+        self.assertEquals(-1.0, md.score)
+
+        review.delete()
+        md = self.get_metadata()
+        self.assertEquals(0, md.num_reviews)
+        self.assertEquals(0.0, md.score)
+        self.assertIsNone(md.latest_review_date)
+        self.assertEquals([], models.rebuild_proposal_metadata(fix=False))
+
+    def test_comment_updates_counter_and_dates(self):
+        first = models.Comment.objects.create(
+            author=self.user, proposal=self.proposal, content='First',
+            pub_date=datetime.datetime(2014, 1, 1))
+        second = models.Comment.objects.create(
+            author=self.user, proposal=self.proposal, content='Second',
+            pub_date=datetime.datetime(2014, 1, 2))
+        md = self.get_metadata()
+        self.assertEquals(2, md.num_comments)
+        self.assertEquals(second.pub_date, md.latest_comment_date)
+        self.assertEquals(second.pub_date, md.latest_activity_date)
+
+        second.delete()
+        md = self.get_metadata()
+        self.assertEquals(1, md.num_comments)
+        self.assertEquals(first.pub_date, md.latest_comment_date)
+        self.assertEquals([], models.rebuild_proposal_metadata(fix=False))
+
+    def test_rebuild_fixes_inconsistent_metadata(self):
+        models.Comment.objects.create(
+            author=self.user, proposal=self.proposal, content='Comment')
+        models.ProposalMetaData.objects.filter(proposal=self.proposal) \
+            .update(num_comments=5, score=3.0)
+        self.assertEquals([self.proposal.pk],
+                          models.rebuild_proposal_metadata(fix=False))
+        self.assertEquals(5, self.get_metadata().num_comments)
+        self.assertEquals([self.proposal.pk], models.rebuild_proposal_metadata())
+        md = self.get_metadata()
+        self.assertEquals(1, md.num_comments)
+        self.assertEquals(0.0, md.score)
+        self.assertEquals([], models.rebuild_proposal_metadata(fix=False))
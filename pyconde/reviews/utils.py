@@ -2,6 +2,7 @@ import tablib
 import logging
 import re
 
+from django.conf import settings
 from django.contrib.auth import models as auth_models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
@@ -9,6 +10,7 @@ from django.core.cache import cache
 from django.core.mail import EmailMessage
 from django.core.urlresolvers import reverse
 from django.db.models import Q
+from django.utils.crypto import get_random_string
 from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 
@@ -26,17 +28,67 @@ def get_review_permission():
     return auth_models.Permission.objects.get(content_type_id=review_ct.pk, codename='add_review')
 
 
+REVIEW_ROLES_VERSION_KEY = 'review_roles_version'
+
+
+def _get_review_roles_key(user_pk):
+    return 'review_roles:{0}'.format(user_pk)
+
+
+def clear_reviewer_cache():
+    """
+    Invalidates the cached review roles of all users.
+    """
+    cache.set(REVIEW_ROLES_VERSION_KEY, get_random_string(12))
+    logger.debug("review roles cache has been invalidated")
+
+
+def invalidate_review_roles(user_pks):
+    """
+    Invalidates the cached review roles of the given users only.
+    """
+    user_pks = list(user_pks)
+    if user_pks:
+        cache.delete_many([_get_review_roles_key(pk) for pk in user_pks])
+        logger.debug("review roles of users %s have been invalidated", user_pks)
+
+
+def get_review_roles(user, reset_cache=False):
+    """
+    Returns a dict with the flags "is_reviewer" and "see_proposal_author"
+    (the user's permission, not taking the conference settings into
+    account) of the given authenticated user.
+
+    The flags are cached per user together with the version of the whole
+    cache, which clear_reviewer_cache() bumps, so that both can be looked up
+    in a single round trip.
+    """
+    key = _get_review_roles_key(user.pk)
+    cached = cache.get_many([REVIEW_ROLES_VERSION_KEY, key])
+    version = cached.get(REVIEW_ROLES_VERSION_KEY)
+    if not reset_cache and version is not None and key in cached:
+        entry_version, roles = cached[key]
+        if entry_version == version:
+            return roles
+    if version is None:
+        version = get_random_string(12)
+        cache.set(REVIEW_ROLES_VERSION_KEY, version)
+    perm = get_review_permission()
+    roles = {
+        'is_reviewer': auth_models.User.objects.filter(pk=user.pk).filter(
+            Q(is_superuser=True) | Q(user_permissions=perm) |
+            Q(groups__permissions=perm)).exists(),
+        'see_proposal_author': user.has_perm('proposals.see_proposal_author'),
+    }
+    cache.set(key, (version, roles))
+    logger.debug("review roles of user %d have been rebuilt", user.pk)
+    return roles
+
+
 def can_review_proposal(user, proposal=None, reset_cache=False):
-    cache_key = 'reviewer_pks'
-    reviewer_pks = cache.get(cache_key)
     if user.is_anonymous() or not hasattr(user, 'pk'):
         return False
-    if reset_cache or reviewer_pks is None:
-        perm = get_review_permission()
-        reviewer_pks = set(u['pk'] for u in auth_models.User.objects.filter(Q(is_superuser=True) | Q(user_permissions=perm) | Q(groups__permissions=perm)).values('pk'))
-        cache.set(cache_key, reviewer_pks)
-        logger.debug("reviewer_pks cache has been rebuilt")
-    return user.pk in reviewer_pks
+    return get_review_roles(user, reset_cache=reset_cache)['is_reviewer']
 
 
 def can_participate_in_review(user, proposal):
@@ -53,9 +105,46 @@ def can_see_proposal_author(user):
         not conference_models.current_conference().anonymize_proposal_author
     ):
         return True
-    if user.has_perm('proposals.see_proposal_author'):
-        return True
-    return False
+    if user.is_anonymous() or not hasattr(user, 'pk'):
+        return False
+    return get_review_roles(user)['see_proposal_author']
+
+
+FILTER_CHOICES_TIMEOUT = 60 * 60 * 24
+
+
+def _get_filter_choices_key(conference_id):
+    return 'reviews:filter_choices:{0}'.format(conference_id)
+
+
+def get_filter_choices(conference_id=None):
+    """
+    Returns a dict with the (slug, name) choices of the tracks and the
+    session kinds (except keynotes) of the given or current conference.
+
+    The choices are cached per conference until a track or session kind is
+    changed (see invalidate_filter_choices()).
+    """
+    if conference_id is None:
+        conference_id = settings.CONFERENCE_ID
+    key = _get_filter_choices_key(conference_id)
+    choices = cache.get(key)
+    if choices is None:
+        choices = {
+            'track': list(conference_models.Track.objects
+                          .filter(conference_id=conference_id)
+                          .values_list('slug', 'name')),
+            'kind': list(conference_models.SessionKind.objects
+                         .filter(conference_id=conference_id)
+                         .exclude(slug='keynote')
+                         .values_list('slug', 'name')),
+        }
+        cache.set(key, choices, FILTER_CHOICES_TIMEOUT)
+    return choices
+
+
+def invalidate_filter_choices(conference_id):
+    cache.delete(_get_filter_choices_key(conference_id))
 
 
 def has_valid_mailaddr(user):
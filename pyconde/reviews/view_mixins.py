@@ -1,3 +1,9 @@
+from django.core import signing
+from django.db import connection, models
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
 class PrepareViewMixin(object):
     """
     A simple view mixin that combines the preparation tasks
@@ -43,3 +49,106 @@ class OrderMappingMixin(object):
         fallback = self.order_mapping[self.get_default_order().lstrip('-')]
         order = self.get_order_mapping().get(order, fallback)
         return '{0}{1}'.format(dir_, order)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginates a queryset ordered by a single field (see OrderMappingMixin)
+    by remembering the order value and primary key of the last object
+    shown instead of counting and skipping all the previous objects.
+
+    Null values are treated as lower than any other value.
+    """
+    paginate_by = 50
+    cursor_param = 'after'
+    cursor_salt = 'pyconde.reviews.keyset'
+
+    def _get_order_field(self, queryset, order):
+        field_name = order.lstrip('-')
+        model = queryset.model
+        parts = field_name.split('__')
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).rel.to
+        return field_name, model._meta.get_field(parts[-1])
+
+    def _dump_value(self, field, value):
+        if isinstance(field, models.DateTimeField) and value is not None:
+            return value.isoformat()
+        return value
+
+    def _load_value(self, field, value):
+        if isinstance(field, models.DateTimeField) and value is not None:
+            return parse_datetime(value)
+        return value
+
+    def get_cursor(self, order):
+        """
+        Returns the decoded (value, pk) of the last object of the previous
+        page or None for the first page or if the cursor was created for
+        another order.
+        """
+        data = self.request.GET.get(self.cursor_param)
+        if not data:
+            return None
+        try:
+            cursor_order, value, pk = signing.loads(data, salt=self.cursor_salt)
+        except (signing.BadSignature, TypeError, ValueError):
+            return None
+        if cursor_order != order:
+            return None
+        return value, pk
+
+    def paginate_keyset(self, queryset, order):
+        """
+        Returns the objects of the current page of the queryset in the given
+        order and the cursor for the next page (or None).
+        """
+        field_name, field = self._get_order_field(queryset, order)
+        descending = order.startswith('-')
+        dir_ = '-' if descending else ''
+        ordering = ['{0}{1}'.format(dir_, field_name), '{0}pk'.format(dir_)]
+        if field.null:
+            column = '{0}.{1}'.format(
+                connection.ops.quote_name(field.model._meta.db_table),
+                connection.ops.quote_name(field.column))
+            queryset = queryset.extra(select={
+                '_keyset_not_null': '{0} IS NOT NULL'.format(column)})
+            ordering.insert(0, '{0}_keyset_not_null'.format(dir_))
+        queryset = queryset.order_by(*ordering)
+
+        cursor = self.get_cursor(order)
+        if cursor is not None:
+            value, pk = cursor
+            value = self._load_value(field, value)
+            cmp_ = 'lt' if descending else 'gt'
+            pk_after = Q(**{'pk__' + cmp_: pk})
+            if value is None:
+                after = Q(**{field_name + '__isnull': True}) & pk_after
+                if not descending:
+                    after |= Q(**{field_name + '__isnull': False})
+            else:
+                after = Q(**{'{0}__{1}'.format(field_name, cmp_): value}) | \
+                    (Q(**{field_name: value}) & pk_after)
+                if descending and field.null:
+                    after |= Q(**{field_name + '__isnull': True})
+            queryset = queryset.filter(after)
+
+        objects = list(queryset[:self.paginate_by + 1])
+        next_cursor = None
+        if len(objects) > self.paginate_by:
+            objects = objects[:self.paginate_by]
+            last = objects[-1]
+            value = last
+            for part in field_name.split('__'):
+                value = getattr(value, part) if value is not None else None
+            next_cursor = signing.dumps(
+                [order, self._dump_value(field, value), last.pk],
+                salt=self.cursor_salt)
+        return objects, next_cursor
+
+    def get_page_url(self, cursor):
+        params = self.request.GET.copy()
+        params.pop(self.cursor_param, None)
+        if cursor is not None:
+            params[self.cursor_param] = cursor
+        return '?' + params.urlencode()
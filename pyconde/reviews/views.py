@@ -12,15 +12,16 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.utils.timezone import now
 from django.utils.importlib import import_module
+from django.db import connection
 
 from . import models, forms, utils, decorators, settings
-from .view_mixins import OrderMappingMixin, PrepareViewMixin
+from .view_mixins import KeysetPaginationMixin, OrderMappingMixin, PrepareViewMixin
 from pyconde.proposals.views import NextRedirectMixin
 from pyconde.utils import create_403
 from pyconde.conference.models import current_conference
 
 
-class ListProposalsView(OrderMappingMixin, generic_views.TemplateView):
+class ListProposalsView(KeysetPaginationMixin, OrderMappingMixin, generic_views.TemplateView):
     """
     Lists all proposals the reviewer should be able to review, sorted by
     "priority".
@@ -28,6 +29,9 @@ class ListProposalsView(OrderMappingMixin, generic_views.TemplateView):
     This listing should include some filter functionality to filter proposals
     by tag, track or kind.
 
+    The proposals are shown in pages (see KeysetPaginationMixin) together
+    with a flag whether the current user has already reviewed them.
+
     Access: review-team and staff
     """
     template_name = 'reviews/reviewable_proposals.html'
@@ -41,17 +45,14 @@ class ListProposalsView(OrderMappingMixin, generic_views.TemplateView):
     default_order = 'reviews'
 
     def get_context_data(self, **kwargs):
-        proposals = self.get_queryset()
-        my_reviews = models.Review.objects \
-                                  .filter(user=self.request.user) \
-                                  .select_related('proposal')
-        reviewed_proposals = [rev.proposal for rev in my_reviews]
-        for proposal in proposals:
-            proposal.reviewed = proposal.proposal in reviewed_proposals
+        proposals, next_cursor = self.paginate_keyset(self.get_queryset(),
+                                                      self.get_order())
         return {
             'proposals': proposals,
             'order': self.get_request_order(),
             'filter_form': self.filter_form,
+            'next_page_url': self.get_page_url(next_cursor) if next_cursor else None,
+            'first_page_url': self.get_page_url(None) if self.get_cursor(self.get_order()) else None,
         }
 
     def get_request_order(self):
@@ -76,8 +77,8 @@ class ListProposalsView(OrderMappingMixin, generic_views.TemplateView):
                                           'latest_proposalversion__title',
                                           'latest_activity_date',
                                           'latest_comment_date') \
-                                    .order_by(self.get_order()) \
                                     .filter(proposal__conference_id=current_conference().id)
+        qs = self._add_reviewed_flag(qs)
         if self.filter_form.is_valid():
             track_slug = self.filter_form.cleaned_data['track']
             kind_slug = self.filter_form.cleaned_data['kind']
@@ -87,6 +88,21 @@ class ListProposalsView(OrderMappingMixin, generic_views.TemplateView):
                 qs = qs.filter(proposal__kind__slug=kind_slug)
         return qs
 
+    def _add_reviewed_flag(self, qs):
+        """
+        Lets the database tell whether the current user has already reviewed
+        each proposal instead of loading all of the user's reviews.
+        """
+        qn = connection.ops.quote_name
+        review_table = qn(models.Review._meta.db_table)
+        reviewed = 'EXISTS (SELECT 1 FROM {0} WHERE {0}.{1} = {2}.{3} AND {0}.{4} = %s)'.format(
+            review_table, qn(models.Review._meta.get_field('proposal').column),
+            qn(models.ProposalMetaData._meta.db_table),
+            qn(models.ProposalMetaData._meta.get_field('proposal').column),
+            qn(models.Review._meta.get_field('user').column))
+        return qs.extra(select={'reviewed': reviewed},
+                        select_params=[self.request.user.pk])
+
     @method_decorator(decorators.reviewer_or_staff_required)
     def dispatch(self, request, *args, **kwargs):
         self.filter_form = forms.ProposalFilterForm(request.GET)
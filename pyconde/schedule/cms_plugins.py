@@ -18,13 +18,13 @@ class CMSCompleteSchedulePlugin(CMSPluginBase):
     def render(self, context, instance, placeholder):
         schedule = utils.create_schedule(row_duration=instance.row_duration,
                                          merge_sections=instance.merge_sections)
-        incl_sections = instance.sections.all()
+        incl_sections = set(instance.sections.values_list('pk', flat=True))
         if not incl_sections:
             schedule = schedule
         else:
             s = SortedDict()
             for k, v in schedule.iteritems():
-                if k in incl_sections:
+                if k.pk in incl_sections:
                     s[k] = v
             schedule = s
         context.update({
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 import collections
 import datetime
+import heapq
 import logging
 import os
 import shutil
@@ -11,7 +12,6 @@ import tablib
 import StringIO
 
 from itertools import chain, groupby
-from operator import attrgetter
 
 from lxml import etree
 
@@ -19,6 +19,7 @@ from django.core.urlresolvers import reverse
 from django.contrib.sites import models as site_models
 from django.template.defaultfilters import slugify
 from django.utils.encoding import force_text
+from django.utils.functional import cached_property
 from django.utils.timezone import now
 from django.utils import timezone
 from django.utils.text import slugify
@@ -41,6 +42,59 @@ def _format_cospeaker(s):
     return force_text(s).replace('|', ' ')
 
 
+class ScheduleExportData(object):
+    """
+    Loads the sessions and side events of a conference together with their
+    speakers, users, profiles, locations and tags in a fixed number of
+    queries. An instance can be shared by several exporters so that the data
+    is only loaded once.
+    """
+
+    def __init__(self, conference=None):
+        if conference is None:
+            conference = conference_models.current_conference()
+        self.conference = conference
+
+    def get_session_queryset(self):
+        return models.Session.objects \
+            .select_related('kind', 'audience_level', 'track',
+                            'speaker__user__profile') \
+            .prefetch_related('additional_speakers__user__profile',
+                              'location') \
+            .filter(conference=self.conference,
+                    start__isnull=False, end__isnull=False) \
+            .order_by('start')
+
+    def get_side_event_queryset(self):
+        return models.SideEvent.objects \
+            .prefetch_related('location') \
+            .filter(conference=self.conference,
+                    start__isnull=False, end__isnull=False) \
+            .order_by('start')
+
+    @cached_property
+    def sessions(self):
+        return list(self.get_session_queryset().prefetch_related('tags'))
+
+    @cached_property
+    def released_sessions(self):
+        return [session for session in self.sessions if session.released]
+
+    @cached_property
+    def side_events(self):
+        return list(self.get_side_event_queryset())
+
+    @cached_property
+    def domain(self):
+        return site_models.Site.objects.get_current().domain
+
+    def get_speaker_url(self, speaker):
+        url = ''
+        if speaker.user is not None:
+            url = reverse('account_profile', kwargs={'uid': speaker.user.pk})
+        return '<https://{0}{1}>'.format(self.domain, url)
+
+
 class AbstractExporter(object):
     def as_csv_value(self, value):
         """
@@ -103,35 +157,14 @@ class GuidebookExporterSections(AbstractExporter):
 
 
 class GuidebookExporterSessions(object):
-    def get_speaker_url(self, speaker):
-        site = site_models.Site.objects.get_current()
-        url = ''
-        if speaker.user is not None:
-            url = reverse('account_profile', kwargs={'uid': speaker.user.pk})
-        return '<https://{0}{1}>'.format(site.domain, url)
+    def __init__(self, data=None):
+        self.data = data if data is not None else ScheduleExportData()
 
     def __call__(self):
         result = []
-        sessions = models.Session.objects \
-            .select_related('kind', 'audience_level', 'track',
-                            'speaker__user__profile') \
-            .prefetch_related('additional_speakers__user__profile',
-                              'location') \
-            .filter(released=True, start__isnull=False, end__isnull=False) \
-            .exclude(kind__slug__in=('poster')) \
-            .order_by('start') \
-            .only('end', 'start', 'title', 'abstract', 'description', 'is_global',
-                  'kind__name',
-                  'audience_level__name',
-                  'track__name',
-                  'speaker__user__username',
-                  'speaker__user__profile__avatar',
-                  'speaker__user__profile__full_name',
-                  'speaker__user__profile__display_name',
-                  'speaker__user__profile__short_info',
-                  'speaker__user__profile__user') \
-            .all()
-        for session in sessions:
+        for session in self.data.released_sessions:
+            if session.kind.slug == 'poster':
+                continue
             additional_speakers = list(session.additional_speakers.all())
             cospeakers = [_format_cospeaker(s) for s in additional_speakers]
             result.append([
@@ -146,15 +179,11 @@ class GuidebookExporterSessions(object):
                 session.audience_level.name if session.audience_level else '',
                 force_text(session.speaker),
                 '|'.join(cospeakers),
-                self.get_speaker_url(session.speaker),
-                ' '.join([self.get_speaker_url(s) for s in additional_speakers]),
+                self.data.get_speaker_url(session.speaker),
+                ' '.join([self.data.get_speaker_url(s) for s in additional_speakers]),
                 session.description_rendered.encode('utf-8'),
                 ])
-        side_events = models.SideEvent.objects \
-            .prefetch_related('location') \
-            .filter(start__isnull=False, end__isnull=False) \
-            .order_by('start') \
-            .all()
+        side_events = self.data.side_events
         for evt in side_events:
             loc = evt.location_guidebook or ''
             if evt.is_pause:
@@ -200,24 +229,17 @@ class GuidebookExporterSessions(object):
 
 
 class GuidebookExporterSpeakers(object):
+    def __init__(self, data=None):
+        self.data = data if data is not None else ScheduleExportData()
+
     def __call__(self):
         data = tablib.Dataset(headers=['Name',
             'Sub-Title (i.e. Location, Table/Booth, or Title/Sponsorship Level)',
             'Description (Optional)', 'Location/Room'])
         speakers = set()
-        sessions = models.Session.objects \
-            .select_related('speaker__user__profile') \
-            .prefetch_related('additional_speakers__user__profile') \
-            .filter(released=True, start__isnull=False, end__isnull=False) \
-            .exclude(kind__slug__in=('poster')) \
-            .only('speaker__user__username',
-                  'speaker__user__profile__avatar',
-                  'speaker__user__profile__full_name',
-                  'speaker__user__profile__display_name',
-                  'speaker__user__profile__short_info',
-                  'speaker__user__profile__user') \
-            .all()
-        for session in sessions:
+        for session in self.data.released_sessions:
+            if session.kind.slug == 'poster':
+                continue
             user = session.speaker.user
             speakers.add((get_full_name(user), user.profile.short_info_rendered))
             for speaker in session.additional_speakers.all():
@@ -236,24 +258,16 @@ class GuidebookExporterSpeakers(object):
 
 
 class GuidebookExporterLinks(object):
+    def __init__(self, data=None):
+        self.data = data if data is not None else ScheduleExportData()
+
     def __call__(self):
         data = tablib.Dataset(headers=['Session ID (Optional)',
             'Session Name (Optional)', 'Link To Session ID (Optional)',
             'Link To Session Name (Optional)', 'Link To Item ID (Optional)',
             'Link To Item Name (Optional)', 'Link To Form Name (Optional)'])
-        sessions = models.Session.objects \
-            .select_related('kind', 'speaker__user__profile') \
-            .prefetch_related('additional_speakers__user__profile') \
-            .filter(released=True, start__isnull=False, end__isnull=False) \
-            .exclude(kind__slug__in=('poster')) \
-            .only('title',
-                  'kind__slug',
-                  'speaker__user__username',
-                  'speaker__user__profile__avatar',
-                  'speaker__user__profile__full_name',
-                  'speaker__user__profile__display_name',
-                  'speaker__user__profile__user') \
-            .all()
+        sessions = [session for session in self.data.released_sessions
+                    if session.kind.slug != 'poster']
 
         for session in sessions:
             user = session.speaker.user
@@ -288,12 +302,24 @@ class GuidebookExporterSponsors(object):
         return data
 
 
+GUIDEBOOK_EXPORTERS = {
+    # 'sections': GuidebookExporterSections,
+    'sessions': GuidebookExporterSessions,
+    'speakers': GuidebookExporterSpeakers,
+    'links': GuidebookExporterLinks,
+    # 'sponsors': GuidebookExporterSponsors,
+}
+
+
 class SessionForEpisodesExporter(object):
     """
     This exporter creates a JSON file that is used by the video team in order
     to add metadata to the created media files.
     """
 
+    def __init__(self, data=None):
+        self.data = data if data is not None else ScheduleExportData()
+
     def _get_speaker_data(self, session):
         Speaker = collections.namedtuple('Speaker', 'name email')
         result = []
@@ -304,7 +330,6 @@ class SessionForEpisodesExporter(object):
         return result
 
     def create_episode_data(self, session):
-        site = site_models.Site.objects.get_current()
         is_sideevent = isinstance(session, models.SideEvent)
         if is_sideevent:
             title = session.name
@@ -319,7 +344,7 @@ class SessionForEpisodesExporter(object):
 
         ep = {
             'name': title,
-            'room': session.location.name,
+            'room': session.location_pretty,
             'start': session.start.isoformat(),
             'duration': (session.end - session.start).total_seconds() / 60.0,
             'end': session.end.isoformat(),
@@ -329,27 +354,94 @@ class SessionForEpisodesExporter(object):
             'license': None,  # TODO: Add license information
             'description': description,
             'conf_key': '{0}:{1}'.format('session' if not is_sideevent else 'event', session.pk),
-            'conf_url': 'https://{domain}{path}'.format(domain=site.domain, path=session.get_absolute_url()),
+            'conf_url': 'https://{domain}{path}'.format(domain=self.data.domain, path=session.get_absolute_url()),
             'tags': ', '.join([t.name for t in session.tags.all()]) if not is_sideevent else ''
         }
         return ep
 
     def __call__(self):
-        items = [self.create_episode_data(session) for session in models.Session.current_conference.select_related('location', 'speaker').all()]
+        items = [self.create_episode_data(session) for session in self.data.sessions]
         # Also export all side-events that are not pauses
-        items += [self.create_episode_data(evt) for evt in models.SideEvent.current_conference.filter(is_recordable=True).exclude(is_pause=True).select_related('location').all()]
+        items += [self.create_episode_data(evt) for evt in self.data.side_events
+                  if evt.is_recordable and not evt.is_pause]
         return items
 
 
-class XMLExporter(object):
+class _StreamBuffer(object):
+    """
+    File-like object collecting everything written to it until the next
+    call of drain.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_chunked(queryset, chunk_size=200):
+    """
+    Iterates over the objects of the given queryset while only fetching
+    chunk_size of them at a time. Unlike QuerySet.iterator this keeps
+    prefetch_related working. Only the primary keys are loaded up front, so
+    objects deleted in the meantime are skipped.
+    """
+    pks = list(queryset.values_list('pk', flat=True))
+    for offset in range(0, len(pks), chunk_size):
+        chunk = pks[offset:offset + chunk_size]
+        objs = dict((obj.pk, obj) for obj in queryset.filter(pk__in=chunk))
+        for pk in chunk:
+            if pk in objs:
+                yield objs[pk]
+
+
+def merge_events(*querysets):
+    """
+    Merges the given querysets, each ordered by start and end, into a single
+    stream of events ordered by start and end. Earlier querysets win ties.
+    """
+    def _decorate(idx, events):
+        for seq, evt in enumerate(events):
+            yield evt.start, evt.end, idx, seq, evt
+    streams = [_decorate(idx, iter_chunked(qs)) for idx, qs in enumerate(querysets)]
+    for item in heapq.merge(*streams):
+        yield item[-1]
+
+
+class StreamingXMLMixin(object):
+    """
+    Exporters using this mixin implement _write(fp) as a generator that
+    writes the document to fp and yields whenever a part of it is complete.
+    """
+
+    def stream(self):
+        """
+        Yields the exported XML document in chunks while it is generated.
+        """
+        buf = _StreamBuffer()
+        for _ in self._write(buf):
+            data = buf.drain()
+            if data:
+                yield data
+        yield buf.drain()
+
+
+class XMLExporter(StreamingXMLMixin):
 
-    def __init__(self, outfile, base_url=None, pretty=False, export_avatars=False):
+    def __init__(self, outfile, base_url=None, pretty=False, export_avatars=False,
+                 data=None):
+        self.data = data if data is not None else ScheduleExportData()
         if base_url is None:
-            self.base_url = 'http://%s' % site_models.Site.objects.get_current().domain
+            self.base_url = 'http://%s' % self.data.domain
         else:
             self.base_url = base_url
         self.outfile = outfile
-        self.event_sorter = attrgetter('start', 'end')
         self.day_grouper = lambda evt: evt.start.date()
         self.pretty = pretty
         self.export_avatars = export_avatars
@@ -360,49 +452,49 @@ class XMLExporter(object):
             if not os.path.exists(self.avatar_dir):
                 os.makedirs(self.avatar_dir)
         with open(self.outfile, 'w') as fp:
-            with etree.xmlfile(fp) as xf:
-                sessions = models.Session.objects \
-                    .select_related('kind', 'audience_level', 'track',
-                                    'speaker__user__profile') \
-                    .prefetch_related('additional_speakers__user__profile',
-                                      'location') \
-                    .filter(released=True, start__isnull=False, end__isnull=False) \
-                    .order_by('start') \
-                    .only('end', 'start', 'title', 'abstract', 'description', 'is_global',
-                          'kind__name',
-                          'audience_level__name',
-                          'track__name',
-                          'speaker__user__username',
-                          'speaker__user__profile__avatar',
-                          'speaker__user__profile__full_name',
-                          'speaker__user__profile__display_name',
-                          'speaker__user__profile__short_info',
-                          'speaker__user__profile__user') \
-                    .all()
-                side_events = models.SideEvent.objects \
-                    .prefetch_related('location') \
-                    .filter(start__isnull=False, end__isnull=False) \
-                    .order_by('start') \
-                    .all()
-                all_events = sorted(chain(sessions, side_events), key=self.event_sorter)
-                all_events = groupby(all_events, self.day_grouper)
-                with xf.element('schedule', created=now().isoformat()):
-                    for day, events in all_events:
-                        self._export_day(fp, xf, day, events)
-
-    def _export_day(self, fp, xf, day, events):
-        with xf.element('day', date=day.isoformat()):
-            for event in events:
-                try:
-                    if isinstance(event, models.Session):
-                        self._export_session(fp, xf, event)
-                    elif isinstance(event, models.SideEvent):
-                        self._export_side_event(fp, xf, event)
-                except Exception as e:
-                    LOG.fatal('Error exporting %s(%d) %s' % (
-                        event.__class__.__name__, event.id, event) + force_text(e))
-                    import traceback
-                    traceback.print_exc()
+            for _ in self._write(fp):
+                pass
+
+    def _write(self, fp):
+        """
+        Writes the document to fp. Yields after every event so that the
+        caller can hand the output written so far on.
+        """
+        with etree.xmlfile(fp) as xf:
+            sessions = self.data.get_session_queryset() \
+                .filter(released=True) \
+                .order_by('start', 'end', 'pk') \
+                .only('end', 'start', 'title', 'abstract', 'description', 'is_global',
+                      'kind__name',
+                      'audience_level__name',
+                      'track__name',
+                      'speaker__user__username',
+                      'speaker__user__profile__avatar',
+                      'speaker__user__profile__full_name',
+                      'speaker__user__profile__display_name',
+                      'speaker__user__profile__short_info',
+                      'speaker__user__profile__user')
+            side_events = self.data.get_side_event_queryset() \
+                .order_by('start', 'end', 'pk')
+            all_events = groupby(merge_events(sessions, side_events), self.day_grouper)
+            with xf.element('schedule', created=now().isoformat()):
+                for day, events in all_events:
+                    with xf.element('day', date=day.isoformat()):
+                        for event in events:
+                            self._export_event(fp, xf, event)
+                            yield
+
+    def _export_event(self, fp, xf, event):
+        try:
+            if isinstance(event, models.Session):
+                self._export_session(fp, xf, event)
+            elif isinstance(event, models.SideEvent):
+                self._export_side_event(fp, xf, event)
+        except Exception as e:
+            LOG.fatal('Error exporting %s(%d) %s' % (
+                event.__class__.__name__, event.id, event) + force_text(e))
+            import traceback
+            traceback.print_exc()
 
     def _export_session(self, fp, xf, event):
         with xf.element('entry', id=force_text(event.id)):
@@ -500,23 +592,24 @@ class XMLExporter(object):
                     dest = os.path.join(self.avatar_dir, str(user.id)) + ext
                     shutil.copy(profile.avatar.file.name, dest)
 
-class XMLExporterPentabarf(object):
+class XMLExporterPentabarf(StreamingXMLMixin):
 
-    def __init__(self):
-        self.domain = site_models.Site.objects.get_current().domain
+    def __init__(self, data=None):
+        self.data = data if data is not None else ScheduleExportData()
+        self.domain = self.data.domain
         self.base_url = 'http://%s' % self.domain
 
     def export(self):
         output = StringIO.StringIO()
-        with etree.xmlfile(output) as xf:
-            sessions = models.Session.objects \
-                .select_related('kind', 'audience_level', 'track',
-                                'speaker__user__profile') \
-                .prefetch_related('additional_speakers__user__profile',
-                                  'location') \
-                .filter(released=True, start__isnull=False, end__isnull=False,
+        for _ in self._write(output):
+            pass
+        return output
+
+    def _write(self, fp):
+        with etree.xmlfile(fp) as xf:
+            sessions = self.data.get_session_queryset() \
+                .filter(released=True,
                         kind__slug__in=('talk', 'keynote', 'sponsored')) \
-                .order_by('start') \
                 .only('end', 'start', 'title', 'abstract', 'description', 'language',
                       'kind__name',
                       'audience_level__name',
@@ -526,16 +619,12 @@ class XMLExporterPentabarf(object):
                       'speaker__user__profile__full_name',
                       'speaker__user__profile__display_name',
                       'speaker__user__profile__short_info',
-                      'speaker__user__profile__user') \
-                .all()
-            side_events = models.SideEvent.objects \
+                      'speaker__user__profile__user')
+            side_events = self.data.get_side_event_queryset() \
                 .select_related() \
-                .prefetch_related('location') \
-                .filter(start__isnull=False, end__isnull=False, is_recordable=True) \
-                .order_by('start') \
-                .only('end', 'start', 'name') \
-                .all()
-            self.conference = force_text(conference_models.current_conference())
+                .filter(is_recordable=True) \
+                .only('end', 'start', 'name')
+            self.conference = force_text(self.data.conference)
             self._duration_base = datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0, 0))
             with xf.element('iCalendar'):
                 with xf.element('vcalendar'):
@@ -547,11 +636,12 @@ class XMLExporterPentabarf(object):
                         xf.write(self.conference)
                     with xf.element('x-wr-calname'):
                         xf.write(self.conference)
-                    for session in sessions:
+                    for session in iter_chunked(sessions):
                         self._export_session(xf, session)
-                    for session in side_events:
+                        yield
+                    for session in iter_chunked(side_events):
                         self._export_side_event(xf, session)
-        return output
+                        yield
 
     def _export_session(self, xf, session):
         with xf.element('vevent'):
@@ -644,13 +734,12 @@ class XMLExporterPentabarf(object):
 
 
 class FrabExporter(object):
-    def __init__(self, output=None, conference=None):
+    def __init__(self, output=None, conference=None, data=None):
         self.output = output
-        self.conference = conference
+        self.data = data if data is not None else ScheduleExportData(conference)
+        self.conference = self.data.conference
         if self.output is None:
             self.output = sys.stdout
-        if self.conference is None:
-            self.conference = conference_models.current_conference()
 
     def __call__(self):
         doc = etree.Element('schedule')
@@ -676,28 +765,19 @@ class FrabExporter(object):
         locations = list(conference_models.Location.objects.filter(conference=self.conference).all()) + [conference_models.Location(pk='other', name="Other")]
         day_index = 1
 
+        events_by_day = collections.defaultdict(list)
+        for event in chain(self.data.released_sessions, self.data.side_events):
+            events_by_day[event.start.date()].append(event)
+
         while day < end_date:
-            self._add_day(root_element, day, locations, day_index)
+            self._add_day(root_element, day, events_by_day[day], locations, day_index)
             day = day + datetime.timedelta(days=1)
             day_index += 1
 
-    def _add_day(self, root_element, day, locations, index):
-        conference = self.conference
+    def _add_day(self, root_element, day, events, locations, index):
         elem = etree.SubElement(root_element, 'day', date=self._format_date(day), index=unicode(index))
         sessions_in_location = collections.defaultdict(list)
-        sessions = models.Session.objects\
-            .select_related('kind', 'audience_level', 'track',
-                            'speaker__user__profile')\
-            .prefetch_related('additional_speakers__user__profile',
-                              'location')\
-            .filter(released=True, start__year=day.year, start__month=day.month, start__day=day.day, conference=conference)\
-            .order_by('start')\
-            .all()
-        side_events = models.SideEvent.objects\
-            .filter(start__year=day.year, start__month=day.month, start__day=day.day, conference=conference)\
-            .order_by('start')\
-            .all()
-        for session in (list(sessions) + list(side_events)):
+        for session in events:
             for loc in session.location.all():
                 sessions_in_location[loc.pk].append(session)
             else:
@@ -2,7 +2,6 @@ import logging
 
 from django.conf import settings
 from django.contrib.markup.templatetags.markup import markdown
-from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.db import models
 from django.db.models import Q, signals as model_signals
@@ -17,12 +16,15 @@ from sortedm2m.fields import SortedManyToManyField
 from ..proposals import models as proposal_models
 from ..reviews import models as review_models
 from ..conference import models as conference_models
+from ..core import deferred
 
 from .exceptions import AttendingError
 
 
 LOG = logging.getLogger(__name__)
 
+SCHEDULE_CACHE_UPDATE_KEY = 'schedule.update_caches'
+
 
 EVENT_ICON_CHOICES = (
     ('coffee', _('Coffee cup')),
@@ -239,23 +241,88 @@ class CompleteSchedulePlugin(CMSPlugin):
 
 
 def clear_schedule_caches(sender, *args, **kwargs):
+    """
+    Invalidates every cached schedule structure by bumping the schedule
+    version all of them are bound to once the current request is done.
+    """
+    deferred.defer(SCHEDULE_CACHE_UPDATE_KEY, _update_schedule_caches, [None])
+
+
+def schedule_cache_warmup(version):
+    """
+    Triggers the background rebuild of all schedule variants for the given
+    schedule version.
+    """
+    if not settings.SCHEDULE_CACHE_WARMUP:
+        return
+    from .tasks import warm_schedule_caches
+    warm_schedule_caches.apply_async(
+        args=[version], countdown=settings.SCHEDULE_CACHE_WARMUP_COUNTDOWN)
+
+
+def update_schedule_caches(sender, instance, *args, **kwargs):
+    """
+    Instead of rebuilding every section schedule whenever a single event
+    changes, only the days of the cached section schedules that are affected
+    by the change are rebuilt and stored for the new schedule version.
+
+    All changes made while processing a request (e.g. saving an event and
+    its locations in the admin) are applied at once when it is done.
+    """
+    from . import utils
+    if kwargs.get('raw'):
+        # Fixtures are loaded event by event, so patching makes no sense.
+        clear_schedule_caches(sender)
+        return
+    deferred.defer(SCHEDULE_CACHE_UPDATE_KEY, _update_schedule_caches,
+                   [utils.get_schedule_change(instance)])
+
+
+def _update_schedule_caches(changes):
+    """
+    Bumps the schedule version and patches the cached section schedules of
+    the previous version with the given changes. None in changes stands for
+    a change that cannot be patched and invalidates all of them instead.
+    """
     from itertools import product
-    # We have to clear the cache for every section of the current conference as
-    # well as the global cache itself.
-    conf = conference_models.current_conference()
-    cache_keys = [
-        'schedule:guidebook:events'
-    ]
-    section_ids = list(conf.sections.values_list('id', flat=True)) + ['__merged__']
-    durations = dict(CompleteSchedulePlugin.ROW_DURATION_CHOICES).keys()
-    prod = product(section_ids, durations)
-    for sec, dur in prod:
-        cache_keys.append('schedule:{0}:{1}'.format(conf.pk, dur))
-        cache_keys.append('section_schedule:{0}:{1}'.format(sec, dur))
-    LOG.debug("Clearing following cache keys: " + unicode(cache_keys))
-    cache.delete_many(cache_keys)
-
-model_signals.post_save.connect(clear_schedule_caches, sender=SideEvent)
-model_signals.post_save.connect(clear_schedule_caches, sender=Session)
-model_signals.post_delete.connect(clear_schedule_caches, sender=SideEvent)
-model_signals.post_delete.connect(clear_schedule_caches, sender=Session)
+    from . import utils
+    previous_version = utils.get_schedule_version()
+    version = utils.bump_schedule_version()
+    LOG.debug("Bumped schedule version to {0}".format(version))
+    if version != previous_version + 1:
+        # Somebody else changed the schedule in the meantime, so the
+        # schedules cached for previous_version don't contain their changes.
+        LOG.debug("Schedule version {0} changed concurrently, not patching"
+                  .format(previous_version))
+    elif None not in changes:
+        conf = conference_models.current_conference()
+        durations = dict(CompleteSchedulePlugin.ROW_DURATION_CHOICES).keys()
+        sections = list(conf.sections.all()) + [None]
+        for section, dur in product(sections, durations):
+            utils.update_section_schedule(section, changes, row_duration=dur,
+                                          previous_version=previous_version,
+                                          version=version)
+    schedule_cache_warmup(version)
+
+
+def update_schedule_caches_on_location_change(sender, instance, action,
+                                              reverse, *args, **kwargs):
+    """
+    Locations are stored after the event itself has been saved (e.g. in the
+    admin), so changes to them have to be handled separately.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        clear_schedule_caches(sender)
+    else:
+        update_schedule_caches(sender, instance)
+
+model_signals.post_save.connect(update_schedule_caches, sender=SideEvent)
+model_signals.post_save.connect(update_schedule_caches, sender=Session)
+model_signals.post_delete.connect(update_schedule_caches, sender=SideEvent)
+model_signals.post_delete.connect(update_schedule_caches, sender=Session)
+model_signals.m2m_changed.connect(update_schedule_caches_on_location_change,
+                                  sender=SideEvent.location.through)
+model_signals.m2m_changed.connect(update_schedule_caches_on_location_change,
+                                  sender=Session.location.through)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+
+from pyconde.celery import app
+
+
+@app.task(ignore_result=True)
+def warm_schedule_caches(version):
+    """
+    Builds every variant of the schedule as well as the Guidebook and XML
+    exports for the given schedule version so that visitors never hit a cold cache
+    after an edit.
+
+    If the schedule version changed in the meantime, another edit happened
+    that comes with its own warmup task. This task is then skipped which
+    effectively debounces consecutive edits.
+    """
+    from . import exporters
+    from . import models
+    from . import utils
+
+    if not getattr(settings, 'SCHEDULE_CACHE_SCHEDULE', True):
+        return
+    if utils.get_schedule_version() != version:
+        return
+    for row_duration in dict(models.CompleteSchedulePlugin.ROW_DURATION_CHOICES):
+        for merge_sections in (False, True):
+            utils.create_schedule(row_duration=row_duration,
+                                  merge_sections=merge_sections)
+    for kind in exporters.GUIDEBOOK_EXPORTERS:
+        utils.create_guidebook_export(kind)
+    for kind in utils.XML_EXPORTERS:
+        for _ in utils.stream_xml_export(kind):
+            pass
@@ -2,18 +2,25 @@ import unittest
 import datetime
 from datetime import datetime as dt
 import logging
+import mock
 
 from django.contrib.auth.models import User
+from django.core.cache import get_cache
 from django.core.urlresolvers import reverse
+from django.db import models as django_models
 from django.test import TestCase
 
 from . import models
 from . import slides
+from . import tasks
 from . import utils
 from . import videos
 from . import exporters
 
 from ..accounts import models as account_models
+from ..conference import models as conference_models
+from ..core import deferred
+from ..core.metrics import MetricsBudgetMixin
 
 
 logging.disable(logging.CRITICAL)
@@ -25,6 +32,16 @@ class MockEvent(object):
         self.end = end
 
 
+class MockSideEvent(MockEvent):
+    def __init__(self, name, start, end, location, is_global=False):
+        super(MockSideEvent, self).__init__(start, end)
+        self.name = name
+        self.location = location
+        self.is_global = is_global
+        self.is_pause = False
+        self.icon = None
+
+
 class ScheduleGeneratorTests(unittest.TestCase):
     def test_number_of_rows_in_order(self):
         evts = [
@@ -80,6 +97,211 @@ class ScheduleGeneratorTests(unittest.TestCase):
         result = utils._strip_empty_rows(rows)
         self.assertEquals(0, len(result))
 
+    def test_padding_with_fillers(self):
+        room1 = conference_models.Location(pk=1, name='Room 1', order=1)
+        room2 = conference_models.Location(pk=2, name='Room 2', order=2)
+        evts = [
+            MockSideEvent('A', dt(2012, 6, 1, 10, 00), dt(2012, 6, 1, 11, 00), room1),
+            MockSideEvent('B', dt(2012, 6, 1, 10, 30), dt(2012, 6, 1, 11, 00), room2),
+        ]
+        rows = utils._create_section_days(evts, [room1, room2], 30)[0].rows
+        self.assertEquals(2, len(rows))
+        self.assertEquals(['A', None], [c.name for c in rows[0].cells])
+        self.assertTrue(rows[0].cells[1].is_empty)
+        self.assertEquals(2, rows[0].cells[0].rowspan)
+        self.assertTrue(rows[1].cells[0].is_filler)
+        self.assertFalse(rows[1].cells[0].is_empty)
+        self.assertEquals(['B'], [c.name for c in rows[1].get_renderable_cells()])
+
+    def test_overlapping_events_in_same_room(self):
+        room1 = conference_models.Location(pk=1, name='Room 1', order=1)
+        evts = [
+            MockSideEvent('A', dt(2012, 6, 1, 10, 00), dt(2012, 6, 1, 11, 00), room1),
+            MockSideEvent('B', dt(2012, 6, 1, 10, 30), dt(2012, 6, 1, 11, 00), room1),
+        ]
+        rows = utils._create_section_days(evts, [room1], 30)[0].rows
+        self.assertEquals(['A'], [c.name for c in rows[0].cells])
+        self.assertEquals(1, rows[0].cells[0].rowspan)
+        self.assertEquals(['B'], [c.name for c in rows[1].cells])
+        self.assertEquals(1, rows[1].cells[0].rowspan)
+
+
+class IncrementalScheduleUpdateTests(TestCase):
+
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        patcher = mock.patch.object(utils, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.section = models.Session.objects.filter(section__isnull=False)[0].section
+
+    def _flatten(self, section_schedule):
+        locations, days = section_schedule
+        return ([loc.pk for loc in locations],
+                [(day.day, day.active, [(row.start, [(cell.name, cell.rowspan, cell.colspan) for cell in row.cells]) for row in day.rows]) for day in days])
+
+    def _cached(self):
+        return self.cache.get(utils._get_section_schedule_cache_key(
+            self.section, 30, utils.get_schedule_version()))
+
+    def test_update_matches_full_rebuild(self):
+        utils.create_section_schedule(self.section, row_duration=30)
+        session = models.Session.objects.filter(section=self.section, released=True)[0]
+        session.title = 'Changed title'
+        session.save()
+        self.assertEqual(
+            self._flatten(utils.create_section_schedule(self.section, row_duration=30, uncached=True)),
+            self._flatten(self._cached()))
+
+    def test_update_after_delete(self):
+        utils.create_section_schedule(self.section, row_duration=30)
+        models.Session.objects.filter(section=self.section, released=True)[0].delete()
+        self.assertEqual(
+            self._flatten(utils.create_section_schedule(self.section, row_duration=30, uncached=True)),
+            self._flatten(self._cached()))
+
+    def test_updates_coalesced(self):
+        utils.create_section_schedule(self.section, row_duration=30)
+        version = utils.get_schedule_version()
+        sessions = models.Session.objects.filter(section=self.section, released=True)
+        with deferred.collect():
+            sessions[0].title = 'Changed title'
+            sessions[0].save()
+            sessions[0].location = sessions[1].location.all()
+            sessions[1].delete()
+            self.assertEqual(version, utils.get_schedule_version())
+        self.assertEqual(version + 1, utils.get_schedule_version())
+        self.assertEqual(
+            self._flatten(utils.create_section_schedule(self.section, row_duration=30, uncached=True)),
+            self._flatten(self._cached()))
+
+    def test_no_update_after_concurrent_change(self):
+        utils.create_section_schedule(self.section, row_duration=30)
+        version = utils.get_schedule_version()
+        with deferred.collect():
+            models.Session.objects.filter(section=self.section)[0].save()
+            utils.bump_schedule_version()
+        self.assertEqual(version + 2, utils.get_schedule_version())
+        self.assertIsNone(self._cached())
+
+    def test_update_without_cache(self):
+        session = models.Session.objects.filter(section=self.section)[0]
+        self.assertIsNone(utils.update_section_schedule(
+            self.section, [utils.get_schedule_change(session)]))
+
+
+class ScheduleSnapshotTests(TestCase):
+
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        patcher = mock.patch.object(utils, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_snapshot_contains_no_models(self):
+        schedule = utils.create_schedule(row_duration=30, uncached=True)
+        for section, (locations, days) in schedule.items():
+            self.assertIsInstance(section, utils.ScheduleSection)
+            for loc in locations:
+                self.assertIsInstance(loc, utils.ScheduleLocation)
+            for day in days:
+                for row in day['rows']:
+                    for cell in row['cells']:
+                        for value in cell.values():
+                            self.assertNotIsInstance(value, django_models.Model)
+
+    def test_version_bump_invalidates_snapshot(self):
+        cache_key = 'schedule:1:30:sections'
+        utils.create_schedule(row_duration=30, uncached=False)
+        version = utils.get_schedule_version()
+        self.assertEqual(version, self.cache.get(cache_key)[0])
+        self.assertEqual(version + 1, utils.bump_schedule_version())
+        utils.create_schedule(row_duration=30, uncached=False)
+        self.assertEqual(version + 1, self.cache.get(cache_key)[0])
+
+
+class VersionedCacheEntryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        patcher = mock.patch.object(utils, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rebuild_and_reuse(self):
+        build = mock.Mock(return_value='data')
+        self.assertEqual('data', utils.get_versioned_cache_entry('key', build))
+        self.assertEqual('data', utils.get_versioned_cache_entry('key', build))
+        build.assert_called_once_with(utils.get_schedule_version())
+
+    def test_serve_stale_while_locked(self):
+        utils.get_versioned_cache_entry('key', lambda version: 'old')
+        utils.bump_schedule_version()
+        self.cache.add('lock:key', 1)
+        build = mock.Mock(return_value='new')
+        self.assertEqual('old', utils.get_versioned_cache_entry('key', build))
+        self.assertFalse(build.called)
+
+    def test_rebuild_after_lock_release(self):
+        utils.get_versioned_cache_entry('key', lambda version: 'old')
+        utils.bump_schedule_version()
+        build = mock.Mock(return_value='new')
+        self.assertEqual('new', utils.get_versioned_cache_entry('key', build))
+        self.assertIsNone(self.cache.get('lock:key'))
+
+
+class WarmScheduleCachesTaskTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.cache.clear()
+        patcher = mock.patch.object(utils, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('pyconde.schedule.utils.stream_xml_export', return_value=[])
+    @mock.patch('pyconde.schedule.utils.create_guidebook_export')
+    @mock.patch('pyconde.schedule.utils.create_schedule')
+    def test_warm_all_variants(self, create_schedule, create_guidebook_export,
+                               stream_xml_export):
+        tasks.warm_schedule_caches(utils.get_schedule_version())
+        self.assertEqual(8, create_schedule.call_count)
+        self.assertEqual(len(exporters.GUIDEBOOK_EXPORTERS),
+                         create_guidebook_export.call_count)
+        self.assertEqual(len(utils.XML_EXPORTERS), stream_xml_export.call_count)
+
+    @mock.patch('pyconde.schedule.utils.create_schedule')
+    def test_skip_outdated_version(self, create_schedule):
+        version = utils.get_schedule_version()
+        utils.bump_schedule_version()
+        tasks.warm_schedule_caches(version)
+        self.assertFalse(create_schedule.called)
+
+
+class ScheduleViewBudgetTests(MetricsBudgetMixin, TestCase):
+
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def test_queries_independent_of_session_count(self):
+        url = reverse('schedule')
+        baseline = self.client.get(url).metrics
+        for session in models.Session.objects.prefetch_related('location', 'additional_speakers'):
+            locations = list(session.location.all())
+            session.pk = None
+            session.start += datetime.timedelta(days=1)
+            session.end += datetime.timedelta(days=1)
+            session.save()
+            session.location.add(*locations)
+            session.additional_speakers.add(session.speaker)
+        self.assertMetricsBudget(self.client.get(url), queries=baseline.queries)
+
 
 class SlideCodeGeneratorTests(unittest.TestCase):
     def test_prezi_match(self):
@@ -334,6 +556,92 @@ class AttendSessionTest(TestCase):
         self.client.logout()
 
 
+class XMLExporterTest(TestCase):
+
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def test_iter_chunked(self):
+        qs = models.Session.objects.order_by('-start', 'pk')
+        self.assertEqual(list(qs), list(exporters.iter_chunked(qs, chunk_size=3)))
+
+    def test_iter_chunked_skips_deleted(self):
+        qs = models.Session.objects.order_by('pk')
+        expected = list(qs)
+        deleted = expected.pop()
+        objs = exporters.iter_chunked(qs, chunk_size=3)
+        first = next(objs)
+        models.Session.objects.filter(pk=deleted.pk).delete()
+        self.assertEqual(expected, [first] + list(objs))
+
+    def test_merge_events(self):
+        sessions = models.Session.objects.filter(start__isnull=False, end__isnull=False) \
+                                         .order_by('start', 'end', 'pk')
+        side_events = models.SideEvent.objects.order_by('start', 'end', 'pk')
+        events = list(exporters.merge_events(sessions, side_events))
+        self.assertEqual(sessions.count() + side_events.count(), len(events))
+        self.assertEqual(sorted(events, key=lambda evt: (evt.start, evt.end)), events)
+
+    def test_stream_matches_export(self):
+        exporter = exporters.XMLExporterPentabarf()
+        self.assertEqual(exporter.export().getvalue(), b''.join(exporter.stream()))
+
+    def _patch_cache(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        cache.clear()
+        patcher = mock.patch.object(utils, 'cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return cache
+
+    def test_xml_export_view(self):
+        self._patch_cache()
+        url = reverse('schedule-xml-export')
+        content = b''.join(self.client.get(url).streaming_content)
+        self.assertTrue(content.startswith(b'<schedule'))
+        sessions = models.Session.objects.filter(released=True, start__isnull=False,
+                                                 end__isnull=False)
+        self.assertEqual(sessions.count() + models.SideEvent.objects.count(),
+                         content.count(b'<entry '))
+        # Further requests are served from the cache until the schedule changes
+        with self.assertNumQueries(0):
+            self.assertEqual(content, b''.join(
+                self.client.get(url).streaming_content))
+        utils.bump_schedule_version()
+        with mock.patch.object(exporters.XMLExporter, 'stream',
+                               return_value=iter([b'<schedule />'])):
+            self.assertEqual(b'<schedule />', b''.join(
+                self.client.get(url).streaming_content))
+
+    @mock.patch.object(utils, 'XML_EXPORT_BLOCK_SIZE', 1024)
+    def test_xml_export_cached_in_blocks(self):
+        cache = self._patch_cache()
+        content = b''.join(utils.stream_xml_export('pentabarf'))
+        key = 'schedule:xml:pentabarf:{0}'.format(utils.get_schedule_version())
+        num_blocks = cache.get(key)
+        self.assertTrue(num_blocks > 1)
+        self.assertEqual(content, b''.join(
+            cache.get('{0}:{1}'.format(key, idx)) for idx in range(num_blocks)))
+        # An evicted block is generated again
+        cache.delete('{0}:1'.format(key))
+        self.assertEqual(content, b''.join(utils.stream_xml_export('pentabarf')))
+
+
+class ScheduleExportDataTest(TestCase):
+
+    fixtures = ['example/users.json', 'example/proposal-and-schedule.json']
+
+    def test_shared_data(self):
+        data = exporters.ScheduleExportData()
+        self.assertTrue(data.sessions)
+        self.assertTrue(data.side_events)
+        self.assertTrue(data.domain)
+        with self.assertNumQueries(0):
+            exporters.GuidebookExporterSessions(data)()
+            exporters.GuidebookExporterSpeakers(data)()
+            exporters.GuidebookExporterLinks(data)()
+            exporters.SessionForEpisodesExporter(data)()
+
+
 class FrabExporterTest(TestCase):
     def test_calculate_event_duration(self):
         exporter = exporters.FrabExporter()
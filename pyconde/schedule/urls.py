@@ -16,4 +16,6 @@ urlpatterns = patterns('',
     url(r'^schedule/$', views.view_schedule, name='schedule'),
     url(r'^attendances/$', views.list_user_attendances, name='schedule-attendances'),
     url(r'^export/guidebook/(?P<kind>[^/.]+)/$', views.guidebook_export, name='guidebook-export'),
+    url(r'^export/schedule\.xml$', views.xml_export, name='schedule-xml-export'),
+    url(r'^export/pentabarf\.xml$', views.pentabarf_export, name='schedule-pentabarf-export'),
 )
@@ -2,12 +2,14 @@ import itertools
 import math
 import datetime
 import collections
+import time
 from django.conf import settings
 from django.utils.datastructures import SortedDict
 from django.utils.timezone import now
 
 from ..conference import models as conference_models
 
+from . import exporters
 from . import models
 
 from django.core.cache import cache
@@ -26,52 +28,410 @@ def proposal_is_scheduled(proposal):
     return proposal.pk in proposal_pks
 
 
+SCHEDULE_VERSION_CACHE_KEY = 'schedule:version'
+
+# The version counter has to outlive every versioned cache entry.
+SCHEDULE_VERSION_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
+# Maximum number of seconds a process may spend rebuilding a cached schedule
+# structure before others stop waiting for it.
+SCHEDULE_REBUILD_LOCK_TIMEOUT = 30
+
+SCHEDULE_REBUILD_POLL_INTERVAL = 0.1
+
+
+ScheduleSection = collections.namedtuple('ScheduleSection', 'pk name slug')
+
+ScheduleLocation = collections.namedtuple('ScheduleLocation', 'pk name')
+
+MERGED_SCHEDULE_SECTION = ScheduleSection(None, '', '')
+
+# A change of a single event: its key as used by GridCell.repr, the day it
+# now starts on (if any) and the pk of its section.
+ScheduleChange = collections.namedtuple('ScheduleChange', 'key day section_pk')
+
+
+def get_schedule_version(version=None):
+    """
+    Returns the current version of the schedule. Every cached schedule
+    structure is bound to this version so that bumping it invalidates all
+    of them at once.
+
+    If the counter is not available (anymore), it is initialized with the
+    current time in milliseconds so that it keeps increasing monotonically
+    even after it has been evicted from the cache.
+    """
+    if version is None:
+        version = cache.get(SCHEDULE_VERSION_CACHE_KEY)
+    if version is None:
+        version = int(time.time() * 1000)
+        cache.add(SCHEDULE_VERSION_CACHE_KEY, version,
+                  SCHEDULE_VERSION_CACHE_TIMEOUT)
+        version = cache.get(SCHEDULE_VERSION_CACHE_KEY, version)
+    return version
+
+
+def bump_schedule_version():
+    """
+    Increments the schedule version and returns the new one.
+    """
+    get_schedule_version()
+    try:
+        return cache.incr(SCHEDULE_VERSION_CACHE_KEY)
+    except ValueError:
+        # The counter vanished in the meantime (or the cache is a dummy).
+        return get_schedule_version()
+
+
+def get_versioned_cache_entry(cache_key, build):
+    """
+    Returns the value stored under cache_key for the current schedule
+    version. If the value is missing, outdated or older than
+    SCHEDULE_CACHE_TIMEOUT, it is rebuilt by calling build with the current
+    schedule version.
+
+    To protect the database from many processes rebuilding the same value in
+    parallel, only the process holding the rebuild lock does so. All others
+    keep serving the previous value for up to SCHEDULE_CACHE_STALE_TIMEOUT
+    seconds or wait for the rebuild to finish if there is none.
+    """
+    cached = cache.get_many([SCHEDULE_VERSION_CACHE_KEY, cache_key])
+    version = get_schedule_version(cached.get(SCHEDULE_VERSION_CACHE_KEY))
+    entry = cached.get(cache_key)
+    if entry and entry[0] == version and entry[1] > time.time():
+        return entry[2]
+
+    lock_key = 'lock:{0}'.format(cache_key)
+    locked = cache.add(lock_key, version, SCHEDULE_REBUILD_LOCK_TIMEOUT)
+    deadline = time.time() + SCHEDULE_REBUILD_LOCK_TIMEOUT
+    while not locked:
+        if entry:
+            return entry[2]
+        if time.time() > deadline:
+            # The rebuilding process seems to be stuck, so don't wait for it
+            # any longer.
+            break
+        time.sleep(SCHEDULE_REBUILD_POLL_INTERVAL)
+        entry = cache.get(cache_key)
+        locked = cache.add(lock_key, version, SCHEDULE_REBUILD_LOCK_TIMEOUT)
+    try:
+        data = build(version)
+        cache.set(cache_key,
+                  (version, time.time() + settings.SCHEDULE_CACHE_TIMEOUT, data),
+                  settings.SCHEDULE_CACHE_TIMEOUT + settings.SCHEDULE_CACHE_STALE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return data
+
+
 def create_schedule(row_duration=30, uncached=None, merge_sections=False):
     """
     Creates a schedule for each section of the conference.
 
+    The result is a compact snapshot (see create_schedule_snapshot) that is
+    stored once per schedule version and served with a single cache
+    request.
+
     @param row_duration duration represented by a row in minutes
     """
     if uncached is None:
         uncached = not getattr(settings, 'SCHEDULE_CACHE_SCHEDULE', True)
+    if uncached:
+        return _create_schedule(row_duration, merge_sections, uncached=True)
     conf = conference_models.current_conference()
-    cache_key = 'schedule:{0}:{1}'.format(conf.pk, row_duration)
-    if not uncached:
-        result = cache.get(cache_key)
-        if result:
-            return result
+    cache_key = 'schedule:{0}:{1}:{2}'.format(
+        conf.pk, row_duration, 'merged' if merge_sections else 'sections')
+    return get_versioned_cache_entry(cache_key, lambda version: _create_schedule(
+        row_duration, merge_sections, version=version))
+
+
+def _create_schedule(row_duration, merge_sections, uncached=False, version=None):
     result = SortedDict()
     if merge_sections:
         section_schedule = create_section_schedule(None,
-            row_duration=row_duration, uncached=uncached)
-        result['merged'] = section_schedule
+            row_duration=row_duration, uncached=uncached, version=version)
+        result[MERGED_SCHEDULE_SECTION] = section_schedule
     else:
         for section in conference_models.Section.objects.order_by('order', 'start_date').all():
             section_schedule = create_section_schedule(section,
-                row_duration=row_duration, uncached=uncached)
+                row_duration=row_duration, uncached=uncached, version=version)
+            result[ScheduleSection(section.pk, section.name, section.slug)] = section_schedule
+    return create_schedule_snapshot(result)
+
+
+def create_guidebook_export(kind):
+    """
+    Returns the CSV data of the Guidebook exporter registered for the given
+    kind for the current schedule version.
+    """
+    exporter_class = exporters.GUIDEBOOK_EXPORTERS[kind]
+    return get_versioned_cache_entry('schedule:guidebook:{0}'.format(kind),
+                                     lambda version: exporter_class()().csv)
+
+
+XML_EXPORTERS = {
+    'schedule': lambda: exporters.XMLExporter(None),
+    'pentabarf': exporters.XMLExporterPentabarf,
+}
+
+
+# Size in bytes of the blocks an XML export is stored in the cache with.
+XML_EXPORT_BLOCK_SIZE = 64 * 1024
+
+
+def stream_xml_export(kind):
+    """
+    Yields the XML document of the given kind (see XML_EXPORTERS) for the
+    current schedule version in chunks.
+
+    The first request after a schedule change streams the document while
+    it is generated and stores it in blocks of XML_EXPORT_BLOCK_SIZE bytes
+    in the cache as they are complete. Later requests stream these blocks
+    one at a time. Neither ever holds the whole document in memory.
+    """
+    version = get_schedule_version()
+    key = 'schedule:xml:{0}:{1}'.format(kind, version)
+    num_blocks = cache.get(key)
+    if num_blocks is None:
+        return _stream_and_cache_xml_export(kind, key)
+    return _stream_cached_xml_export(kind, key, num_blocks)
+
+
+def _stream_and_cache_xml_export(kind, key):
+    block = []
+    block_size = 0
+    num_blocks = 0
+    for chunk in XML_EXPORTERS[kind]().stream():
+        yield chunk
+        block.append(chunk)
+        block_size += len(chunk)
+        if block_size >= XML_EXPORT_BLOCK_SIZE:
+            cache.set('{0}:{1}'.format(key, num_blocks), b''.join(block),
+                      settings.SCHEDULE_CACHE_TIMEOUT)
+            num_blocks += 1
+            block = []
+            block_size = 0
+    if block:
+        cache.set('{0}:{1}'.format(key, num_blocks), b''.join(block),
+                  settings.SCHEDULE_CACHE_TIMEOUT)
+        num_blocks += 1
+    # Only a complete document is served from the cache.
+    cache.set(key, num_blocks, settings.SCHEDULE_CACHE_TIMEOUT)
+
+
+def _stream_cached_xml_export(kind, key, num_blocks):
+    sent = 0
+    for idx in range(num_blocks):
+        block = cache.get('{0}:{1}'.format(key, idx))
+        if block is None:
+            break
+        yield block
+        sent += len(block)
+    else:
+        return
+    # A block has been evicted in the meantime. The document is generated
+    # again and streamed from where the cached blocks ended.
+    for chunk in XML_EXPORTERS[kind]().stream():
+        if sent >= len(chunk):
+            sent -= len(chunk)
+            continue
+        yield chunk[sent:]
+        sent = 0
+
+
+def create_schedule_snapshot(schedule):
+    """
+    Converts a schedule consisting of GridRows and GridCells into plain
+    tuples and dicts that only contain the data needed by the schedule
+    templates. This keeps the cached structure small and avoids unpickling
+    model instances on every request.
+    """
+    result = SortedDict()
+    for section, section_schedule in schedule.iteritems():
+        if not section_schedule:
             result[section] = section_schedule
-    if not uncached:
-        cache.set(cache_key, result, settings.SCHEDULE_CACHE_TIMEOUT)
+            continue
+        locations, days = section_schedule
+        result[section] = (
+            [ScheduleLocation(loc.pk, loc.name) for loc in locations],
+            [{
+                'day': day.day,
+                'active': day.active,
+                'rows': [{
+                    'start': row.start,
+                    'end': row.end,
+                    'is_pause': row.is_pause_row(),
+                    'cells': [_create_cell_snapshot(cell) for cell in row.get_renderable_cells()],
+                } for row in day.rows],
+            } for day in days]
+        )
     return result
 
 
-def create_section_schedule(section, row_duration=30, uncached=False):
+def _create_cell_snapshot(cell):
+    locations = cell.location or []
+    if isinstance(locations, conference_models.Location):
+        locations = [locations]
+    return {
+        'type': cell.type,
+        'name': cell.name,
+        'url': cell.url,
+        'icon': cell.icon,
+        'session_kind': cell.session_kind,
+        'speakers': cell.speakers,
+        'start': cell.start,
+        'end': cell.end,
+        'location': [ScheduleLocation(loc.pk, loc.name) for loc in locations],
+        'level': cell.level,
+        'level_name': cell.level_name,
+        'language': cell.language,
+        'is_global': cell.is_global,
+        'is_pause': cell.is_pause,
+        'is_empty': cell.is_empty,
+        'rowspan': cell.rowspan,
+        'colspan': cell.colspan,
+    }
+
+
+def create_section_schedule(section, row_duration=30, uncached=False, version=None):
     """
     Creates a schedule for a given section.
 
     @param section section for which the schedule should be generated.
     @param row_duration number of minutes a single row should represent
+    @param version schedule version the cached result should be bound to
     """
-    if section is None:
-        schedule_cache_key = 'section_schedule:__merged__:{0}'.format(row_duration)
-    else:
-        schedule_cache_key = 'section_schedule:{0}:{1}'.format(section.pk, row_duration)
-
     if not uncached:
+        version = get_schedule_version(version)
+        schedule_cache_key = _get_section_schedule_cache_key(section, row_duration, version)
         section_schedule = cache.get(schedule_cache_key)
         if section_schedule:
             return section_schedule
 
+    sessions, side_events = _get_section_events(section)
+    locations = _get_event_locations(sessions, side_events)
+
+    # This allows overriding sessions (e.g. posters) with side events in the
+    # schedule table but still have them listed in the general lists.
+    events = sorted(itertools.chain(sessions, side_events),
+        cmp=_evt_start_cmp)
+
+    if not events:
+        return {}
+
+    days = _create_section_days(events, locations, row_duration)
+    _mark_active_day(days)
+
+    if not uncached:
+        cache.set(schedule_cache_key, (locations, days), settings.SCHEDULE_CACHE_TIMEOUT)
+    return (locations, days)
+
+
+def update_section_schedule(section, changes, row_duration=30,
+                            previous_version=None, version=None):
+    """
+    Patches the cached schedule of a section after some events have been
+    changed or deleted. Only the days the events were or are now part of
+    are rebuilt. If the set of locations of the section changed or the
+    affected days cannot be rebuilt independently of their neighbours (e.g.
+    events that last past midnight), the whole section schedule is rebuilt
+    instead.
+
+    The schedule cached for previous_version is read and the result is
+    stored for version. If there is no cached schedule for the given
+    section, nothing is done and the schedule is created on the next
+    request.
+
+    @param section section whose schedule should be patched or None for the
+        merged schedule
+    @param changes ScheduleChange instances of the changed events (see
+        get_schedule_change)
+    @param row_duration number of minutes a single row should represent
+    @param previous_version schedule version the event changes are based on
+    @param version schedule version the patched schedule belongs to
+    """
+    version = get_schedule_version(version)
+    if previous_version is None:
+        previous_version = version
+    section_schedule = cache.get(_get_section_schedule_cache_key(
+        section, row_duration, previous_version))
+    if not section_schedule:
+        return None
+    locations, days = section_schedule
+    schedule_cache_key = _get_section_schedule_cache_key(section, row_duration, version)
+
+    event_keys = set(change.key for change in changes)
+    affected_days = set(day.day for day in days
+                        if any(_day_contains_event(day, event_key)
+                               for event_key in event_keys))
+    for change in changes:
+        if change.day is not None and (section is None or
+                                       change.section_pk == section.pk):
+            affected_days.add(change.day)
+    if not affected_days:
+        cache.set(schedule_cache_key, section_schedule, settings.SCHEDULE_CACHE_TIMEOUT)
+        return section_schedule
+
+    sessions, side_events = _get_section_events(section)
+    location_pks = _get_event_location_pks(sessions, side_events)
+    if location_pks != set(loc.pk for loc in locations) or \
+            not _days_are_self_contained(days):
+        return create_section_schedule(section, row_duration=row_duration, version=version)
+
+    days = [day for day in days if day.day not in affected_days]
+    for day in affected_days:
+        day_range = (datetime.datetime.combine(day, datetime.time.min),
+                     datetime.datetime.combine(day, datetime.time.max))
+        events = sorted(itertools.chain(sessions.filter(start__range=day_range),
+                                        side_events.filter(start__range=day_range)),
+                        cmp=_evt_start_cmp)
+        if not events:
+            continue
+        new_days = _create_section_days(events, locations, row_duration)
+        if [d.day for d in new_days] != [day] or \
+                not _days_are_self_contained(new_days):
+            return create_section_schedule(section, row_duration=row_duration, version=version)
+        days.extend(new_days)
+
+    if not days:
+        return {}
+
+    days.sort(key=lambda d: d.day)
+    _mark_active_day(days)
+    cache.set(schedule_cache_key, (locations, days), settings.SCHEDULE_CACHE_TIMEOUT)
+    return (locations, days)
+
+
+def _get_section_schedule_cache_key(section, row_duration, version):
+    if section is None:
+        return 'section_schedule:{0}:__merged__:{1}'.format(version, row_duration)
+    return 'section_schedule:{0}:{1}:{2}'.format(version, section.pk, row_duration)
+
+
+def get_schedule_change(event):
+    """
+    Returns the ScheduleChange describing the given session or side event
+    as it is now. This has to be called before a deleted event loses its
+    primary key.
+    """
+    day = event.start.date() if event.start is not None else None
+    return ScheduleChange(_get_event_key(event), day, event.section_id)
+
+
+def _get_event_key(event):
+    """
+    Returns the identifier of an event as it is also used by GridCell.repr.
+    """
+    type_ = 'session' if isinstance(event, models.Session) else 'side'
+    return '{0}:{1}'.format(type_, event.pk)
+
+
+def _get_section_events(section):
+    """
+    Returns the querysets of all sessions and side events that should be
+    included in the schedule of the given section.
+    """
     if section is None:
         sessions = models.Session.objects
         side_events = models.SideEvent.objects
@@ -93,42 +453,57 @@ def create_section_schedule(section, row_duration=30, uncached=False):
                              .filter(start__isnull=False, end__isnull=False) \
                              .order_by('start') \
                              .all()
+    return sessions, side_events
 
-    evt_cache = {}
 
+def _get_event_locations(sessions, side_events):
+    """
+    Returns all locations used by non-global events ordered by their order
+    attribute.
+    """
     locations = set()
-    start_time = None
-    end_time = None
     for session in sessions:
-        start_time = session.start if start_time is None else min(start_time, session.start)
-        end_time = session.end if end_time is None else max(end_time, session.end)
         if session.is_global:
             continue
         locations |= set(session.location.all())
     for evt in side_events:
-        start_time = evt.start if start_time is None else min(start_time, evt.start)
-        end_time = evt.end if end_time is None else max(end_time, evt.end)
         # Global events span all session locations and therefor the location
         # should not be included in the columns list
         if evt.is_global:
             continue
         locations |= set(evt.location.all())
-    locations = sorted(locations, cmp=lambda a, b: a.order - b.order)
+    return sorted(locations, cmp=lambda a, b: a.order - b.order)
 
-    # This allows overriding sessions (e.g. posters) with side events in the
-    # schedule table but still have them listed in the general lists.
-    events = sorted(itertools.chain(sessions, side_events),
-        cmp=_evt_start_cmp)
 
-    if not events:
-        return {}
+def _get_event_location_pks(sessions, side_events):
+    """
+    Returns the primary keys of all locations used by non-global events
+    without loading the events themselves.
+    """
+    pks = set()
+    for qs in (sessions, side_events):
+        pks |= set(qs.prefetch_related(None)
+                     .filter(is_global=False)
+                     .order_by()
+                     .values_list('location', flat=True)
+                     .distinct())
+    pks.discard(None)
+    return pks
+
+
+def _create_section_days(events, locations, row_duration):
+    """
+    Creates the list of SectionDays for the given events sorted by their
+    start time.
+    """
+    start_time = min(evt.start for evt in events)
+    end_time = max(evt.end for evt in events)
 
     # As a first step we build a grid with the respective row start time as
     # key and fill it with events starting at that time.
     grid = _create_base_grid(start_time, end_time, row_duration)
     for evt in events:
         cell = GridCell(evt, int((evt.end - evt.start).total_seconds() / (row_duration * 60)))
-        evt_cache[repr(cell)] = cell
         grid[evt.start].append(cell)
 
     # Convert this grid into a list of grid rows sorted by the row's start time.
@@ -136,14 +511,13 @@ def create_section_schedule(section, row_duration=30, uncached=False):
     for k, v in grid.iteritems():
         new_grid.append(GridRow(k, k + datetime.timedelta(0, row_duration * 60), v))
     new_grid.sort(cmp=lambda a, b: cmp(a.start, b.start))
+    _pad_rows_for_locations(new_grid, locations)
 
     # Split the whole section grid into days
     current_day = None
     days = []
     prev_row = None
     for row in new_grid:
-        _pad_row_for_locations(row, prev_row, locations)
-
         if current_day is None:
             current_day = SectionDay(row.start.date(), [])
         elif current_day.day < row.start.date():
@@ -163,18 +537,45 @@ def create_section_schedule(section, row_duration=30, uncached=False):
     if current_day and current_day.rows:
         days.append(current_day)
     # Strip out heading and tailing empty rows
-    has_active = False
     for day in days:
         day.rows = _strip_empty_rows(day.rows)
         day.rows = _merge_adjacent_row_cells(day.rows)
+    return days
+
+
+def _mark_active_day(days):
+    """
+    Marks the current day as active or, if the schedule doesn't contain
+    the current day, the first one.
+    """
+    has_active = False
+    for day in days:
+        day.active = (day.day == now().date())
         if day.active:
             has_active = True
     if days and not has_active:
         days[0].active = True
 
-    if not uncached:
-        cache.set(schedule_cache_key, (locations, days), settings.SCHEDULE_CACHE_TIMEOUT)
-    return (locations, days)
+
+def _day_contains_event(day, event_key):
+    for row in day.rows:
+        for cell in row.cells:
+            if cell.event is not None and cell.repr() == event_key:
+                return True
+    return False
+
+
+def _days_are_self_contained(days):
+    """
+    Checks that no cell of a day refers to an event that started on a
+    different day. Otherwise the days cannot be rebuilt individually.
+    """
+    for day in days:
+        for row in day.rows:
+            for cell in row.cells:
+                if cell.event is not None and cell.start.date() != day.day:
+                    return False
+    return True
 
 
 class GridRow(object):
@@ -185,11 +586,14 @@ class GridRow(object):
         self.pause = None
         self.pause_until = None
         self.event_by_location = {}
+        self.locations_by_cell = {}
         self.cells = events
         for evt in events:
-            if not evt.event or not evt.event.location:
+            if not evt.event or not evt.location:
+                self.locations_by_cell[evt] = []
                 continue
-            for loc in evt.event.location.all():
+            self.locations_by_cell[evt] = evt.location
+            for loc in evt.location:
                 self.event_by_location[loc] = evt
 
     def is_pause_row(self):
@@ -260,7 +664,7 @@ class GridCell(object):
         if isinstance(self.location, conference_models.Location):
             self.location = [self.location]
         elif hasattr(self.location, 'all'):
-            self.location = self.location.all()
+            self.location = list(self.location.all())
         self.event = None
         self.type = None
         self.session_kind = None
@@ -308,8 +712,7 @@ class GridCell(object):
     __repr__ = __str__
 
     def repr(self):
-        type_ = 'session' if isinstance(self.event, models.Session) else 'side'
-        return '{0}:{1}'.format(type_, self.event.pk)
+        return _get_event_key(self.event)
 
 
 class SectionDay(object):
@@ -374,29 +777,43 @@ def _strip_empty_rows(rows):
     return rows[first_idx_with_events:last_idx_with_events + 1]
 
 
-def _pad_row_for_locations(row, prev_row, locations):
+def _pad_rows_for_locations(rows, locations):
     """
     Make sure that "empty" rooms are also included in the grid as such.
-    This has to take into account if a talk in the same room in the
-    previous row actually requires a row-span. If it does, *this* row
-    must not be empty, otherwise it has to include an empty cell.
+
+    This is done in a single sweep over all rows that keeps track of the
+    cell currently occupying each location and the last row it spans. If
+    a location is still occupied by a cell from a previous row, *this* row
+    gets a filler for it, otherwise it gets an empty cell.
+
+    If an event starts in a location that is still occupied by another
+    event, the rowspan of the earlier event is cut short so that it ends
+    right before the new one. Otherwise the table would end up with a
+    column overhang.
     """
-    if row.contains_global:
-        return
-    for location in locations:
-        if location not in row.event_by_location:
-            # Let's check the previous row if it exists. We also have to take
-            # global events into account
-            prev_event = prev_row.event_by_location.get(location, None) if prev_row else None
-            if prev_event is None and prev_row is not None and prev_row.is_global_row():
-                prev_event = prev_row.events[0]
-
-            if prev_event is None or prev_event.is_empty:
-                filler = GridCell(None, 1)
-            elif prev_event.end <= row.start:
-                filler = GridCell(None, 1)
+    # location -> [cell, index of the first row, index of the last row]
+    occupants = {}
+    for idx, row in enumerate(rows):
+        for cell in row.events:
+            last_idx = idx + max(cell.rowspan, 1) - 1
+            cell_locations = locations if cell.is_global else row.locations_by_cell[cell]
+            for location in cell_locations:
+                occupant = occupants.get(location)
+                if occupant is not None and occupant[0] is not cell and \
+                        occupant[1] < idx <= occupant[2]:
+                    _end_occupation(occupants, occupant, idx)
+                occupants[location] = [cell, idx, last_idx]
+
+        if row.contains_global:
+            continue
+        for location in locations:
+            if location in row.event_by_location:
+                continue
+            occupant = occupants.get(location)
+            if occupant is not None and occupant[2] >= idx:
+                filler = GridCell(occupant[0], 1)
             else:
-                filler = GridCell(prev_event, 1)
+                filler = GridCell(None, 1)
             if not filler.start:
                 filler.start = row.start
             if not filler.end:
@@ -404,26 +821,28 @@ def _pad_row_for_locations(row, prev_row, locations):
             filler.location = location
             filler.is_filler = True
             row.event_by_location[location] = filler
-    row.reorder_by_location(locations)
+        row.reorder_by_location(locations)
 
 
-def _merge_adjacent_row_cells(rows):
+def _end_occupation(occupants, occupant, idx):
     """
-    Combines adjacent cells in the same row iff they belong to the same event.
-
-    .. warning::
-
-        This function cannot handle overlapping events in the same room, eg.
-
-            A A
-            A B
+    Shortens the rowspan of the occupant's cell so that it ends right before
+    the row with the given index and releases all locations it occupies.
+    """
+    cell = occupant[0]
+    cell.rowspan = idx - occupant[1]
+    for other in occupants.itervalues():
+        if other[0] is cell:
+            other[2] = idx - 1
 
-        will result in
 
-            A A
-            A A B
+def _merge_adjacent_row_cells(rows):
+    """
+    Combines adjacent cells in the same row iff they belong to the same event.
 
-        meaning, there is a table column overhang.
+    Overlapping events in the same room are resolved while padding the rows
+    (see _pad_rows_for_locations), so they cannot cause a column overhang
+    here.
     """
     for ridx, row in enumerate(rows):
         if len(row) < 1:
@@ -3,10 +3,9 @@
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.http import (HttpResponseRedirect, HttpResponse,
-    HttpResponseBadRequest)
+    HttpResponseBadRequest, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
 from django.utils.timezone import now
@@ -232,23 +231,27 @@ def guidebook_export(request, kind):
     if not request.user.has_perm('accounts.export_guidebook'):
         raise PermissionDenied
 
-    exporter_classes = {
-        # 'sections': exporters.GuidebookExporterSections,
-        'sessions': exporters.GuidebookExporterSessions,
-        'speakers': exporters.GuidebookExporterSpeakers,
-        'links': exporters.GuidebookExporterLinks,
-        # 'sponsors': exporters.GuidebookExporterSponsors,
-    }
-
-    exporter_class = exporter_classes.get(kind, None)
-    if exporter_class is None:
+    if kind not in exporters.GUIDEBOOK_EXPORTERS:
         return HttpResponseBadRequest('Invalid exporter %s' % kind)
 
-    cache_key = 'schedule:guidebook:%s' % kind
-    data = cache.get(cache_key, None)
-    if not data:
-        data = exporter_class()().csv
-        cache.set(cache_key, data)
+    data = utils.create_guidebook_export(kind)
     response = HttpResponse(data, content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="%s.csv"' % kind
     return response
+
+
+def xml_export(request):
+    """
+    Streams the complete schedule as XML while it is being generated or
+    read from the cache.
+    """
+    return StreamingHttpResponse(utils.stream_xml_export('schedule'),
+                                 content_type='application/xml')
+
+
+def pentabarf_export(request):
+    """
+    Streams the talks and recordable side events as Pentabarf xCal.
+    """
+    return StreamingHttpResponse(utils.stream_xml_export('pentabarf'),
+                                 content_type='application/xml')
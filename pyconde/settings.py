@@ -1,3 +1,4 @@
+import datetime
 import os
 
 from email.utils import parseaddr
@@ -141,6 +142,8 @@ class Base(Configuration):
     ]
 
     MIDDLEWARE_CLASSES = [
+        'pyconde.core.middleware.RequestMetricsMiddleware',
+        'pyconde.core.middleware.DeferredCallsMiddleware',
         'django.middleware.common.CommonMiddleware',
         'django.contrib.sessions.middleware.SessionMiddleware',
         'django.middleware.csrf.CsrfViewMiddleware',
@@ -196,6 +199,10 @@ class Base(Configuration):
 
     DEBUG_TOOLBAR_CONFIG = {'INTERCEPT_REDIRECTS': False}
 
+    # Record SQL queries, timing and cache lookups per request. Exposed as
+    # response headers in debug mode and logged otherwise.
+    REQUEST_METRICS = values.BooleanValue(True)
+
     @property
     def TEMPLATE_DEBUG(self):
         return self.DEBUG
@@ -348,6 +355,13 @@ class Base(Configuration):
     SCHEDULE_ATTENDING_POSSIBLE = values.ListValue(['training'])
     SCHEDULE_CACHE_SCHEDULE = values.BooleanValue(True)
     SCHEDULE_CACHE_TIMEOUT = values.IntegerValue(300)
+    # Number of seconds an outdated schedule is still served while it is
+    # being rebuilt by another process.
+    SCHEDULE_CACHE_STALE_TIMEOUT = values.IntegerValue(3600)
+    # Rebuild all schedule variants in the background after an edit. Edits
+    # within the countdown (in seconds) are handled by a single rebuild.
+    SCHEDULE_CACHE_WARMUP = values.BooleanValue(True)
+    SCHEDULE_CACHE_WARMUP_COUNTDOWN = values.IntegerValue(10)
 
 
     ###########################################################################
@@ -491,16 +505,31 @@ class Base(Configuration):
 
     PURCHASE_INVOICE_NUMBER_FORMAT = values.Value('INVOICE-{0:d}')
 
+    PURCHASE_INVOICE_RENDER_BATCH_SIZE = values.IntegerValue(50)
+
     PURCHASE_INVOICE_ROOT = values.Value()  # absolute path on the filesystem
 
     PURCHASE_INVOICE_TEMPLATE_PATH = values.Value()  # absolute path to invoice template
 
+    PURCHASE_MAIL_BATCH_SIZE = values.IntegerValue(100)
+
     # Mapping from logo name (key, e.g. 'logo' or 'vbb') to the image file path
     ATTENDEES_BADGE_LOGOS = values.DictValue({})
 
+    # Key used to sign the checkin snapshots shared with the desk clients.
+    # Falls back to SECRET_KEY.
+    CHECKIN_SNAPSHOT_KEY = values.Value(None)
+
+    # Seconds by which consecutive checkin deltas overlap. Has to exceed the
+    # duration of any transaction changing tickets.
+    CHECKIN_SNAPSHOT_OVERLAP = values.IntegerValue(300)
+
+    # Number of badges rendered by a single Celery task.
+    CHECKIN_BADGE_RENDER_BATCH_SIZE = values.IntegerValue(50)
+
     CACHES = values.DictValue({
         'default': {
-            'BACKEND': 'redis_cache.cache.RedisCache',
+            'BACKEND': 'pyconde.core.cache.RedisCache',
             'LOCATION': 'localhost:6379:0',
             'OPTIONS': {
                 'PARSER_CLASS': 'redis.connection.HiredisParser'
@@ -510,6 +539,16 @@ class Base(Configuration):
 
     BROKER_URL = values.Value('redis://localhost:6379/0')
 
+    # Periodic tasks run by "celery beat"
+    CELERYBEAT_SCHEDULE = {
+        # Checkouts that were given up still hold their ticket reservations
+        # until these are released.
+        'release-expired-ticket-reservations': {
+            'task': 'pyconde.attendees.tasks.release_expired_reservations',
+            'schedule': datetime.timedelta(minutes=5),
+        },
+    }
+
     LOCALE_PATHS = (
         os.path.join(BASE_DIR, PROJECT_NAME, 'locale'),
     )
@@ -595,6 +634,7 @@ class Testing(Dev):
 
     CELERY_ALWAYS_EAGER = True
     PURCHASE_INVOICE_DISABLE_RENDERING = True
+    SCHEDULE_CACHE_WARMUP = False
 
 
 class Staging(Base):
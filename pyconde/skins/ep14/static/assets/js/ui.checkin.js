@@ -21,11 +21,57 @@
             }
         });
         new_form.insertBefore(extra_ticket_holder);
+        initUserAutocomplete($('.user-autocomplete', new_form));
         $('#id_form-TOTAL_FORMS').val(total + 1);
     }
 
+    function initUserAutocomplete(elements) {
+        if (!($.ui && $.ui.autocomplete)) {
+            return;
+        }
+        elements.each(function() {
+            var hidden = $('input[type=hidden]', this);
+            var input = $('.user-autocomplete-input', this);
+            var page = 1;
+            input.autocomplete({
+                minLength: 2,
+                source: function(request, response) {
+                    $.getJSON(input.data('source'), {term: request.term, page: page}, function(data) {
+                        var items = data.results;
+                        if (page > 1) {
+                            items.unshift({label: '\u2026', value: null, page: page - 1});
+                        }
+                        if (data.more) {
+                            items.push({label: '\u2026', value: null, page: page + 1});
+                        }
+                        page = 1;
+                        response(items);
+                    });
+                },
+                focus: function(event) {
+                    event.preventDefault();
+                },
+                select: function(event, ui) {
+                    event.preventDefault();
+                    if (ui.item.page) {
+                        page = ui.item.page;
+                        input.autocomplete('search');
+                        return;
+                    }
+                    input.val(ui.item.label);
+                    hidden.val(ui.item.value);
+                }
+            }).on('change', function() {
+                if (input.val() === '') {
+                    hidden.val('');
+                }
+            });
+        });
+    }
+
     function init() {
         $('#add-ticket').on('click', addTicket);
+        initUserAutocomplete($('.user-autocomplete').not('#extra-ticket .user-autocomplete'));
     }
     init();
 })(jQuery);